@@ -0,0 +1,139 @@
+"""Concurrency stress test for RideRequest.accept.
+
+Creates a ride and one pending request per thread, then has every
+thread accept its request at the same moment. Fails (exit status 1) if
+the ride ends up with more riders than its capacity, if its
+riders_count disagrees with the riders table, or if the number of
+accepted requests doesn't match the seats available.
+
+Usage:
+    $ source .flaskenv
+    $ python bench/accept_stress.py [--threads 200] [--capacity 4]
+
+The rows it creates are deleted afterwards, but the script should still
+be pointed at a development database, never at production.
+"""
+
+# ----------------------------------------------------------------------
+
+import argparse
+import os
+import sys
+import threading
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from tigertaxi import create_app  # noqa: E402
+from tigertaxi.extensions import db  # noqa: E402
+from tigertaxi.models import (  # noqa: E402
+    Ride,
+    Rider,
+    RideRequest,
+    User,
+)
+
+# ----------------------------------------------------------------------
+
+
+def main() -> None:
+    """Runs the stress test and reports the outcome of each accept."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--threads", type=int, default=200)
+    parser.add_argument("--capacity", type=int, default=4)
+    args = parser.parse_args()
+
+    app = create_app()
+    tag = uuid.uuid4().hex[:8]
+
+    with app.app_context():
+        users = [
+            User(
+                netid=f"stress-{tag}-{i}",
+                email=f"stress-{tag}-{i}@example.com",
+                disp_name=f"Stress {i}",
+            )
+            for i in range(args.threads + 1)
+        ]
+        db.session.add_all(users)
+        db.session.commit()
+
+        ride = Ride(
+            creator_id=users[0].id,
+            capacity=args.capacity,
+            origin="Princeton",
+            destination=f"Stress Test {tag}",
+            departure_datetime=datetime.utcnow() + timedelta(days=1),
+        )
+        ride.save()
+        ride_id = ride.id
+
+        ride_requests = [
+            RideRequest(ride_id=ride_id, user_id=user.id)
+            for user in users[1:]
+        ]
+        db.session.add_all(ride_requests)
+        db.session.commit()
+        request_ids = [
+            ride_request.id for ride_request in ride_requests
+        ]
+        user_ids = [user.id for user in users]
+
+    barrier = threading.Barrier(args.threads)
+    outcomes: List[str] = []
+    lock = threading.Lock()
+
+    def accept(request_id: int) -> None:
+        with app.app_context():
+            ride_request = RideRequest.query.get(request_id)
+            barrier.wait()
+            try:
+                outcome = ride_request.accept().value
+            except Exception as error:
+                db.session.rollback()
+                outcome = f"error: {type(error).__name__}"
+            finally:
+                db.session.remove()
+            with lock:
+                outcomes.append(outcome)
+
+    threads = [
+        threading.Thread(target=accept, args=(request_id,))
+        for request_id in request_ids
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    with app.app_context():
+        ride = Ride.query.get(ride_id)
+        riders = Rider.query.where(Rider.ride_id == ride_id).count()
+        stored = ride.riders_count
+
+        # Clean up
+        Rider.query.where(Rider.ride_id == ride_id).delete()
+        RideRequest.query.where(RideRequest.ride_id == ride_id).delete()
+        Ride.query.where(Ride.id == ride_id).delete()
+        User.query.where(User.id.in_(user_ids)).delete()
+        db.session.commit()
+
+    print("Outcomes:", dict(Counter(outcomes)))
+    print(
+        f"Riders: {riders} (riders_count {stored}), capacity"
+        f" {args.capacity}"
+    )
+
+    seats = args.capacity - 1
+    accepted = outcomes.count("accepted")
+    if riders > args.capacity or stored != riders or accepted != seats:
+        print("FAILED")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
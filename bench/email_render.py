@@ -0,0 +1,108 @@
+"""Rendering benchmark for notification emails.
+
+Compares the per-message cost of building the "request accepted" email
+body the way endpoints used to (an inline str.format call with escape()
+and url_for() for every message) against rendering the compiled
+emails/request_accepted.html template in batches with
+emails.render_emails(). No database or mail server is needed.
+
+Usage:
+    $ source .flaskenv
+    $ python bench/email_render.py [--messages 1000] [--repeat 5]
+"""
+
+# ----------------------------------------------------------------------
+
+import argparse
+import os
+import sys
+import timeit
+from datetime import datetime, timedelta
+from html import escape
+
+from flask import url_for
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from tigertaxi import create_app  # noqa: E402
+from tigertaxi.emails import render_emails  # noqa: E402
+from tigertaxi.models import Ride  # noqa: E402
+
+# ----------------------------------------------------------------------
+
+
+def render_inline(name: str, ride: Ride) -> str:
+    """Builds the email body as endpoints.ride_request_accept used
+    to."""
+    return (
+        """
+        <style>p {{margin-bottom: 2rem;}}</style>
+        <p>Hello {},</p>
+        <p>You've been accepted to ride from {} to {} on {}.
+        <a href=\"{}\">Click here</a> to manage
+        your accepted request.</p>
+        <p>All the best,</p>
+        <p>TigerTaxi Team</p>
+        """
+    ).format(
+        escape(name),
+        escape(ride.origin),
+        escape(ride.destination),
+        escape(
+            ride.format_departure_datetime()  # type: ignore[no-untyped-call]
+        ),
+        url_for("main_bp.user_rides", _external=True, _scheme="https"),
+    )
+
+
+def main() -> None:
+    """Times both approaches and prints the cost per message."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    app = create_app()
+    rides = [
+        Ride(
+            origin="Princeton",
+            destination=f"Newark Airport Terminal {i % 3} & <Gate>",
+            departure_datetime=datetime.utcnow() + timedelta(hours=i),
+        )
+        for i in range(args.messages)
+    ]
+    names = [f"Rider {i}" for i in range(args.messages)]
+
+    with app.test_request_context(base_url="https://tigertaxi.test"):
+
+        def before() -> None:
+            for name, ride in zip(names, rides):
+                render_inline(name, ride)
+
+        def after() -> None:
+            render_emails(
+                [
+                    (
+                        "emails/request_accepted.html",
+                        {"name": name, "ride": ride},
+                    )
+                    for name, ride in zip(names, rides)
+                ]
+            )
+
+        # Warm up the template cache before timing
+        after()
+
+        for label, function in (("before", before), ("after", after)):
+            best = min(
+                timeit.repeat(function, number=1, repeat=args.repeat)
+            )
+            print(
+                "{:<7}{:8.1f} µs/message".format(
+                    label, best / args.messages * 1e6
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""Lookup latency benchmark for the composite indexes.
+
+Seeds scratch copies of the rides, ride_requests and riders tables at
+each requested size (100k and 1M ride requests by default), then times
+the hot per-ride and per-user lookups made by the models, first with
+only the primary keys (as the tables were before migration
+6c2e9d4a1f38) and then with the composite indexes added by it. Prints
+the median and 95th percentile latency of each query.
+
+Usage:
+    $ source .flaskenv
+    $ python bench/lookup_latency.py [--rows 100000 1000000]
+        [--samples 200]
+
+Everything is created in a separate "bench" schema which is dropped
+afterwards, but the script should still be pointed at a development
+database, never at production.
+"""
+
+# ----------------------------------------------------------------------
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from typing import Any, Dict, List, Tuple
+
+from sqlalchemy import text
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from tigertaxi import create_app  # noqa: E402
+from tigertaxi.extensions import db  # noqa: E402
+
+# ----------------------------------------------------------------------
+
+# Rows per ride request: most rides get a handful of requests and
+# riders, and each user makes requests for many rides
+RIDES_PER_REQUEST = 0.25
+USERS_PER_REQUEST = 0.05
+
+SETUP = """
+DROP SCHEMA IF EXISTS bench CASCADE;
+CREATE SCHEMA bench;
+
+CREATE TABLE bench.rides (
+    id integer PRIMARY KEY,
+    creator_id integer NOT NULL,
+    capacity integer NOT NULL,
+    departure_datetime timestamp NOT NULL
+);
+INSERT INTO bench.rides
+SELECT
+    g,
+    1 + g % :users,
+    4,
+    now() - interval '30 days' + (g % 525600) * interval '1 minute'
+FROM generate_series(1, :rides) AS g;
+
+CREATE TABLE bench.ride_requests (
+    id integer PRIMARY KEY,
+    ride_id integer NOT NULL,
+    user_id integer NOT NULL,
+    status integer NOT NULL
+);
+INSERT INTO bench.ride_requests
+SELECT
+    g,
+    1 + (g * 7919) % :rides,
+    1 + (g * 104729) % :users,
+    1 + g % 4
+FROM generate_series(1, :rows) AS g;
+
+CREATE TABLE bench.riders (
+    id integer PRIMARY KEY,
+    ride_id integer NOT NULL,
+    user_id integer NOT NULL
+);
+INSERT INTO bench.riders
+SELECT id, ride_id, user_id
+FROM bench.ride_requests
+WHERE status = 2;
+
+ANALYZE bench.rides;
+ANALYZE bench.ride_requests;
+ANALYZE bench.riders;
+"""
+
+INDEXES = """
+CREATE INDEX ON bench.ride_requests (ride_id, user_id, status);
+CREATE INDEX ON bench.ride_requests (user_id, status);
+CREATE INDEX ON bench.riders (ride_id, user_id);
+CREATE INDEX ON bench.rides (creator_id, departure_datetime);
+
+ANALYZE bench.rides;
+ANALYZE bench.ride_requests;
+ANALYZE bench.riders;
+"""
+
+# The lookups made by the models, named after the methods making them
+QUERIES: Dict[str, str] = {
+    "Ride.is_user_rider": """
+        SELECT id FROM bench.riders
+        WHERE ride_id = :ride AND user_id = :user
+        LIMIT 1
+    """,
+    "Ride.is_user_request_pending": """
+        SELECT id FROM bench.ride_requests
+        WHERE ride_id = :ride AND user_id = :user AND status = 1
+        LIMIT 1
+    """,
+    "Ride.get_pending_requests": """
+        SELECT * FROM bench.ride_requests
+        WHERE ride_id = :ride AND status = 1
+    """,
+    "User.get_pending_outbound_requests": """
+        SELECT * FROM bench.ride_requests
+        WHERE user_id = :user AND status = 1
+    """,
+    "User.get_created_rides": """
+        SELECT * FROM bench.rides
+        WHERE creator_id = :user
+            AND departure_datetime >= now() - interval '6 hours'
+        ORDER BY departure_datetime
+    """,
+}
+
+
+def time_queries(
+    conn: Any, rides: int, users: int, samples: int
+) -> Dict[str, Tuple[float, float]]:
+    """Runs each query with random parameters and returns its median and
+    95th percentile latency in milliseconds."""
+    rng = random.Random(0)
+    results = {}
+    for name, query in QUERIES.items():
+        statement = text(query)
+        timings: List[float] = []
+        for _ in range(samples):
+            params = {
+                "ride": rng.randint(1, rides),
+                "user": rng.randint(1, users),
+            }
+            start = time.perf_counter()
+            conn.execute(statement, params).fetchall()
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        results[name] = (
+            statistics.median(timings),
+            timings[int(len(timings) * 0.95) - 1],
+        )
+    return results
+
+
+def main() -> None:
+    """Seeds the scratch tables at each size and prints the latency of
+    every lookup before and after indexing."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--rows", type=int, nargs="+", default=[100_000, 1_000_000]
+    )
+    parser.add_argument("--samples", type=int, default=200)
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context(), db.engine.connect() as conn:
+        for rows in args.rows:
+            rides = max(1, int(rows * RIDES_PER_REQUEST))
+            users = max(1, int(rows * USERS_PER_REQUEST))
+
+            print(f"\nSeeding {rows} ride requests...")
+            with conn.begin():
+                conn.execute(
+                    text(SETUP),
+                    {"rows": rows, "rides": rides, "users": users},
+                )
+
+            before = time_queries(conn, rides, users, args.samples)
+            with conn.begin():
+                conn.execute(text(INDEXES))
+            after = time_queries(conn, rides, users, args.samples)
+
+            print(
+                f"{'query':<36} {'before p50/p95 (ms)':>22} "
+                f"{'after p50/p95 (ms)':>22}"
+            )
+            for name in QUERIES:
+                print(
+                    "{:<36} {:>10.3f} / {:<9.3f} {:>10.3f} / {:<9.3f}"
+                    .format(name, *before[name], *after[name])
+                )
+
+        with conn.begin():
+            conn.execute(text("DROP SCHEMA bench CASCADE"))
+
+
+if __name__ == "__main__":
+    main()
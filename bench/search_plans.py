@@ -0,0 +1,156 @@
+"""Query plan benchmark for Ride.search.
+
+Seeds two scratch copies of the rides table with the same rows (one
+million by default), one with only the original btree indexes and one
+with the generated tsvector columns and GIN indexes added in migration
+5d0c664d067e. Then prints EXPLAIN ANALYZE output for the "from" tab
+search as it was written before and after that migration.
+
+Usage:
+    $ source .flaskenv
+    $ python bench/search_plans.py [--rows 1000000] [--term airport]
+
+Everything is created in a separate "bench" schema which is dropped
+afterwards, but the script should still be pointed at a development
+database, never at production.
+"""
+
+# ----------------------------------------------------------------------
+
+import argparse
+import os
+import sys
+from typing import Any
+
+from sqlalchemy import text
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from tigertaxi import create_app  # noqa: E402
+from tigertaxi.extensions import db  # noqa: E402
+
+# ----------------------------------------------------------------------
+
+PLACES = [
+    "Newark Airport",
+    "JFK Airport",
+    "LaGuardia Airport",
+    "Philadelphia Airport",
+    "Penn Station",
+    "Grand Central",
+    "Trenton Transit Center",
+    "Hamilton Station",
+    "New Brunswick",
+    "Times Square",
+    "Boston South Station",
+    "Washington Union Station",
+]
+
+SETUP = """
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+DROP SCHEMA IF EXISTS bench CASCADE;
+CREATE SCHEMA bench;
+
+CREATE TABLE bench.rides_before (
+    id integer PRIMARY KEY,
+    origin varchar(256) NOT NULL,
+    destination varchar(256) NOT NULL,
+    departure_datetime timestamp NOT NULL
+);
+
+INSERT INTO bench.rides_before
+SELECT
+    g,
+    CASE WHEN g % 2 = 0 THEN 'Princeton'
+        ELSE (:places)[1 + g % :n_places] || ' ' || g % 97 END,
+    CASE WHEN g % 2 = 1 THEN 'Princeton'
+        ELSE (:places)[1 + g % :n_places] || ' ' || g % 89 END,
+    now() - interval '30 days' + (g % 525600) * interval '1 minute'
+FROM generate_series(1, :rows) AS g;
+
+CREATE TABLE bench.rides_after AS SELECT * FROM bench.rides_before;
+ALTER TABLE bench.rides_after ADD PRIMARY KEY (id);
+ALTER TABLE bench.rides_after
+    ADD COLUMN origin_tsv tsvector
+        GENERATED ALWAYS AS (to_tsvector('english', origin)) STORED,
+    ADD COLUMN destination_tsv tsvector
+        GENERATED ALWAYS AS (to_tsvector('english', destination)) STORED;
+
+CREATE INDEX ON bench.rides_before (origin);
+CREATE INDEX ON bench.rides_before (destination);
+CREATE INDEX ON bench.rides_before (departure_datetime);
+CREATE INDEX ON bench.rides_after (origin);
+CREATE INDEX ON bench.rides_after (destination);
+CREATE INDEX ON bench.rides_after (departure_datetime);
+CREATE INDEX ON bench.rides_after USING gin (destination_tsv);
+CREATE INDEX ON bench.rides_after
+    USING gin (destination gin_trgm_ops);
+
+ANALYZE bench.rides_before;
+ANALYZE bench.rides_after;
+"""
+
+BEFORE = """
+EXPLAIN (ANALYZE, BUFFERS)
+SELECT * FROM bench.rides_before
+WHERE departure_datetime >= now() - interval '6 hours'
+    AND origin = 'Princeton'
+    AND (destination ILIKE :pattern
+        OR to_tsvector(destination) @@ plainto_tsquery(:term))
+ORDER BY departure_datetime, destination, origin
+"""
+
+AFTER = """
+EXPLAIN (ANALYZE, BUFFERS)
+SELECT * FROM bench.rides_after
+WHERE departure_datetime >= now() - interval '6 hours'
+    AND origin = 'Princeton'
+    AND (destination ILIKE :pattern
+        OR destination_tsv @@ plainto_tsquery('english', :term))
+ORDER BY departure_datetime, destination, origin
+"""
+
+
+def explain(conn: Any, query: str, term: str) -> str:
+    """Runs the given EXPLAIN query and returns its output."""
+    rows = conn.execute(
+        text(query), {"pattern": f"%{term}%", "term": term}
+    )
+    return "\n".join(row[0] for row in rows)
+
+
+def main() -> None:
+    """Seeds the scratch tables and prints both query plans."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--term", default="airport")
+    parser.add_argument(
+        "--keep",
+        action="store_true",
+        help="don't drop the bench schema afterwards",
+    )
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context(), db.engine.begin() as conn:
+        print(f"Seeding {args.rows} rides...")
+        conn.execute(
+            text(SETUP),
+            {
+                "places": PLACES,
+                "n_places": len(PLACES),
+                "rows": args.rows,
+            },
+        )
+
+        print("\n=== Before (inline to_tsvector) ===")
+        print(explain(conn, BEFORE, args.term))
+        print("\n=== After (generated column + GIN) ===")
+        print(explain(conn, AFTER, args.term))
+
+        if not args.keep:
+            conn.execute(text("DROP SCHEMA bench CASCADE"))
+
+
+if __name__ == "__main__":
+    main()
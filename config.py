@@ -19,6 +19,18 @@ class Config:
     if server is not None:
         SERVER_NAME = server
 
+    # Base URL of the site, for links in emails sent outside of requests
+    # (see tigertaxi/emails.py). Defaults to the server name over HTTPS,
+    # or to the local development server.
+    site_url = os.environ.get("SITE_URL")
+    if site_url is None:
+        site_url = (
+            "https://{}".format(server)
+            if server is not None
+            else "http://localhost:5000"
+        )
+    SITE_URL = site_url.rstrip("/")
+
     # Flask-SQLAlchemy setup (modified for Heroku)
     db_uri = os.environ.get("DATABASE_URL")
 
@@ -37,10 +49,112 @@ class Config:
 
     SQLALCHEMY_DATABASE_URI = db_uri
 
+    # Optional read replicas (comma-separated URLs), which serve the
+    # read-only views (see tigertaxi/replicas.py). A user's requests
+    # stay on the primary for REPLICA_READ_YOUR_WRITES seconds after
+    # they change anything, to hide replication lag from them.
+    replica_uris = [
+        uri.strip().replace("postgres://", "postgresql://", 1)
+        for uri in os.environ.get("DATABASE_REPLICA_URLS", "").split(
+            ","
+        )
+        if uri.strip() != ""
+    ]
+    SQLALCHEMY_BINDS = {
+        f"replica_{i}": uri for i, uri in enumerate(replica_uris, 1)
+    }
+    REPLICA_BINDS = list(SQLALCHEMY_BINDS)
+    REPLICA_READ_YOUR_WRITES = float(
+        os.environ.get("REPLICA_READ_YOUR_WRITES", 10)
+    )
+
+    # Netids allowed to view internal statistics (comma-separated)
+    ADMIN_NETIDS = [
+        netid.strip()
+        for netid in os.environ.get("ADMIN_NETIDS", "").split(",")
+        if netid.strip() != ""
+    ]
+
+    # Connection pool for the primary and each replica (see
+    # tigertaxi/pools.py). Waiting longer than DB_POOL_TIMEOUT seconds
+    # for a connection fails the request, connections are replaced
+    # after DB_POOL_RECYCLE seconds, and DB_POOL_PRE_PING tests each
+    # connection before it is used. Set DB_PGBOUNCER when connecting
+    # through PgBouncer in transaction pooling mode: PgBouncer then
+    # pools the connections, so the app opens one per checkout instead
+    # and the DB_POOL_* settings are ignored.
+    DB_PGBOUNCER = (
+        os.environ.get("DB_PGBOUNCER", "False").lower() == "true"
+    )
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        "pool_size": int(os.environ.get("DB_POOL_SIZE", 5)),
+        "max_overflow": int(os.environ.get("DB_MAX_OVERFLOW", 10)),
+        "pool_timeout": float(os.environ.get("DB_POOL_TIMEOUT", 30)),
+        "pool_recycle": int(os.environ.get("DB_POOL_RECYCLE", 1800)),
+        "pool_pre_ping": (
+            os.environ.get("DB_POOL_PRE_PING", "True").lower() == "true"
+        ),
+    }
+
+    # Cross-worker cache invalidation (see tigertaxi/invalidation.py).
+    # On PostgreSQL, workers LISTEN for changes; since that doesn't
+    # work through PgBouncer in transaction pooling mode, they need
+    # DATABASE_LISTEN_URL to connect to the database directly there.
+    # Otherwise (and on SQLite) they poll for changes every
+    # INVALIDATION_POLL_INTERVAL seconds.
+    INVALIDATION_ENABLED = (
+        os.environ.get("INVALIDATION_ENABLED", "True").lower() == "true"
+    )
+    listen_uri = os.environ.get("DATABASE_LISTEN_URL")
+    if listen_uri is not None:
+        listen_uri = listen_uri.replace(
+            "postgres://", "postgresql://", 1
+        )
+    DATABASE_LISTEN_URL = listen_uri
+    INVALIDATION_POLL_INTERVAL = float(
+        os.environ.get("INVALIDATION_POLL_INTERVAL", 2)
+    )
+
     # Disables a feature of Flask-SQLAlchemy which sends a signal to
     # the app every time a change is about to be made in the database.
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # Run each request in a unit of work, so that model changes are
+    # committed once at the end of the request instead of on every
+    # save() (see tigertaxi/transactions.py)
+    UNIT_OF_WORK_PER_REQUEST = (
+        os.environ.get("UNIT_OF_WORK_PER_REQUEST", "True").lower()
+        == "true"
+    )
+
+    # In-process ride search index (see tigertaxi/search_index.py).
+    # Indexes are reloaded from the database after RIDE_INDEX_MAX_AGE
+    # seconds, in case changes from other workers were missed.
+    RIDE_INDEX_ENABLED = (
+        os.environ.get("RIDE_INDEX_ENABLED", "True").lower() == "true"
+    )
+    RIDE_INDEX_MAX_AGE = int(os.environ.get("RIDE_INDEX_MAX_AGE", 60))
+
+    # Location suggestions are reloaded after this many seconds, in
+    # case changes from other workers were missed
+    LOCATION_INDEX_MAX_AGE = int(
+        os.environ.get("LOCATION_INDEX_MAX_AGE", 600)
+    )
+
+    # JSON search API page sizes (see endpoints.rides_api)
+    RIDES_API_PAGE_SIZE = 20
+    RIDES_API_MAX_PAGE_SIZE = 50
+
+    # Live search result and My Rides streams (see tigertaxi/streams.py).
+    # Each open stream holds one of a worker's threads (see Procfile),
+    # so at most STREAM_MAX_CLIENTS are served per worker, of both
+    # kinds together. Streams are closed after STREAM_MAX_AGE seconds,
+    # and send a keepalive after STREAM_KEEPALIVE idle seconds so the
+    # router doesn't drop them.
+    STREAM_MAX_CLIENTS = int(os.environ.get("STREAM_MAX_CLIENTS", 40))
+    STREAM_MAX_AGE = float(os.environ.get("STREAM_MAX_AGE", 300))
+    STREAM_KEEPALIVE = float(os.environ.get("STREAM_KEEPALIVE", 20))
+
     # Flask-CAS-NG setup
     CAS_SERVER = os.environ.get("CAS_SERVER")
     CAS_AFTER_LOGIN = os.environ.get("CAS_AFTER_LOGIN")
@@ -54,6 +168,38 @@ class Config:
     MAIL_DEFAULT_SENDER = os.environ.get("MAIL_DEFAULT_SENDER")
     MAIL_PASSWORD = os.environ.get("MAIL_PASSWORD")
 
+    # Background mail delivery (see tigertaxi/mailer.py). The SMTP
+    # connection is closed after MAIL_IDLE_TIMEOUT seconds without mail.
+    MAIL_ASYNC = os.environ.get("MAIL_ASYNC", "True").lower() == "true"
+    MAIL_IDLE_TIMEOUT = float(os.environ.get("MAIL_IDLE_TIMEOUT", 30))
+
+    # Notification outbox delivery (see tigertaxi/outbox.py). Failed
+    # messages are retried after OUTBOX_RETRY_BACKOFF seconds, doubling
+    # after each attempt.
+    OUTBOX_BATCH_SIZE = int(os.environ.get("OUTBOX_BATCH_SIZE", 50))
+    OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", 5))
+    OUTBOX_RETRY_BACKOFF = float(
+        os.environ.get("OUTBOX_RETRY_BACKOFF", 60)
+    )
+
+    # Digest notifications are sent once a recipient has had none of
+    # the same kind for DIGEST_QUIET_WINDOW seconds, or after
+    # DIGEST_MAX_DELAY seconds at most
+    DIGEST_QUIET_WINDOW = int(
+        os.environ.get("DIGEST_QUIET_WINDOW", 300)
+    )
+    DIGEST_MAX_DELAY = int(os.environ.get("DIGEST_MAX_DELAY", 1800))
+
+    # Rides are moved to the archive tables by `flask rides archive`
+    # once they departed RIDE_ARCHIVE_AFTER_DAYS days ago, in batches
+    # of RIDE_ARCHIVE_BATCH_SIZE rides (see tigertaxi/archive.py)
+    RIDE_ARCHIVE_AFTER_DAYS = int(
+        os.environ.get("RIDE_ARCHIVE_AFTER_DAYS", 30)
+    )
+    RIDE_ARCHIVE_BATCH_SIZE = int(
+        os.environ.get("RIDE_ARCHIVE_BATCH_SIZE", 500)
+    )
+
     DEBUG = False
     TESTING = os.environ.get("FLASK_ENV") != "production"
     CSRF_ENABLED = True
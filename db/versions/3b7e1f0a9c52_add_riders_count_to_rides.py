@@ -0,0 +1,42 @@
+"""Add riders_count to rides
+
+Revision ID: 3b7e1f0a9c52
+Revises: 5d0c664d067e
+Create Date: 2026-10-18 11:02:47.391870
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "3b7e1f0a9c52"
+down_revision = "5d0c664d067e"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "rides",
+        sa.Column(
+            "riders_count",
+            sa.Integer(),
+            server_default="0",
+            nullable=False,
+        ),
+    )
+
+    # Backfill from the riders table. Run `flask rides check-counts`
+    # afterwards if riders may have changed while this was running.
+    op.execute(
+        """
+        UPDATE rides
+        SET riders_count = (
+            SELECT count(*) FROM riders WHERE riders.ride_id = rides.id
+        )
+        """
+    )
+
+
+def downgrade():
+    op.drop_column("rides", "riders_count")
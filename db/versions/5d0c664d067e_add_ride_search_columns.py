@@ -0,0 +1,85 @@
+"""Add indexed search columns to rides
+
+Revision ID: 5d0c664d067e
+Revises: c8d4ab20e7fc
+Create Date: 2026-10-18 09:40:12.518204
+
+"""
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = "5d0c664d067e"
+down_revision = "c8d4ab20e7fc"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Trigram operator classes used by the substring indexes below
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+
+    # Generated columns must use an explicit text search configuration
+    # so that their expressions are immutable
+    op.add_column(
+        "rides",
+        sa.Column(
+            "origin_tsv",
+            postgresql.TSVECTOR(),
+            sa.Computed(
+                "to_tsvector('english', origin)", persisted=True
+            ),
+            nullable=True,
+        ),
+    )
+    op.add_column(
+        "rides",
+        sa.Column(
+            "destination_tsv",
+            postgresql.TSVECTOR(),
+            sa.Computed(
+                "to_tsvector('english', destination)", persisted=True
+            ),
+            nullable=True,
+        ),
+    )
+    op.create_index(
+        "ix_rides_origin_tsv",
+        "rides",
+        ["origin_tsv"],
+        unique=False,
+        postgresql_using="gin",
+    )
+    op.create_index(
+        "ix_rides_destination_tsv",
+        "rides",
+        ["destination_tsv"],
+        unique=False,
+        postgresql_using="gin",
+    )
+    op.create_index(
+        "ix_rides_origin_trgm",
+        "rides",
+        ["origin"],
+        unique=False,
+        postgresql_using="gin",
+        postgresql_ops={"origin": "gin_trgm_ops"},
+    )
+    op.create_index(
+        "ix_rides_destination_trgm",
+        "rides",
+        ["destination"],
+        unique=False,
+        postgresql_using="gin",
+        postgresql_ops={"destination": "gin_trgm_ops"},
+    )
+
+
+def downgrade():
+    op.drop_index("ix_rides_destination_trgm", table_name="rides")
+    op.drop_index("ix_rides_origin_trgm", table_name="rides")
+    op.drop_index("ix_rides_destination_tsv", table_name="rides")
+    op.drop_index("ix_rides_origin_tsv", table_name="rides")
+    op.drop_column("rides", "destination_tsv")
+    op.drop_column("rides", "origin_tsv")
@@ -0,0 +1,58 @@
+"""Add composite indexes for ride, request and rider lookups
+
+Revision ID: 6c2e9d4a1f38
+Revises: 9a5f3c81d2e7
+Create Date: 2026-10-18 14:21:47.103562
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "6c2e9d4a1f38"
+down_revision = "9a5f3c81d2e7"
+branch_labels = None
+depends_on = None
+
+# Name, table and columns of each index
+INDEXES = [
+    (
+        "ix_ride_requests_ride_id_user_id_status",
+        "ride_requests",
+        ["ride_id", "user_id", "status"],
+    ),
+    (
+        "ix_ride_requests_user_id_status",
+        "ride_requests",
+        ["user_id", "status"],
+    ),
+    ("ix_riders_ride_id_user_id", "riders", ["ride_id", "user_id"]),
+    (
+        "ix_rides_creator_id_departure_datetime",
+        "rides",
+        ["creator_id", "departure_datetime"],
+    ),
+]
+
+
+def upgrade():
+    # CREATE INDEX CONCURRENTLY doesn't block writes to the tables, but
+    # can't run inside a transaction. If it fails part way, it leaves an
+    # invalid index behind, which has to be dropped before this
+    # migration is run again.
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(
+                name,
+                table,
+                columns,
+                unique=False,
+                postgresql_concurrently=True,
+            )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, _ in reversed(INDEXES):
+            op.drop_index(
+                name, table_name=table, postgresql_concurrently=True
+            )
@@ -0,0 +1,29 @@
+"""Add digest columns to outbox
+
+Revision ID: 9a5f3c81d2e7
+Revises: e41c7d2b8f06
+Create Date: 2026-10-18 13:02:09.517340
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "9a5f3c81d2e7"
+down_revision = "e41c7d2b8f06"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "outbox", sa.Column("kind", sa.String(length=64), nullable=True)
+    )
+    op.add_column(
+        "outbox", sa.Column("summary", sa.Text(), nullable=True)
+    )
+
+
+def downgrade():
+    op.drop_column("outbox", "summary")
+    op.drop_column("outbox", "kind")
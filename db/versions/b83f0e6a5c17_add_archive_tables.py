@@ -0,0 +1,163 @@
+"""Add archive tables for departed rides
+
+Revision ID: b83f0e6a5c17
+Revises: 6c2e9d4a1f38
+Create Date: 2026-10-18 15:04:12.662091
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "b83f0e6a5c17"
+down_revision = "6c2e9d4a1f38"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Archived rows keep the ids they had in the hot tables
+    op.create_table(
+        "archived_rides",
+        sa.Column(
+            "id", sa.Integer(), autoincrement=False, nullable=False
+        ),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.Column("updated_at", sa.DateTime(), nullable=True),
+        sa.Column("creator_id", sa.Integer(), nullable=False),
+        sa.Column("capacity", sa.Integer(), nullable=False),
+        sa.Column("origin", sa.String(length=256), nullable=False),
+        sa.Column("destination", sa.String(length=256), nullable=False),
+        sa.Column("departure_datetime", sa.DateTime(), nullable=False),
+        sa.Column("notes", sa.String(length=280), nullable=True),
+        sa.Column("is_anonymous", sa.Boolean(), nullable=False),
+        sa.Column("riders_count", sa.Integer(), nullable=False),
+        sa.Column("archived_at", sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["creator_id"],
+            ["users.id"],
+        ),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        op.f("ix_archived_rides_created_at"),
+        "archived_rides",
+        ["created_at"],
+        unique=False,
+    )
+    op.create_index(
+        op.f("ix_archived_rides_updated_at"),
+        "archived_rides",
+        ["updated_at"],
+        unique=False,
+    )
+    op.create_index(
+        "ix_archived_rides_creator_id_departure_datetime",
+        "archived_rides",
+        ["creator_id", "departure_datetime"],
+        unique=False,
+    )
+
+    op.create_table(
+        "archived_ride_requests",
+        sa.Column(
+            "id", sa.Integer(), autoincrement=False, nullable=False
+        ),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.Column("updated_at", sa.DateTime(), nullable=True),
+        sa.Column("ride_id", sa.Integer(), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("status", sa.Integer(), nullable=False),
+        sa.Column("status_changed_at", sa.DateTime(), nullable=True),
+        sa.Column("archived_at", sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["ride_id"],
+            ["archived_rides.id"],
+        ),
+        sa.ForeignKeyConstraint(
+            ["user_id"],
+            ["users.id"],
+        ),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        op.f("ix_archived_ride_requests_created_at"),
+        "archived_ride_requests",
+        ["created_at"],
+        unique=False,
+    )
+    op.create_index(
+        op.f("ix_archived_ride_requests_updated_at"),
+        "archived_ride_requests",
+        ["updated_at"],
+        unique=False,
+    )
+    op.create_index(
+        op.f("ix_archived_ride_requests_ride_id"),
+        "archived_ride_requests",
+        ["ride_id"],
+        unique=False,
+    )
+    op.create_index(
+        op.f("ix_archived_ride_requests_user_id"),
+        "archived_ride_requests",
+        ["user_id"],
+        unique=False,
+    )
+
+    op.create_table(
+        "archived_riders",
+        sa.Column(
+            "id", sa.Integer(), autoincrement=False, nullable=False
+        ),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.Column("updated_at", sa.DateTime(), nullable=True),
+        sa.Column("ride_request_id", sa.Integer(), nullable=True),
+        sa.Column("ride_id", sa.Integer(), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("is_creator", sa.Boolean(), nullable=False),
+        sa.Column("archived_at", sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["ride_id"],
+            ["archived_rides.id"],
+        ),
+        sa.ForeignKeyConstraint(
+            ["ride_request_id"],
+            ["archived_ride_requests.id"],
+        ),
+        sa.ForeignKeyConstraint(
+            ["user_id"],
+            ["users.id"],
+        ),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        op.f("ix_archived_riders_created_at"),
+        "archived_riders",
+        ["created_at"],
+        unique=False,
+    )
+    op.create_index(
+        op.f("ix_archived_riders_updated_at"),
+        "archived_riders",
+        ["updated_at"],
+        unique=False,
+    )
+    op.create_index(
+        op.f("ix_archived_riders_user_id"),
+        "archived_riders",
+        ["user_id"],
+        unique=False,
+    )
+    op.create_index(
+        "ix_archived_riders_ride_id_user_id",
+        "archived_riders",
+        ["ride_id", "user_id"],
+        unique=False,
+    )
+
+
+def downgrade():
+    op.drop_table("archived_riders")
+    op.drop_table("archived_ride_requests")
+    op.drop_table("archived_rides")
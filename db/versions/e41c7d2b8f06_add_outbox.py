@@ -0,0 +1,58 @@
+"""Add notification outbox
+
+Revision ID: e41c7d2b8f06
+Revises: 3b7e1f0a9c52
+Create Date: 2026-10-18 12:15:31.846213
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "e41c7d2b8f06"
+down_revision = "3b7e1f0a9c52"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "outbox",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.Column("updated_at", sa.DateTime(), nullable=True),
+        sa.Column("recipient", sa.String(length=256), nullable=False),
+        sa.Column("subject", sa.String(length=256), nullable=False),
+        sa.Column("html", sa.Text(), nullable=False),
+        sa.Column("attempts", sa.Integer(), nullable=False),
+        sa.Column("next_attempt_at", sa.DateTime(), nullable=True),
+        sa.Column("sent_at", sa.DateTime(), nullable=True),
+        sa.Column("last_error", sa.Text(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        op.f("ix_outbox_created_at"),
+        "outbox",
+        ["created_at"],
+        unique=False,
+    )
+    op.create_index(
+        op.f("ix_outbox_updated_at"),
+        "outbox",
+        ["updated_at"],
+        unique=False,
+    )
+    op.create_index(
+        "ix_outbox_next_attempt_at",
+        "outbox",
+        ["next_attempt_at"],
+        unique=False,
+        postgresql_where=sa.text("next_attempt_at IS NOT NULL"),
+    )
+
+
+def downgrade():
+    op.drop_index("ix_outbox_next_attempt_at", table_name="outbox")
+    op.drop_index(op.f("ix_outbox_updated_at"), table_name="outbox")
+    op.drop_index(op.f("ix_outbox_created_at"), table_name="outbox")
+    op.drop_table("outbox")
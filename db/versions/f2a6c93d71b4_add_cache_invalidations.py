@@ -0,0 +1,53 @@
+"""Add cache invalidations table
+
+Revision ID: f2a6c93d71b4
+Revises: b83f0e6a5c17
+Create Date: 2026-10-18 17:42:08.315926
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "f2a6c93d71b4"
+down_revision = "b83f0e6a5c17"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Only used by workers which poll for invalidations instead of
+    # listening for them (see tigertaxi/invalidation.py)
+    op.create_table(
+        "cache_invalidations",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.Column("updated_at", sa.DateTime(), nullable=True),
+        sa.Column("entity", sa.String(length=64), nullable=False),
+        sa.Column("entity_id", sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        op.f("ix_cache_invalidations_created_at"),
+        "cache_invalidations",
+        ["created_at"],
+        unique=False,
+    )
+    op.create_index(
+        op.f("ix_cache_invalidations_updated_at"),
+        "cache_invalidations",
+        ["updated_at"],
+        unique=False,
+    )
+
+
+def downgrade():
+    op.drop_index(
+        op.f("ix_cache_invalidations_updated_at"),
+        table_name="cache_invalidations",
+    )
+    op.drop_index(
+        op.f("ix_cache_invalidations_created_at"),
+        table_name="cache_invalidations",
+    )
+    op.drop_table("cache_invalidations")
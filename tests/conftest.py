@@ -0,0 +1,178 @@
+"""Shared fixtures for the TigerTaxi tests.
+
+Tests run the app against a throwaway SQLite database, which is created
+afresh for every test. PostgreSQL's full text search is stood in for by
+plain lowercasing, which is enough for the queries to run.
+"""
+
+# ----------------------------------------------------------------------
+
+import os
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Any, Callable, Iterator, List
+
+# Config is read from the environment when it is first imported
+DATABASE_DIR = tempfile.mkdtemp(prefix="tigertaxi-tests-")
+os.environ["DATABASE_URL"] = "sqlite:///{}".format(
+    os.path.join(DATABASE_DIR, "primary.db")
+)
+os.environ["SECRET_KEY"] = "tigertaxi-tests"
+os.environ["FLASK_ENV"] = "development"
+os.environ["INVALIDATION_ENABLED"] = "False"
+os.environ["MAIL_ASYNC"] = "False"
+
+import pytest
+from flask import Flask
+from flask.testing import FlaskClient
+from sqlalchemy import event
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.compiler import compiles
+
+from tigertaxi import create_app
+from tigertaxi.extensions import db
+from tigertaxi.locations import location_index
+from tigertaxi.models import Ride, User
+from tigertaxi.search_index import ride_index
+
+# ----------------------------------------------------------------------
+
+
+@compiles(TSVECTOR, "sqlite")  # type: ignore[misc]
+def compile_tsvector(type_: Any, compiler: Any, **kw: Any) -> str:
+    """Stores tsvector columns as text on SQLite."""
+    return "TEXT"
+
+
+def add_search_functions(dbapi_connection: Any, record: Any) -> None:
+    """Defines the full text search functions used by the models."""
+    if hasattr(dbapi_connection, "create_function"):
+        dbapi_connection.create_function(
+            "to_tsvector",
+            2,
+            lambda config, text: (text or "").lower(),
+            deterministic=True,
+        )
+        dbapi_connection.create_function(
+            "plainto_tsquery",
+            2,
+            lambda config, text: (text or "").lower(),
+        )
+
+
+event.listen(Engine, "connect", add_search_functions)
+
+
+@pytest.fixture(scope="session")
+def app() -> Flask:
+    """The app, shared by every test."""
+    return create_app()
+
+
+@pytest.fixture(autouse=True)
+def database(app: Flask) -> Iterator[None]:
+    """Gives each test empty tables and in-process caches."""
+    with app.app_context():
+        db.create_all()
+        db.session.remove()
+
+    ride_index.clear()
+    location_index.load([])
+
+    yield
+
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def users(app: Flask) -> List[int]:
+    """Ids of four users, with netids u0 to u3."""
+    with app.app_context():
+        created = [
+            User(
+                netid=f"u{i}",
+                email=f"u{i}@princeton.edu",
+                disp_name=f"User {i}",
+            )
+            for i in range(4)
+        ]
+        db.session.add_all(created)
+        db.session.commit()
+        return [user.id for user in created]
+
+
+@pytest.fixture
+def add_rides(app: Flask) -> Callable[..., List[int]]:
+    """Adds upcoming rides from Princeton, returning their ids."""
+
+    def add(
+        creator_id: int, count: int, capacity: int = 3
+    ) -> List[int]:
+        with app.app_context():
+            rides = [
+                Ride(
+                    creator_id=creator_id,
+                    capacity=capacity,
+                    origin="Princeton",
+                    destination=f"Newark Airport {i}",
+                    departure_datetime=(
+                        datetime.utcnow() + timedelta(days=1, hours=i)
+                    ),
+                )
+                for i in range(count)
+            ]
+            db.session.add_all(rides)
+            db.session.commit()
+            return [ride.id for ride in rides]
+
+    return add
+
+
+@pytest.fixture
+def login(app: Flask) -> Callable[[str], FlaskClient]:
+    """Returns a test client logged in through CAS as the given
+    netid."""
+
+    def client(netid: str) -> FlaskClient:
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session["CAS_USERNAME"] = netid
+            session["CAS_ATTRIBUTES"] = {
+                "cas:mail": f"{netid}@princeton.edu",
+                "cas:displayname": netid,
+            }
+        return client
+
+    return client
+
+
+@pytest.fixture
+def count_queries(app: Flask) -> Callable[[], Any]:
+    """Returns a context manager which counts the statements run on the
+    primary database within it."""
+
+    @contextmanager
+    def counting() -> Iterator[List[str]]:
+        statements: List[str] = []
+
+        def record(
+            conn: Any,
+            cursor: Any,
+            statement: str,
+            *args: Any,
+        ) -> None:
+            statements.append(statement)
+
+        with app.app_context():
+            engine = db.engine
+        event.listen(engine, "before_cursor_execute", record)
+        try:
+            yield statements
+        finally:
+            event.remove(engine, "before_cursor_execute", record)
+
+    return counting
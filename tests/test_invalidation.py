@@ -0,0 +1,69 @@
+"""Polling for cross-worker invalidations (see invalidation.py)."""
+
+# ----------------------------------------------------------------------
+
+from datetime import datetime
+from typing import List
+
+import pytest
+from flask import Flask
+from sqlalchemy import insert
+
+from tigertaxi import invalidation
+from tigertaxi.extensions import db
+from tigertaxi.invalidation import Change, InvalidationBus
+from tigertaxi.models import CacheInvalidation
+
+# ----------------------------------------------------------------------
+
+
+def add_change(app: Flask, row_id: int, entity_id: int) -> None:
+    """Commits a change to a ride, with the given id."""
+    now = datetime.utcnow()
+    with app.app_context(), db.engine.begin() as conn:
+        conn.execute(
+            insert(CacheInvalidation.__table__),
+            {
+                "id": row_id,
+                "entity": "Ride",
+                "entity_id": entity_id,
+                "created_at": now,
+                "updated_at": now,
+            },
+        )
+
+
+def poll(app: Flask, bus: InvalidationBus) -> List[Change]:
+    """Returns the changes the bus finds on its next poll."""
+    with app.app_context(), db.engine.connect() as conn:
+        return bus._poll_changes(conn)
+
+
+def test_poll_finds_changes_committed_out_of_order(app: Flask) -> None:
+    """A change committed after one with a higher id is still found, and
+    each change is only reported once."""
+    add_change(app, 5, 1)
+    bus = InvalidationBus()
+    assert poll(app, bus) == []
+
+    add_change(app, 10, 2)
+    assert poll(app, bus) == [("Ride", 2)]
+
+    add_change(app, 8, 3)
+    add_change(app, 11, 4)
+    assert poll(app, bus) == [("Ride", 3), ("Ride", 4)]
+    assert poll(app, bus) == []
+
+
+def test_poll_forgets_ids_outside_overlap(
+    app: Flask, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Only the ids which may still be polled again are remembered."""
+    monkeypatch.setattr(invalidation, "POLL_OVERLAP", 2)
+    bus = InvalidationBus()
+    poll(app, bus)
+
+    for row_id in range(1, 6):
+        add_change(app, row_id, row_id)
+    assert len(poll(app, bus)) == 5
+    assert bus._seen == {4, 5}
@@ -0,0 +1,78 @@
+"""Location suggestions (see locations.py)."""
+
+# ----------------------------------------------------------------------
+
+from typing import Callable, List
+
+import pytest
+from flask import Flask
+from sqlalchemy.orm import Session
+
+from tigertaxi import locations
+from tigertaxi.extensions import db
+from tigertaxi.invalidation import STAGED_KEY, Change, invalidation_bus
+from tigertaxi.locations import LocationIndex
+from tigertaxi.models import Ride, RideRequest
+
+# ----------------------------------------------------------------------
+
+
+def test_suggestions_by_prefix_and_weight() -> None:
+    """Any word of a location matches, most used locations first."""
+    index = LocationIndex()
+    index.load([("Newark Airport", 5), ("JFK Airport", 2), ("NYC", 1)])
+
+    assert index.suggest("air") == ["Newark Airport", "JFK Airport"]
+    assert index.suggest("n", limit=1) == ["Newark Airport"]
+    assert index.suggest("  ") == []
+
+
+def test_memo_keeps_recent_prefixes(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Memoized suggestions are capped, dropping the least recently
+    requested prefixes first."""
+    monkeypatch.setattr(locations, "MEMO_SIZE", 2)
+    index = LocationIndex()
+    index.load([("Newark Airport", 1)])
+
+    for prefix in ("n", "ne", "n", "new"):
+        assert index.suggest(prefix) == ["Newark Airport"]
+
+    assert list(index._memo) == [("n", 8), ("new", 8)]
+
+
+def test_only_location_changes_are_staged(
+    app: Flask,
+    users: List[int],
+    add_rides: Callable[..., List[int]],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Rides stage a location change when they are created or their
+    origin or destination changes, but not when their seats do."""
+    staged: List[Change] = []
+
+    def record(session: Session) -> None:
+        staged.extend(session.info.pop(STAGED_KEY, ()))
+
+    monkeypatch.setattr(invalidation_bus, "publish", record)
+
+    (ride_id,) = add_rides(users[0], 1)
+    assert ("RideLocation", ride_id) in staged
+
+    with app.app_context():
+        ride_request = RideRequest(ride_id=ride_id, user_id=users[1])
+        db.session.add(ride_request)
+        db.session.commit()
+        staged.clear()
+
+        ride_request.accept()  # type: ignore[no-untyped-call]
+        ride = db.session.get(Ride, ride_id)
+        ride.capacity = 4
+        db.session.commit()
+        assert ("Ride", ride_id) in staged
+        assert ("RideLocation", ride_id) not in staged
+
+        ride.destination = "JFK Airport"
+        db.session.commit()
+        assert ("RideLocation", ride_id) in staged
@@ -0,0 +1,265 @@
+"""Background mail delivery (see mailer.py)."""
+
+# ----------------------------------------------------------------------
+
+import smtplib
+import socketserver
+import threading
+import time
+from typing import Any, Iterator, List, Optional
+
+import pytest
+from flask import Flask
+from flask_mail import Message
+
+from tigertaxi import outbox
+from tigertaxi.extensions import db, mail
+from tigertaxi.mailer import MailDispatcher, SMTPSession
+from tigertaxi.models import OutboxMessage
+
+# ----------------------------------------------------------------------
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    """Speaks just enough SMTP to accept mail, recording each connection
+    and message on the server."""
+
+    server: "SMTPServer"
+
+    def reply(self, line: str) -> None:
+        """Sends a reply line to the client."""
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self) -> None:
+        """Serves one connection."""
+        self.server.connections += 1
+        self.reply("220 localhost")
+        while True:
+            line = self.rfile.readline().decode().strip()
+            command = line[:4].upper()
+            if command == "":
+                return
+            elif command in ("EHLO", "HELO"):
+                self.reply("250 localhost")
+            elif command == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                while self.rfile.readline() not in (b".\r\n", b""):
+                    pass
+                self.server.messages += 1
+                if self.server.drop_next:
+                    # Hang up without acknowledging the message
+                    self.server.drop_next = False
+                    return
+                self.reply("250 OK")
+            elif command == "QUIT":
+                self.server.quits += 1
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("250 OK")
+
+
+class SMTPServer(socketserver.ThreadingTCPServer):
+    """Local SMTP server standing in for the real one."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self) -> None:
+        """Listens on a free local port."""
+        super().__init__(("127.0.0.1", 0), SMTPHandler)
+        self.connections = 0
+        self.messages = 0
+        self.quits = 0
+        self.drop_next = False
+
+
+@pytest.fixture
+def smtp_server(
+    app: Flask, monkeypatch: pytest.MonkeyPatch
+) -> Iterator[SMTPServer]:
+    """Runs a local SMTP server, which Flask-Mail is pointed at."""
+    server = SMTPServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    state: Any = app.extensions["mail"]
+    monkeypatch.setattr(state, "server", "127.0.0.1")
+    monkeypatch.setattr(state, "port", server.server_address[1])
+    monkeypatch.setattr(state, "suppress", False)
+    monkeypatch.setattr(
+        state, "default_sender", "tigertaxi@princeton.edu"
+    )
+    yield server
+
+    server.shutdown()
+    server.server_close()
+
+
+def message(subject: str) -> Message:
+    """Returns a message to a user."""
+    return Message(
+        subject=subject,
+        html="<p>Hi</p>",
+        recipients=["u0@princeton.edu"],
+    )
+
+
+def wait_for(condition: Any, timeout: float = 5) -> bool:
+    """Waits until condition() holds, returning whether it did."""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_session_reuses_its_connection(
+    app: Flask, smtp_server: SMTPServer
+) -> None:
+    """Consecutive messages are sent over one connection."""
+    smtp = SMTPSession(mail)
+    with app.app_context():
+        for i in range(3):
+            smtp.send(message(f"Message {i}"))
+        smtp.close()
+
+    assert smtp_server.messages == 3
+    assert smtp_server.connections == 1
+    assert smtp_server.quits == 1
+
+
+def test_session_reconnects_after_failure(
+    app: Flask, smtp_server: SMTPServer
+) -> None:
+    """A failed send raises and drops the connection, and the next
+    message is sent over a new one."""
+    smtp = SMTPSession(mail)
+    with app.app_context():
+        smtp.send(message("Before"))
+        smtp_server.drop_next = True
+        with pytest.raises(smtplib.SMTPException):
+            smtp.send(message("Dropped"))
+        smtp.send(message("After"))
+        smtp.close()
+
+    assert smtp_server.connections == 2
+    assert smtp_server.messages == 3
+
+
+def test_dispatcher_delivers_the_outbox(
+    app: Flask, smtp_server: SMTPServer
+) -> None:
+    """Woken up, the worker sends the outbox over one connection, which
+    it closes once idle."""
+    dispatcher = MailDispatcher(mail)
+    dispatcher.init_app(app)
+    dispatcher.enabled = True
+    dispatcher.idle_timeout = 0.1
+    dispatcher.drain_outbox = outbox.drain
+
+    with app.app_context():
+        for i in range(3):
+            outbox.enqueue(message(f"Message {i}"))
+        db.session.commit()
+
+    try:
+        dispatcher.wake()
+        assert wait_for(lambda: smtp_server.quits == 1)
+    finally:
+        dispatcher.stop()
+
+    assert smtp_server.messages == 3
+    assert smtp_server.connections == 1
+    with app.app_context():
+        assert (
+            OutboxMessage.query.where(
+                OutboxMessage.sent_at.is_(None)
+            ).count()
+            == 0
+        )
+
+
+class FakeOutbox:
+    """Stands in for outbox.drain and outbox.due_in."""
+
+    def __init__(self) -> None:
+        """Creates an outbox with nothing due."""
+        self.drains = 0
+        self.drained = threading.Event()
+        self.next_due: Optional[float] = None
+
+    def drain(self, smtp: SMTPSession) -> int:
+        """Counts the drain."""
+        self.drains += 1
+        self.drained.set()
+        return 0
+
+    def due_in(self) -> Optional[float]:
+        """Returns when the worker should drain again."""
+        return self.next_due
+
+
+@pytest.fixture
+def fake_outbox() -> FakeOutbox:
+    """A fake outbox."""
+    return FakeOutbox()
+
+
+@pytest.fixture
+def dispatcher(
+    app: Flask, fake_outbox: FakeOutbox
+) -> Iterator[MailDispatcher]:
+    """An enabled dispatcher draining the fake outbox."""
+    dispatcher = MailDispatcher(mail)
+    dispatcher.init_app(app)
+    dispatcher.enabled = True
+    dispatcher.drain_outbox = fake_outbox.drain
+    dispatcher.outbox_due_in = fake_outbox.due_in
+    yield dispatcher
+
+    if dispatcher._timer is not None:
+        dispatcher._timer.cancel()
+    dispatcher.stop()
+
+
+def test_delayed_wakes_share_the_earliest_timer(
+    dispatcher: MailDispatcher, fake_outbox: FakeOutbox
+) -> None:
+    """Only one timer is armed, for the earliest requested wake-up."""
+    dispatcher.wake(300)
+    timer = dispatcher._timer
+    for _ in range(10):
+        dispatcher.wake(300)
+    dispatcher.wake(600)
+    assert dispatcher._timer is timer
+
+    live_timers: List[threading.Thread] = [
+        thread
+        for thread in threading.enumerate()
+        if isinstance(thread, threading.Timer) and thread.is_alive()
+    ]
+    assert live_timers == [timer]
+
+    dispatcher.wake(0.05)
+    assert dispatcher._timer is not timer
+    assert fake_outbox.drained.wait(5)
+    assert fake_outbox.drains == 1
+
+
+def test_drain_schedules_the_next_one(
+    dispatcher: MailDispatcher, fake_outbox: FakeOutbox
+) -> None:
+    """After a drain, the worker wakes up again when the outbox says
+    something is next due."""
+    fake_outbox.next_due = 120
+    dispatcher.wake()
+    assert fake_outbox.drained.wait(5)
+
+    # The timer is set just after the drain
+    assert wait_for(lambda: dispatcher._timer is not None)
+    timer = dispatcher._timer
+    assert timer is not None
+    dispatcher.wake(300)
+    assert dispatcher._timer is timer
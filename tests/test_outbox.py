@@ -0,0 +1,156 @@
+"""Delivery of the notification outbox (see outbox.py)."""
+
+# ----------------------------------------------------------------------
+
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+import pytest
+from flask import Flask
+from flask_mail import Message
+
+from tigertaxi import outbox
+from tigertaxi.extensions import db, mail
+from tigertaxi.mailer import SMTPSession
+from tigertaxi.models import OutboxMessage
+
+# ----------------------------------------------------------------------
+
+
+class FakeSMTP(SMTPSession):
+    """Records sent messages instead of sending them, failing with the
+    given exception for one subject."""
+
+    def __init__(
+        self,
+        fail_subject: Optional[str] = None,
+        error: Optional[BaseException] = None,
+    ) -> None:
+        """Creates a session which fails for fail_subject."""
+        super().__init__(mail)
+        self.fail_subject = fail_subject
+        self.error = error
+        self.sent: List[Message] = []
+
+    def send(self, message: Message) -> None:
+        """Records the message, or raises the error."""
+        if message.subject == self.fail_subject:
+            assert self.error is not None
+            raise self.error
+        self.sent.append(message)
+
+
+def subjects(smtp: FakeSMTP) -> List[str]:
+    """Returns the subjects of the messages sent through smtp."""
+    return [message.subject for message in smtp.sent]
+
+
+def add_messages(app: Flask, *subjects: str) -> None:
+    """Commits one outbox message per subject."""
+    with app.app_context():
+        for subject in subjects:
+            outbox.enqueue(
+                Message(
+                    subject=subject,
+                    html="<p>Hi</p>",
+                    recipients=["u0@princeton.edu"],
+                )
+            )
+        db.session.commit()
+
+
+def test_failure_is_recorded_and_others_sent(app: Flask) -> None:
+    """Any error sending one message, not only SMTP errors, schedules it
+    for a retry without holding up the rest."""
+    add_messages(app, "first", "broken", "last")
+    smtp = FakeSMTP("broken", ValueError("Bad message"))
+
+    with app.app_context():
+        assert outbox.drain(smtp) == 2
+        assert subjects(smtp) == ["first", "last"]
+
+        broken = OutboxMessage.query.filter_by(subject="broken").one()
+        assert broken.sent_at is None
+        assert broken.attempts == 1
+        assert broken.last_error == "Bad message"
+        assert broken.next_attempt_at > datetime.utcnow()
+
+
+def test_sent_messages_survive_a_crash(app: Flask) -> None:
+    """Messages sent before the drain is interrupted stay sent."""
+    add_messages(app, "first", "second", "crash")
+    smtp = FakeSMTP("crash", KeyboardInterrupt())
+
+    with app.app_context():
+        with pytest.raises(KeyboardInterrupt):
+            outbox.drain(smtp)
+
+        unsent = [
+            outbox_message.subject
+            for outbox_message in OutboxMessage.query.where(
+                OutboxMessage.sent_at.is_(None)
+            )
+        ]
+        assert subjects(smtp) == ["first", "second"]
+        assert unsent == ["crash"]
+
+
+def test_digest_links_outside_requests(app: Flask) -> None:
+    """Digests are rendered by worker threads and commands, outside of
+    any request, with links to SITE_URL."""
+    with app.app_context():
+        for i in range(2):
+            outbox.enqueue(
+                Message(
+                    subject=f"Request {i}",
+                    html="<p>Hi</p>",
+                    recipients=["u0@princeton.edu"],
+                ),
+                kind="ride_request",
+                summary=f"<li>Request {i}</li>",
+            )
+        db.session.commit()
+
+        # Past the digest's quiet window
+        OutboxMessage.query.update(
+            {
+                OutboxMessage.created_at: datetime.utcnow()
+                - timedelta(hours=1)
+            }
+        )
+        db.session.commit()
+
+        smtp = FakeSMTP()
+        assert outbox.drain(smtp) == 1
+
+    (digest,) = smtp.sent
+    assert digest.subject == "2 new ride requests"
+    assert "<li>Request 1</li>" in digest.html
+    assert app.config["SITE_URL"] + "/account/rides" in digest.html
+
+
+def test_due_in(app: Flask) -> None:
+    """Digests are due once their quiet window has passed, and other
+    messages right away."""
+    with app.app_context():
+        assert outbox.due_in() is None
+
+        outbox.enqueue(
+            Message(
+                subject="Request",
+                html="<p>Hi</p>",
+                recipients=["u0@princeton.edu"],
+            ),
+            kind="ride_request",
+            summary="<li>Request</li>",
+        )
+        db.session.commit()
+        due_in = outbox.due_in()
+        quiet_window = app.config["DIGEST_QUIET_WINDOW"]
+        assert due_in is not None
+        assert quiet_window - 5 < due_in <= quiet_window
+
+    add_messages(app, "now")
+    with app.app_context():
+        due_in = outbox.due_in()
+        assert due_in is not None and due_in <= 0
@@ -0,0 +1,42 @@
+"""Connection pool configuration (see pools.py)."""
+
+# ----------------------------------------------------------------------
+
+import pytest
+from flask import Flask
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import NullPool
+
+from tigertaxi import pools
+from tigertaxi.pools import MeteredQueuePool
+
+# ----------------------------------------------------------------------
+
+POSTGRES_URL = make_url("postgresql+psycopg2://tigertaxi@db/tigertaxi")
+
+
+def test_postgres_engines_are_metered(app: Flask) -> None:
+    """Engines keep their own pool, with the configured options."""
+    options = pools.configure_engine(
+        app, POSTGRES_URL, dict(app.config["SQLALCHEMY_ENGINE_OPTIONS"])
+    )
+
+    assert options["poolclass"] is MeteredQueuePool
+    assert options["pool_size"] == 5
+    assert options["pool_pre_ping"] is True
+
+
+def test_pgbouncer_does_the_pooling(
+    app: Flask, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Through PgBouncer, engines open a connection per checkout, so the
+    pool options are dropped."""
+    monkeypatch.setitem(app.config, "DB_PGBOUNCER", True)
+    options = pools.configure_engine(
+        app, POSTGRES_URL, dict(app.config["SQLALCHEMY_ENGINE_OPTIONS"])
+    )
+
+    assert options == {
+        "poolclass": NullPool,
+        "use_native_hstore": False,
+    }
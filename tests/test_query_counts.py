@@ -0,0 +1,125 @@
+"""Query counts of the busiest pages.
+
+Pages must be built with a fixed number of queries however many rides
+they show, rather than one or more queries per ride.
+"""
+
+# ----------------------------------------------------------------------
+
+from typing import Any, Callable, Dict, List, Tuple
+
+import pytest
+from flask import Flask
+from flask.testing import FlaskClient
+
+from tigertaxi.extensions import db
+from tigertaxi.models import RideRequest
+
+# ----------------------------------------------------------------------
+
+
+@pytest.mark.parametrize("use_index", [False, True])
+def test_search_queries_dont_grow_with_results(
+    app: Flask,
+    users: List[int],
+    add_rides: Callable[..., List[int]],
+    login: Callable[[str], FlaskClient],
+    count_queries: Callable[[], Any],
+    use_index: bool,
+) -> None:
+    """Searching runs as many queries for ten results as for one."""
+    app.config["RIDE_INDEX_ENABLED"] = use_index
+    client = login("u2")
+    client.get("/api/v1/rides?tab=from")
+
+    counts = []
+    for count in (1, 10):
+        add_rides(users[count % 2], count)
+        with count_queries() as statements:
+            response = client.get("/api/v1/rides?tab=from&limit=50")
+        assert response.status_code == 200
+        counts.append(len(statements))
+
+    page = response.json
+    assert page is not None and len(page["rides"]) == 11
+    assert counts[0] == counts[1]
+    assert counts[1] <= 6
+
+
+def test_my_rides_queries_dont_grow_with_rides(
+    app: Flask,
+    users: List[int],
+    add_rides: Callable[..., List[int]],
+    login: Callable[[str], FlaskClient],
+    count_queries: Callable[[], Any],
+) -> None:
+    """The My Rides page runs as many queries for many rides and
+    requests as for one of each."""
+    client = login("u2")
+    client.get("/account/rides")
+
+    counts = []
+    for count in (1, 5):
+        add_rides(users[2], count)
+
+        # Requests to other users' rides, half of them accepted
+        with app.app_context():
+            for i, ride_id in enumerate(add_rides(users[0], count)):
+                ride_request = RideRequest(
+                    ride_id=ride_id, user_id=users[2]
+                )
+                db.session.add(ride_request)
+                db.session.commit()
+                if i % 2 == 0:
+                    ride_request.accept()  # type: ignore[no-untyped-call]
+                    db.session.commit()
+
+        with count_queries() as statements:
+            response = client.get("/account/rides")
+        assert response.status_code == 200
+        counts.append(len(statements))
+
+    assert counts[0] == counts[1]
+
+
+def test_user_loaded_once_per_request(
+    users: List[int],
+    add_rides: Callable[..., List[int]],
+    login: Callable[[str], FlaskClient],
+    count_queries: Callable[[], Any],
+) -> None:
+    """Each request looks up the logged in user once: by netid on the
+    first request of a session, and by id from then on."""
+    add_rides(users[0], 3)
+    client = login("u2")
+
+    def user_lookups(method: str, url: str, **kwargs: Any) -> List[str]:
+        with count_queries() as statements:
+            response = client.open(url, method=method, **kwargs)
+        assert response.status_code in (200, 302)
+        return [
+            statement
+            for statement in statements
+            if statement.startswith("SELECT users.id AS users_id")
+        ]
+
+    (lookup,) = user_lookups("GET", "/account/settings")
+    assert "users.netid = ?" in lookup
+
+    requests: List[Tuple[str, str, Dict[str, Any]]] = [
+        ("GET", "/search", {}),
+        ("GET", "/account/rides", {}),
+        ("GET", "/account/history", {}),
+        ("GET", "/api/v1/rides?tab=from", {}),
+        (
+            "POST",
+            "/users/u2/update",
+            {
+                "data": {"disp_name": "Tiger"},
+                "headers": {"Referer": "/account/settings"},
+            },
+        ),
+    ]
+    for method, url, kwargs in requests:
+        (lookup,) = user_lookups(method, url, **kwargs)
+        assert "users.id = ?" in lookup
@@ -0,0 +1,160 @@
+"""Read replica routing (see replicas.py).
+
+The replica is a second SQLite database, which is brought up to date
+with the primary by copying it over, so anything written afterwards is
+missing from it as if replication were lagging.
+"""
+
+# ----------------------------------------------------------------------
+
+import sqlite3
+from contextlib import closing, contextmanager
+from typing import Any, Callable, Dict, Iterator, List
+
+import pytest
+from flask import Flask
+from flask.testing import FlaskClient
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+from config import Config
+from tigertaxi import create_app
+from tigertaxi.extensions import db, mailer
+from tigertaxi.invalidation import invalidation_bus
+
+# ----------------------------------------------------------------------
+
+SEARCH_URL = "/api/v1/rides?tab=from"
+
+
+@pytest.fixture
+def replica_app(
+    app: Flask, monkeypatch: pytest.MonkeyPatch
+) -> Iterator[Flask]:
+    """An app which sends its read-only views to a replica."""
+    primary = make_url(app.config["SQLALCHEMY_DATABASE_URI"])
+    assert primary.database is not None
+    replica = primary.set(
+        database=primary.database.replace("primary", "replica")
+    )
+    monkeypatch.setattr(
+        Config, "SQLALCHEMY_BINDS", {"replica_1": str(replica)}
+    )
+    monkeypatch.setattr(Config, "REPLICA_BINDS", ["replica_1"])
+    monkeypatch.setattr(Config, "REPLICA_READ_YOUR_WRITES", 60.0)
+
+    yield create_app()
+
+    # The dispatcher and invalidation bus are shared with the other
+    # tests' app
+    mailer.init_app(app)
+    invalidation_bus.init_app(app)
+
+
+def replicate(app: Flask) -> None:
+    """Brings the replica up to date with the primary."""
+    with app.app_context():
+        primary = db.engine.url.database
+        replica = db.get_engine(app, bind="replica_1").url.database
+    with closing(sqlite3.connect(primary)) as source, closing(
+        sqlite3.connect(replica)
+    ) as target:
+        source.backup(target)
+
+
+@contextmanager
+def count_by_database(app: Flask) -> Iterator[Dict[str, List[str]]]:
+    """Records the statements run on the primary and the replica."""
+    statements: Dict[str, List[str]] = {"primary": [], "replica": []}
+    with app.app_context():
+        engines = {
+            "primary": db.engine,
+            "replica": db.get_engine(app, bind="replica_1"),
+        }
+
+    def recorder(name: str) -> Callable[..., None]:
+        def record(
+            conn: Any, cursor: Any, statement: str, *args: Any
+        ) -> None:
+            statements[name].append(statement)
+
+        return record
+
+    records = {name: recorder(name) for name in engines}
+    for name, engine in engines.items():
+        event.listen(engine, "before_cursor_execute", records[name])
+    try:
+        yield statements
+    finally:
+        for name, engine in engines.items():
+            event.remove(engine, "before_cursor_execute", records[name])
+
+
+def login(app: Flask, netid: str) -> FlaskClient:
+    """Returns a client of the given app logged in as netid."""
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["CAS_USERNAME"] = netid
+        session["CAS_ATTRIBUTES"] = {
+            "cas:mail": f"{netid}@princeton.edu",
+            "cas:displayname": netid,
+        }
+    return client
+
+
+def viewer_statuses(client: FlaskClient) -> List[str]:
+    """Returns the viewer's status for each ride in the search
+    results."""
+    response = client.get(SEARCH_URL)
+    assert response.status_code == 200
+    assert response.json is not None
+    return [ride["viewer_status"] for ride in response.json["rides"]]
+
+
+def test_reads_go_to_replica(
+    replica_app: Flask,
+    users: List[int],
+    add_rides: Callable[..., List[int]],
+) -> None:
+    """Read-only views are served entirely by the replica."""
+    add_rides(users[0], 2)
+    replicate(replica_app)
+    client = login(replica_app, "u2")
+
+    with count_by_database(replica_app) as statements:
+        assert len(viewer_statuses(client)) == 2
+
+    assert statements["replica"]
+    assert statements["primary"] == []
+
+
+def test_writes_and_reads_after_them_go_to_primary(
+    replica_app: Flask,
+    users: List[int],
+    add_rides: Callable[..., List[int]],
+) -> None:
+    """Writes go to the primary, and so do the writer's reads for a
+    while afterwards, so they see their change before the replica
+    does."""
+    (ride_id,) = add_rides(users[0], 1)
+    replicate(replica_app)
+    writer = login(replica_app, "u2")
+    other = login(replica_app, "u3")
+
+    with count_by_database(replica_app) as statements:
+        response = writer.post(
+            f"/rides/{ride_id}/requests", headers={"Referer": "/search"}
+        )
+        assert response.status_code == 302
+    assert any(s.startswith("INSERT") for s in statements["primary"])
+    assert statements["replica"] == []
+
+    with count_by_database(replica_app) as statements:
+        assert viewer_statuses(writer) == ["pending"]
+    assert statements["primary"]
+    assert statements["replica"] == []
+
+    # Everyone else still reads from the lagging replica
+    with count_by_database(replica_app) as statements:
+        assert viewer_statuses(other) == ["open"]
+    assert statements["primary"] == []
@@ -0,0 +1,163 @@
+"""Accepting ride requests against ride capacity (see RideRequest.accept
+and RideRequest.decide_many)."""
+
+# ----------------------------------------------------------------------
+
+from typing import Callable, List
+
+from flask import Flask
+
+from tigertaxi import transactions
+from tigertaxi.extensions import db
+from tigertaxi.models import Ride, RideRequest, User
+
+# ----------------------------------------------------------------------
+
+Outcome = RideRequest.AcceptOutcome
+
+
+def add_requests(
+    app: Flask, ride_id: int, user_ids: List[int]
+) -> List[int]:
+    """Adds a pending request for the ride from each user."""
+    with app.app_context():
+        ride_requests = [
+            RideRequest(ride_id=ride_id, user_id=user_id)
+            for user_id in user_ids
+        ]
+        db.session.add_all(ride_requests)
+        db.session.commit()
+        return [ride_request.id for ride_request in ride_requests]
+
+
+def accept(ride_req_id: int) -> "RideRequest.AcceptOutcome":
+    """Accepts the ride request with the given id."""
+    ride_req = db.session.get(RideRequest, ride_req_id)
+    outcome: RideRequest.AcceptOutcome = ride_req.accept()
+    return outcome
+
+
+def test_accept_takes_a_seat(
+    app: Flask,
+    users: List[int],
+    add_rides: Callable[..., List[int]],
+) -> None:
+    """An accepted request takes one of the ride's seats."""
+    (ride_id,) = add_rides(users[0], 1)
+    (ride_req_id,) = add_requests(app, ride_id, [users[1]])
+
+    with app.app_context():
+        riders_count = db.session.get(Ride, ride_id).riders_count
+        assert accept(ride_req_id) == Outcome.ACCEPTED
+
+        db.session.expire_all()
+        ride_req = db.session.get(RideRequest, ride_req_id)
+        assert ride_req.status == RideRequest.Status.ACCEPTED.value
+        assert ride_req.ride.riders_count == riders_count + 1
+
+
+def test_accept_full_ride(
+    app: Flask,
+    users: List[int],
+    add_rides: Callable[..., List[int]],
+) -> None:
+    """A request for a ride with no seats left stays pending."""
+    (ride_id,) = add_rides(users[0], 1, capacity=2)
+    first, second = add_requests(app, ride_id, users[1:3])
+
+    with app.app_context():
+        assert accept(first) == Outcome.ACCEPTED
+        assert accept(second) == Outcome.FULL
+        db.session.commit()
+
+        db.session.expire_all()
+        ride = db.session.get(Ride, ride_id)
+        assert ride.riders_count == ride.capacity
+        assert db.session.get(RideRequest, second).is_pending()
+
+
+def test_accept_request_not_pending(
+    app: Flask,
+    users: List[int],
+    add_rides: Callable[..., List[int]],
+) -> None:
+    """A request which isn't pending anymore can't be accepted, and
+    gives back the seat it took."""
+    (ride_id,) = add_rides(users[0], 1)
+    (ride_req_id,) = add_requests(app, ride_id, [users[1]])
+
+    with app.app_context():
+        assert accept(ride_req_id) == Outcome.ACCEPTED
+        riders_count = db.session.get(Ride, ride_id).riders_count
+
+        assert accept(ride_req_id) == Outcome.NOT_PENDING
+        db.session.commit()
+
+        db.session.expire_all()
+        assert (
+            db.session.get(Ride, ride_id).riders_count == riders_count
+        )
+
+
+def decide_many(
+    to_accept: List[int], to_reject: List[int]
+) -> "RideRequest.AcceptOutcome":
+    """Accepts and rejects the ride requests with the given ids."""
+    outcome: RideRequest.AcceptOutcome = RideRequest.decide_many(
+        [db.session.get(RideRequest, i) for i in to_accept],
+        [db.session.get(RideRequest, i) for i in to_reject],
+    )
+    return outcome
+
+
+def test_decide_many_over_capacity_changes_nothing(
+    app: Flask,
+    users: List[int],
+    add_rides: Callable[..., List[int]],
+) -> None:
+    """Decisions which would fill a ride past its capacity are all
+    rolled back, including the seats already taken on other rides,
+    leaving the rest of the transaction alone."""
+    (open_ride,) = add_rides(users[0], 1)
+    (full_ride,) = add_rides(users[0], 1, capacity=1)
+    (first,) = add_requests(app, open_ride, [users[1]])
+    second, third = add_requests(app, full_ride, users[2:4])
+
+    with app.app_context():
+        riders_count = db.session.get(Ride, open_ride).riders_count
+        with transactions.transaction():
+            db.session.get(User, users[0]).disp_name = "Renamed"
+            db.session.flush()
+            assert decide_many([first, second], [third]) == Outcome.FULL
+
+        db.session.expire_all()
+        assert db.session.get(User, users[0]).disp_name == "Renamed"
+        assert (
+            db.session.get(Ride, open_ride).riders_count == riders_count
+        )
+        for ride_req_id in (first, second, third):
+            assert db.session.get(RideRequest, ride_req_id).is_pending()
+
+
+def test_decide_many_not_pending_gives_back_seats(
+    app: Flask,
+    users: List[int],
+    add_rides: Callable[..., List[int]],
+) -> None:
+    """Seats taken before finding a request which isn't pending anymore
+    are given back."""
+    (ride_id,) = add_rides(users[0], 1, capacity=4)
+    first, second = add_requests(app, ride_id, users[1:3])
+
+    with app.app_context():
+        assert accept(second) == Outcome.ACCEPTED
+        riders_count = db.session.get(Ride, ride_id).riders_count
+
+        assert decide_many([first, second], []) == Outcome.NOT_PENDING
+        db.session.commit()
+
+        db.session.expire_all()
+        assert (
+            db.session.get(Ride, ride_id).riders_count == riders_count
+        )
+        assert db.session.get(RideRequest, first).is_pending()
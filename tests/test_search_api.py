@@ -0,0 +1,113 @@
+"""Caching and validation of the ride search endpoints."""
+
+# ----------------------------------------------------------------------
+
+from typing import Callable, List
+
+from flask import Flask
+from flask.testing import FlaskClient
+
+from tigertaxi.extensions import db
+from tigertaxi.models import Rider, RideRequest
+
+# ----------------------------------------------------------------------
+
+SEARCH_URL = "/api/v1/rides?tab=from"
+HTML_SEARCH_URL = "/rides?tab=from"
+
+
+def revalidate(
+    client: FlaskClient, etag: str, url: str = SEARCH_URL
+) -> int:
+    """Returns the status of a conditional search request."""
+    response = client.get(url, headers={"If-None-Match": etag})
+    return response.status_code
+
+
+def test_unchanged_page_is_not_modified(
+    users: List[int],
+    add_rides: Callable[..., List[int]],
+    login: Callable[[str], FlaskClient],
+) -> None:
+    """A page is answered with 304 until something on it changes."""
+    add_rides(users[0], 3)
+    client = login("u2")
+
+    response = client.get(SEARCH_URL)
+    assert response.status_code == 200
+    etag, _ = response.get_etag()
+    assert etag is not None
+    assert revalidate(client, etag) == 304
+
+    add_rides(users[1], 1)
+    assert revalidate(client, etag) == 200
+
+
+def test_etag_follows_seats_and_viewer_riders(
+    app: Flask,
+    users: List[int],
+    add_rides: Callable[..., List[int]],
+    login: Callable[[str], FlaskClient],
+) -> None:
+    """Seats being taken and the viewer leaving a ride change the tag,
+    even though no ride is added or removed."""
+    (ride_id,) = add_rides(users[0], 1)
+    client = login("u2")
+
+    def accept(user_id: int) -> None:
+        with app.app_context():
+            ride_request = RideRequest(ride_id=ride_id, user_id=user_id)
+            db.session.add(ride_request)
+            db.session.commit()
+            ride_request.accept()  # type: ignore[no-untyped-call]
+
+    def current_etag() -> str:
+        etag, _ = client.get(SEARCH_URL).get_etag()
+        assert etag is not None
+        return etag
+
+    etag = current_etag()
+    accept(users[3])
+    assert revalidate(client, etag) == 200
+
+    accept(users[2])
+    etag = current_etag()
+    with app.app_context():
+        rider = Rider.query.filter_by(user_id=users[2]).one()
+        rider.remove()
+    assert revalidate(client, etag) == 200
+
+
+def test_invalid_departure_date_is_rejected(
+    login: Callable[[str], FlaskClient],
+) -> None:
+    """Unparseable dates and UTC offsets are client errors."""
+    client = login("u2")
+
+    for query in (
+        "&departure_date=tomorrow",
+        "&departure_date=2030-01-01&utc_offset=east",
+    ):
+        response = client.get(SEARCH_URL + query)
+        assert response.status_code == 400
+        assert "error" in (response.get_json() or {})
+
+
+def test_html_search_is_not_modified(
+    users: List[int],
+    add_rides: Callable[..., List[int]],
+    login: Callable[[str], FlaskClient],
+) -> None:
+    """The deprecated HTML search is tagged by the rides it lists."""
+    add_rides(users[0], 2)
+    client = login("u2")
+
+    response = client.get(HTML_SEARCH_URL)
+    assert response.status_code == 200
+    assert b"Newark Airport 1" in response.data
+    etag, _ = response.get_etag()
+    assert etag is not None
+    assert revalidate(client, etag, HTML_SEARCH_URL) == 304
+
+    add_rides(users[1], 1)
+    assert revalidate(client, etag, HTML_SEARCH_URL) == 200
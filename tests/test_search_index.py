@@ -0,0 +1,68 @@
+"""Ride searches from the in-process index and from the database (see
+search_index.py and Ride.query_search)."""
+
+# ----------------------------------------------------------------------
+
+from datetime import datetime, timedelta
+from typing import List
+
+from flask import Flask
+from sqlalchemy.dialects import postgresql
+
+from tigertaxi.models import Ride, ride_departure_limit
+from tigertaxi.search_index import (
+    RideEntry,
+    UpcomingRidesIndex,
+    like_pattern,
+    tokenize,
+)
+
+# ----------------------------------------------------------------------
+
+
+def index_of(*destinations: str) -> UpcomingRidesIndex:
+    """Returns an index of rides from Princeton to each destination,
+    with ids counting up from 1."""
+    index = UpcomingRidesIndex()
+    departure = datetime.utcnow() + timedelta(days=1)
+    index.load(
+        RideEntry(i, "Princeton", destination, departure)
+        for i, destination in enumerate(destinations, start=1)
+    )
+    return index
+
+
+def search(index: UpcomingRidesIndex, term: str) -> List[int]:
+    """Returns the ids of the rides from Princeton matching term."""
+    return index.search(ride_departure_limit(), tab="from", term=term)
+
+
+def test_index_matches_like_wildcards_literally() -> None:
+    """The index matches "%" and "_" in a term as themselves."""
+    index = index_of("Gate 50% Shuttle", "500 Nassau St", "Terminal_B")
+
+    assert search(index, "50%") == [1]
+    assert search(index, "l_b") == [3]
+
+
+def test_database_matches_like_wildcards_literally(app: Flask) -> None:
+    """The database's substring match escapes "%" and "_" in a term, so
+    it finds the same rides as the index."""
+    assert like_pattern("50%_\\") == "%50\\%\\_\\\\%"
+
+    with app.app_context():
+        query = Ride.query_search(tab="from", term="50%").statement
+        compiled = query.compile(dialect=postgresql.dialect())
+    assert "ESCAPE" in str(compiled)
+    assert "%50\\%%" in compiled.params.values()
+
+
+def test_index_only_stems_plurals() -> None:
+    """The index drops a trailing plural "s" but, unlike PostgreSQL, no
+    other suffix."""
+    assert tokenize("The Airports") == ["airport"]
+    assert tokenize("Parking") == ["parking"]
+
+    index = index_of("Newark Airport", "Park Ave")
+    assert search(index, "airports") == [1]
+    assert search(index, "parking") == []
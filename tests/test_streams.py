@@ -0,0 +1,59 @@
+"""Live search and My Rides streams (see streams.py)."""
+
+# ----------------------------------------------------------------------
+
+from typing import Any, Callable, Generator, List, cast
+
+from flask import Flask
+
+from tigertaxi.streams import ride_feed, ride_search_events
+from tigertaxi.viewmodels import RideChange
+
+# ----------------------------------------------------------------------
+
+
+def removed(ride_id: int) -> RideChange:
+    """Returns the change of a deleted ride."""
+    return RideChange(ride_id, None, set(), {})
+
+
+def test_changes_are_not_loaded_without_streams(
+    app: Flask,
+    users: List[int],
+    add_rides: Callable[..., List[int]],
+    count_queries: Callable[[], Any],
+) -> None:
+    """Changed rides are neither loaded nor broadcast while no stream is
+    open."""
+    ride_ids = add_rides(users[0], 2)
+    latest = ride_feed.latest()
+
+    with app.app_context(), count_queries() as statements:
+        ride_feed.publish_changes(set(ride_ids))
+        ride_feed.publish_changes(None)
+
+    assert statements == []
+    assert ride_feed.latest() == latest
+
+
+def test_only_matching_rides_are_removed() -> None:
+    """Rides are only removed from a live search if they matched it."""
+    events = cast(
+        Generator[str, None, None],
+        ride_search_events(
+            1, "from", None, None, {1}, max_age=60, keepalive=0.01
+        ),
+    )
+    try:
+        assert next(events).startswith("retry:")
+        ride_feed.publish([removed(1), removed(2)])
+
+        assert next(events) == 'event: remove\ndata: {"id":1}\n\n'
+        assert next(events) == ": keepalive\n\n"
+
+        # Already removed from the page
+        ride_feed.publish([removed(1)])
+        assert next(events) == ": keepalive\n\n"
+    finally:
+        events.close()
+    assert ride_feed.subscribers == 0
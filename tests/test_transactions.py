@@ -0,0 +1,171 @@
+"""Units of work and the commits deferred to them (see
+transactions.py)."""
+
+# ----------------------------------------------------------------------
+
+from typing import Any, Callable, Iterator, List
+
+import pytest
+from flask import Flask
+from flask.testing import FlaskClient
+from sqlalchemy import func, select
+
+from config import Config
+from tigertaxi import create_app, transactions
+from tigertaxi.extensions import db, mailer
+from tigertaxi.invalidation import invalidation_bus
+from tigertaxi.models import OutboxMessage, Ride, Rider, RideRequest
+
+# ----------------------------------------------------------------------
+
+
+@pytest.fixture(params=[True, False], ids=["per-request", "per-call"])
+def uow_app(
+    app: Flask, monkeypatch: pytest.MonkeyPatch, request: Any
+) -> Iterator[Flask]:
+    """An app with and without a unit of work per request."""
+    monkeypatch.setattr(
+        Config, "UNIT_OF_WORK_PER_REQUEST", request.param
+    )
+
+    yield create_app()
+
+    # The dispatcher and invalidation bus are shared with the other
+    # tests' app
+    mailer.init_app(app)
+    invalidation_bus.init_app(app)
+
+
+def login(app: Flask, netid: str) -> FlaskClient:
+    """Returns a client of the given app logged in as netid."""
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["CAS_USERNAME"] = netid
+        session["CAS_ATTRIBUTES"] = {
+            "cas:mail": f"{netid}@princeton.edu",
+            "cas:displayname": netid,
+        }
+    return client
+
+
+def committed_count(model: Any) -> int:
+    """Counts the committed rows of model, from outside the session."""
+    with db.engine.connect() as connection:
+        count: int = connection.execute(
+            select(func.count()).select_from(model.__table__)
+        ).scalar_one()
+    return count
+
+
+def add_requests(
+    app: Flask, ride_id: int, user_ids: List[int]
+) -> List[int]:
+    """Adds a pending request for the ride from each user."""
+    with app.app_context():
+        ride_requests = [
+            RideRequest(ride_id=ride_id, user_id=user_id)
+            for user_id in user_ids
+        ]
+        db.session.add_all(ride_requests)
+        db.session.commit()
+        return [ride_request.id for ride_request in ride_requests]
+
+
+def test_commits_are_deferred_to_the_unit_of_work(
+    app: Flask,
+    users: List[int],
+    add_rides: Callable[..., List[int]],
+) -> None:
+    """commit() inside a unit of work leaves the changes for the
+    outermost block to commit."""
+    (ride_id,) = add_rides(users[0], 1)
+    (ride_req_id,) = add_requests(app, ride_id, [users[1]])
+
+    with app.app_context():
+        riders = committed_count(Rider)
+        with transactions.transaction():
+            with transactions.transaction():
+                ride_req = db.session.get(RideRequest, ride_req_id)
+                outcome = ride_req.accept()
+                assert outcome == RideRequest.AcceptOutcome.ACCEPTED
+            assert committed_count(Rider) == riders
+        assert committed_count(Rider) == riders + 1
+
+
+def test_unit_of_work_is_rolled_back_on_error(
+    app: Flask,
+    users: List[int],
+    add_rides: Callable[..., List[int]],
+) -> None:
+    """Nothing done in a unit of work which raises is committed."""
+    (ride_id,) = add_rides(users[0], 1)
+    (ride_req_id,) = add_requests(app, ride_id, [users[1]])
+
+    with app.app_context():
+        riders_count = db.session.get(Ride, ride_id).riders_count
+        with pytest.raises(RuntimeError):
+            with transactions.transaction():
+                db.session.get(RideRequest, ride_req_id).accept()
+                raise RuntimeError("Failed after accepting")
+
+        ride_req = db.session.get(RideRequest, ride_req_id)
+        assert ride_req.is_pending()
+        assert (
+            db.session.get(Ride, ride_id).riders_count == riders_count
+        )
+
+
+def test_accept_commits_its_notification(
+    uow_app: Flask,
+    users: List[int],
+    add_rides: Callable[..., List[int]],
+) -> None:
+    """The acceptance email is committed to the outbox along with the
+    acceptance, with or without a unit of work per request."""
+    (ride_id,) = add_rides(users[0], 1)
+    (ride_req_id,) = add_requests(uow_app, ride_id, [users[1]])
+
+    response = login(uow_app, "u0").post(
+        f"/ride_requests/{ride_req_id}/accept",
+        headers={"Referer": "/my_rides"},
+    )
+    assert response.status_code == 302
+
+    with uow_app.app_context():
+        ride_req = db.session.get(RideRequest, ride_req_id)
+        assert ride_req.status == RideRequest.Status.ACCEPTED.value
+        assert committed_count(OutboxMessage) == 1
+        (message,) = OutboxMessage.query.all()
+        assert message.recipient == "u1@princeton.edu"
+
+
+def test_bulk_decisions_commit_their_notifications(
+    uow_app: Flask,
+    users: List[int],
+    add_rides: Callable[..., List[int]],
+) -> None:
+    """Bulk decisions commit every email to the outbox along with the
+    decisions, with or without a unit of work per request."""
+    (ride_id,) = add_rides(users[0], 1)
+    accepted, rejected = add_requests(uow_app, ride_id, users[1:3])
+
+    response = login(uow_app, "u0").post(
+        "/ride_requests/bulk",
+        data={
+            f"decision-{accepted}": "accept",
+            f"decision-{rejected}": "reject",
+        },
+        headers={"Referer": "/my_rides"},
+    )
+    assert response.status_code == 302
+
+    with uow_app.app_context():
+        statuses = {
+            ride_req.id: ride_req.status
+            for ride_req in RideRequest.query.all()
+        }
+        assert statuses == {
+            accepted: RideRequest.Status.ACCEPTED.value,
+            rejected: RideRequest.Status.REJECTED.value,
+        }
+        assert committed_count(OutboxMessage) == 2
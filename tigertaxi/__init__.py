@@ -15,9 +15,15 @@ from logging.handlers import RotatingFileHandler
 
 from flask import Flask, Response, redirect, request
 
+from tigertaxi import outbox, transactions
 from tigertaxi.blueprint import main_bp
+from tigertaxi.commands import outbox_cli, rides_cli
 from tigertaxi.errors import internal_error, not_found_error
-from tigertaxi.extensions import cas, db, mail
+from tigertaxi.extensions import cas, db, mail, mailer
+from tigertaxi.invalidation import invalidation_bus
+from tigertaxi.locations import location_index
+from tigertaxi.models import refresh_index_entries
+from tigertaxi.streams import my_rides_feed, ride_feed
 
 # ----------------------------------------------------------------------
 
@@ -39,10 +45,35 @@ def create_app() -> Flask:
     db.init_app(app)  # type: ignore[no-untyped-call]
     cas.init_app(app)
     mail.init_app(app)
+    mailer.init_app(app)
+    mailer.drain_outbox = outbox.drain
+    mailer.outbox_due_in = outbox.due_in
+
+    # Request-scoped units of work
+    transactions.init_app(app)
+
+    # Cross-worker invalidation of the in-process caches
+    invalidation_bus.register("Ride", refresh_index_entries)
+    invalidation_bus.register("RideLocation", location_index.invalidate)
+
+    # Live search results and My Rides pages are fed by the same
+    # changes
+    invalidation_bus.register("Ride", ride_feed.publish_changes)
+    invalidation_bus.register(
+        "Ride", my_rides_feed.publish_ride_changes
+    )
+    invalidation_bus.register(
+        "RideRequest", my_rides_feed.publish_request_changes
+    )
+    invalidation_bus.init_app(app)
 
     # Application routes
     app.register_blueprint(main_bp)
 
+    # Command line tools
+    app.cli.add_command(rides_cli)
+    app.cli.add_command(outbox_cli)
+
     # Error handlers
     app.register_error_handler(404, not_found_error)
     app.register_error_handler(500, internal_error)
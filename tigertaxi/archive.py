@@ -0,0 +1,144 @@
+"""Archival of departed rides for TigerTaxi.
+
+Rides which departed more than RIDE_ARCHIVE_AFTER_DAYS days ago are
+moved, along with their riders and ride requests, from the hot tables
+into the archived_* tables by `flask rides archive`. The hot tables
+(and their indexes) then only grow with the number of recent and
+upcoming rides rather than with the site's whole history, while past
+rides remain available to the Ride History page.
+
+Rides are moved in batches of RIDE_ARCHIVE_BATCH_SIZE, each in its own
+transaction, so the job never holds locks on many rows at once and can
+be interrupted at any point without losing or duplicating anything.
+"""
+
+# ----------------------------------------------------------------------
+
+from datetime import datetime, timedelta
+from typing import Any, List, Optional
+
+from flask import current_app
+from sqlalchemy import Table, delete, insert, literal, select
+
+from tigertaxi.extensions import db
+from tigertaxi.models import (
+    ArchivedRide,
+    ArchivedRider,
+    ArchivedRideRequest,
+    Ride,
+    Rider,
+    RideRequest,
+)
+
+# ----------------------------------------------------------------------
+
+
+def archive_cutoff(now: Optional[datetime] = None) -> datetime:
+    """Returns the departure time before which rides are archived."""
+    if now is None:
+        now = datetime.utcnow()
+    days = current_app.config["RIDE_ARCHIVE_AFTER_DAYS"]
+    return now - timedelta(days=days)
+
+
+def archive_rides(cutoff: datetime, limit: Optional[int] = None) -> int:
+    """Archives every ride which departed before the cutoff and returns
+    the number of rides archived.
+
+    When given, at most limit batches are archived.
+    """
+    batch_size = current_app.config["RIDE_ARCHIVE_BATCH_SIZE"]
+    archived = 0
+    batches = 0
+
+    while limit is None or batches < limit:
+        moved = archive_batch(cutoff, batch_size)
+        archived += moved
+        batches += 1
+        if moved < batch_size:
+            break
+
+    return archived
+
+
+def archive_batch(cutoff: datetime, batch_size: int) -> int:
+    """Moves up to batch_size departed rides, with their riders and
+    requests, into the archive tables in a single transaction.
+
+    Returns the number of rides moved.
+    """
+    try:
+        # Locking the rides also keeps riders and requests from being
+        # added to them until they are gone
+        ride_ids: List[int] = [
+            ride_id
+            for (ride_id,) in db.session.query(Ride.id)
+            .where(Ride.departure_datetime < cutoff)
+            .order_by(Ride.departure_datetime)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        ]
+        if len(ride_ids) == 0:
+            return 0
+
+        archived_at = datetime.utcnow()
+        rides = Ride.__table__
+        requests = RideRequest.__table__
+        riders = Rider.__table__
+
+        # Copy parents before children, then delete children first, so
+        # foreign keys hold throughout
+        copy_rows(
+            rides,
+            ArchivedRide.__table__,
+            rides.c.id,
+            ride_ids,
+            archived_at,
+        )
+        copy_rows(
+            requests,
+            ArchivedRideRequest.__table__,
+            requests.c.ride_id,
+            ride_ids,
+            archived_at,
+        )
+        copy_rows(
+            riders,
+            ArchivedRider.__table__,
+            riders.c.ride_id,
+            ride_ids,
+            archived_at,
+        )
+        for table, column in (
+            (riders, riders.c.ride_id),
+            (requests, requests.c.ride_id),
+            (rides, rides.c.id),
+        ):
+            db.session.execute(
+                delete(table).where(column.in_(ride_ids))
+            )
+
+        db.session.commit()
+        return len(ride_ids)
+
+    finally:
+        db.session.rollback()
+
+
+def copy_rows(
+    source: Table,
+    archive: Table,
+    column: Any,
+    ride_ids: List[int],
+    archived_at: datetime,
+) -> None:
+    """Copies the rows of source whose column is one of the given ride
+    ids into the archive table, server side."""
+    names = [c.name for c in archive.columns if c.name != "archived_at"]
+    rows = select(
+        *[source.c[name] for name in names],
+        literal(archived_at, archive.c.archived_at.type),
+    ).where(column.in_(ride_ids))
+    db.session.execute(
+        insert(archive).from_select(names + ["archived_at"], rows)
+    )
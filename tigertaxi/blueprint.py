@@ -36,6 +36,8 @@ def url(
 url(["/landing"], pages.landing)
 url(["/guide"], pages.ride_guide)
 url(["/account/rides"], pages.user_rides)
+url(["/account/rides/stream"], endpoints.my_rides_stream)
+url(["/account/history"], pages.ride_history)
 url(["/account/settings"], pages.settings)
 url(["/search", "/home", "/index", "/"], pages.search_rides)
 url(["/rides/new"], pages.create_ride)
@@ -52,6 +54,16 @@ url(
     endpoints.rides,
     methods=["GET", "POST"],
 )
+url(
+    ["/api/v1/rides"],
+    endpoints.rides_api,
+    methods=["GET"],
+)
+url(
+    ["/rides/stream"],
+    endpoints.ride_stream,
+    methods=["GET"],
+)
 url(
     ["/rides/<string:ride_id>/leave"],
     endpoints.leave_ride,
@@ -62,6 +74,11 @@ url(
     endpoints.ride_requests,
     methods=["POST"],
 )
+url(
+    ["/ride_requests/bulk"],
+    endpoints.ride_requests_bulk,
+    methods=["POST"],
+)
 url(
     ["/ride_requests/<string:ride_req_id>/accept"],
     endpoints.ride_request_accept,
@@ -82,3 +99,13 @@ url(
     endpoints.remove_rider,
     methods=["POST"],
 )
+url(
+    ["/locations/suggest"],
+    endpoints.location_suggestions,
+    methods=["GET"],
+)
+url(
+    ["/internal/stats"],
+    endpoints.internal_stats,
+    methods=["GET"],
+)
@@ -0,0 +1,146 @@
+"""Command line tools for TigerTaxi.
+
+Defines maintenance commands and workers run through the Flask CLI, such
+as `flask rides check-counts`, `flask rides archive` and `flask outbox
+drain`.
+"""
+
+# ----------------------------------------------------------------------
+
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import func
+
+from tigertaxi import archive, outbox
+from tigertaxi.extensions import db, mail
+from tigertaxi.mailer import SMTPSession
+from tigertaxi.models import Ride, Rider
+
+# ----------------------------------------------------------------------
+
+rides_cli = AppGroup("rides", help="Maintain ride data.")
+outbox_cli = AppGroup("outbox", help="Deliver queued notifications.")
+
+
+@rides_cli.command("check-counts")  # type: ignore[misc,no-untyped-call]
+@click.option(
+    "--fix",
+    is_flag=True,
+    help="Overwrite wrong counts with the number of riders.",
+)
+def check_counts(fix: bool) -> None:
+    """Checks every ride's riders_count against the riders table."""
+    actual = (
+        db.session.query(Rider.ride_id, func.count(Rider.id).label("n"))
+        .group_by(Rider.ride_id)
+        .subquery()
+    )
+    expected = func.coalesce(actual.c.n, 0)
+    mismatches = (
+        db.session.query(Ride.id, Ride.riders_count, expected)
+        .outerjoin(actual, actual.c.ride_id == Ride.id)
+        .where(Ride.riders_count != expected)
+        .order_by(Ride.id)
+        .all()
+    )
+
+    for ride_id, stored, count in mismatches:
+        click.echo(
+            f"Ride {ride_id}: riders_count={stored}, riders={count}"
+        )
+
+    if not mismatches:
+        click.echo("All rider counts are correct.")
+        return
+
+    if not fix:
+        click.echo(
+            f"{len(mismatches)} ride(s) have wrong rider counts."
+        )
+        raise SystemExit(1)
+
+    # Recount inside the update itself, so riders added or removed since
+    # the check above are still counted correctly
+    recount = (
+        db.session.query(func.count(Rider.id))
+        .where(Rider.ride_id == Ride.id)
+        .scalar_subquery()
+    )
+    Ride.query.where(
+        Ride.id.in_([ride_id for ride_id, _, _ in mismatches])
+    ).update({Ride.riders_count: recount}, synchronize_session=False)
+    db.session.commit()
+    click.echo(f"Fixed {len(mismatches)} ride(s).")
+
+
+@rides_cli.command("archive")  # type: ignore[misc,no-untyped-call]
+@click.option(
+    "--days",
+    type=int,
+    default=None,
+    help=(
+        "Archive rides which departed this many days ago "
+        "[default: RIDE_ARCHIVE_AFTER_DAYS]."
+    ),
+)
+@click.option(
+    "--batches",
+    type=int,
+    default=None,
+    help="Stop after this many batches.",
+)
+def archive_departed_rides(
+    days: Optional[int], batches: Optional[int]
+) -> None:
+    """Moves departed rides, with their riders and requests, to the
+    archive tables."""
+    if days is None:
+        cutoff = archive.archive_cutoff()
+    elif days < 1:
+        raise click.BadParameter(
+            "must be at least 1", param_hint="--days"
+        )
+    else:
+        cutoff = datetime.utcnow() - timedelta(days=days)
+
+    archived = archive.archive_rides(cutoff, limit=batches)
+    click.echo(
+        f"Archived {archived} ride(s) which departed before {cutoff}."
+    )
+
+
+@outbox_cli.command("drain")  # type: ignore[misc,no-untyped-call]
+@click.option(
+    "--once",
+    is_flag=True,
+    help="Exit once no messages are due instead of polling.",
+)
+@click.option(
+    "--interval",
+    default=5.0,
+    show_default=True,
+    help="Seconds to wait between polls.",
+)
+def drain_outbox(once: bool, interval: float) -> None:
+    """Delivers notifications from the outbox.
+
+    Several drain workers can safely run at once.
+    """
+    smtp = SMTPSession(mail)
+    try:
+        while True:
+            sent = outbox.drain(smtp)
+            if sent:
+                click.echo(f"Sent {sent} message(s).")
+            else:
+                # Don't hold an idle connection between polls
+                smtp.close()
+            if once:
+                return
+            time.sleep(interval)
+    finally:
+        smtp.close()
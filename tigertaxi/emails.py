@@ -0,0 +1,85 @@
+"""Notification emails for TigerTaxi.
+
+Email bodies are Jinja templates in templates/emails/, rendered with
+autoescaping like any other HTML template. Rendering goes straight
+through the compiled templates, skipping render_template's context
+processors and signals, and is batched, so values shared by every
+email (such as links back to the site) are computed once per batch
+instead of once per message.
+
+Email templates only see the variables they are given plus those from
+shared_context(); Jinja and Flask globals such as url_for() are not
+available to them. Links should be built with site_url_for() instead,
+since emails are also rendered outside of requests (by the mail
+dispatcher's worker thread and by `flask outbox drain`).
+"""
+
+# ----------------------------------------------------------------------
+
+from typing import Any, Dict, List, Mapping, Sequence, Tuple
+from urllib.parse import urlsplit
+
+from flask import current_app, has_request_context, url_for
+from jinja2 import Template
+
+# ----------------------------------------------------------------------
+
+# A template name and the context to render it with
+EmailSpec = Tuple[str, Mapping[str, Any]]
+
+
+def site_url_for(endpoint: str, **values: Any) -> str:
+    """Returns the absolute URL of an endpoint, for links in emails.
+
+    Within a request, the URL points to the host the request was made
+    to. Elsewhere there is no request to take the host from, so the URL
+    is built against SITE_URL.
+    """
+    if has_request_context():
+        return url_for(
+            endpoint, _external=True, _scheme="https", **values
+        )
+
+    site = urlsplit(current_app.config["SITE_URL"])
+    adapter = current_app.url_map.bind(
+        site.netloc,
+        script_name=site.path or "/",
+        url_scheme=site.scheme,
+    )
+    return adapter.build(endpoint, values, force_external=True)
+
+
+def shared_context() -> Dict[str, Any]:
+    """Returns the values available to every email template."""
+    return {
+        "my_rides_url": site_url_for("main_bp.user_rides"),
+        "search_url": site_url_for("main_bp.search_rides"),
+    }
+
+
+def render_emails(emails: Sequence[EmailSpec]) -> List[str]:
+    """Renders each (template name, context) pair and returns the bodies
+    in the same order."""
+    environment = current_app.jinja_env
+    shared = shared_context()
+    templates: Dict[str, Template] = {}
+
+    bodies = []
+    for name, context in emails:
+        template = templates.get(name)
+        if template is None:
+            template = environment.get_template(name)
+            templates[name] = template
+        # A shared context skips copying the environment's globals
+        # into every render, which is most of Jinja's per-call cost.
+        # The module is rendered as soon as it is made.
+        module = template.make_module(
+            {**shared, **context}, shared=True
+        )
+        bodies.append(str(module))
+    return bodies
+
+
+def render_email(template_name: str, **context: Any) -> str:
+    """Renders a single email template with the given context."""
+    return render_emails([(template_name, context)])[0]
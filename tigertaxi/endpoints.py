@@ -18,7 +18,10 @@ from re import compile
 
 from flask import (
     Response,
+    abort,
+    current_app,
     flash,
+    jsonify,
     make_response,
     redirect,
     render_template,
@@ -27,10 +30,27 @@ from flask import (
     url_for,
 )
 from flask_mail import Message
-
-from tigertaxi.extensions import cas, mail
-from tigertaxi.helpers import login_required
-from tigertaxi.models import Ride, Rider, RideRequest, User
+from sqlalchemy.orm import contains_eager, joinedload
+
+from tigertaxi import outbox, transactions
+from tigertaxi.emails import render_email, render_emails
+from tigertaxi.extensions import cas, db
+from tigertaxi.helpers import current_user, login_required
+from tigertaxi.locations import location_index
+from tigertaxi.models import Ride, Rider, RideRequest
+from tigertaxi.pools import pool_stats
+from tigertaxi.replicas import read_only
+from tigertaxi.streams import (
+    my_rides_events,
+    open_streams,
+    ride_search_events,
+)
+from tigertaxi.viewmodels import (
+    decode_cursor,
+    encode_cursor,
+    load_search_results,
+    search_etag,
+)
 
 # ----------------------------------------------------------------------
 
@@ -66,7 +86,7 @@ def user_update(net_id: str) -> Response:
         )
         return redirect(request.referrer)
 
-    user = User.query.filter_by(netid=net_id).first_or_404()
+    user = current_user
 
     if "disp_name" in request.form:
         name = request.form["disp_name"]
@@ -123,16 +143,17 @@ def user_update(net_id: str) -> Response:
 # TODO potentially split into rides/search and rides/create
 # TODO refactor this function and Ride.search to remove all
 # form-specific handling in models.py
+@read_only
 @login_required
 def rides() -> Response:
     """Endpoint for ride search and creation.
 
-    GET requests are used to look up rides based on query parameters.
-    When a user searches for rides on the Search Rides page, AJAX
-    requests are sent to this endpoint, and rendered HTML for the search
-    results is returned. See static/js/searchrides.js and models.py for
-    more information about the specific query parameters used in search
-    and how they are handled.
+    GET requests are used to look up rides based on query parameters,
+    and rendered HTML for the search results is returned. See models.py
+    for more information about the specific query parameters used in
+    search and how they are handled. Deprecated: the Search Rides page
+    now searches through the JSON search API (see rides_api), and this
+    is kept for clients still requesting the HTML.
 
     POST requests are used to create rides. When a user submits the form
     on the Create a Ride page, this endpoint is called to handle their
@@ -145,18 +166,32 @@ def rides() -> Response:
         # Pulls params from url query strings
         params = request.args
 
-        rides = Ride.search(**params)
-        user = User.query.filter_by(netid=cas.username).first_or_404()
-        html = render_template(
-            "elements/ride_search_cards.html",
-            rides=rides,
-            current_user=user,
-        )
-        return make_response(html)
+        user = current_user
+
+        # Find the matching rides, and skip loading them if the client's
+        # copy is still fresh
+        ride_ids = Ride.search(**params)
+        etag = search_etag(user, ride_ids, len(ride_ids))
+        if request.if_none_match.contains(etag):
+            response = make_response("", 304)
+        else:
+            results = load_search_results(
+                Ride.load_in_order(ride_ids), user
+            )
+            html = render_template(
+                "elements/ride_search_cards.html",
+                results=results,
+            )
+            response = make_response(html)
+
+        # Browsers may cache results, but must revalidate them each time
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "private, no-cache"
+        return response
 
     elif request.method == "POST" and request.form is not None:
         # Get user from database
-        user = User.query.filter_by(netid=cas.username).first_or_404()
+        user = current_user
 
         # Validate to/from
         to_from = request.form["to_from"]
@@ -225,8 +260,8 @@ def rides() -> Response:
         is_anonymous = False if show_id == "Yes" else True
 
         # Set ride to/from based on form
-        origin = None
-        destination = None
+        origin = "Princeton"
+        destination = "Princeton"
 
         if to_from == "From":
             destination = location
@@ -242,9 +277,8 @@ def rides() -> Response:
             is_anonymous=is_anonymous,
             creator_id=user.id,
         )
-        ride.save()
 
-        # Email notif upon creation
+        # Email notif upon creation, committed along with the ride
         if user.email_notifs:
             notif = Message(
                 subject=(
@@ -252,33 +286,171 @@ def rides() -> Response:
                         escape(ride.origin), escape(ride.destination)
                     )
                 ),
-                html=(
-                    """
-                    <style>p {{margin-bottom: 2rem;}}</style>
-                    <p>Hello {},</p>
-                    <p>Your ride can now be seen and requested by other
-                    TigerTaxi users. <a href=\"{}\">Click here</a> to
-                    manage the ride.</p>
-                    <p>All the best,</p>
-                    <p>TigerTaxi Team</p>
-                    """
-                ).format(
-                    escape(user.disp_name),
-                    url_for(
-                        "main_bp.user_rides",
-                        _external=True,
-                        _scheme="https",
-                    ),
+                html=render_email(
+                    "emails/ride_created.html", name=user.disp_name
                 ),
                 recipients=[user.email],
             )
-            mail.send(notif)
+            outbox.enqueue(notif)
+
+        ride.save()
+        location_index.add(location)
 
         # Redirect to My Rides page
         flash("Your ride has been created!", "success")
         return redirect(url_for("main_bp.user_rides"))
 
 
+@read_only
+@login_required
+def rides_api() -> Response:
+    """Endpoint for paginated ride search returning JSON.
+
+    Accepts the same query parameters as GET requests to rides(), plus
+    an optional page size ("limit", capped at RIDES_API_MAX_PAGE_SIZE)
+    and the opaque "cursor" returned with the previous page. Each page
+    lists rides in the same order as the HTML search results, along with
+    the viewer's status for each ride. See static/js/searchrides.js for
+    the client.
+    """
+    params = request.args
+    user = current_user
+
+    # Validate pagination and date parameters
+    max_page_size = current_app.config["RIDES_API_MAX_PAGE_SIZE"]
+    try:
+        limit = int(
+            params.get(
+                "limit", current_app.config["RIDES_API_PAGE_SIZE"]
+            )
+        )
+        after = None
+        if params.get("cursor"):
+            after = decode_cursor(params["cursor"])
+        window = Ride.departure_window(
+            params.get("departure_date"), params.get("utc_offset", 0)
+        )
+    except ValueError:
+        return make_response(
+            jsonify(error="Invalid limit, cursor or departure date"),
+            400,
+        )
+    limit = max(1, min(limit, max_page_size))
+
+    tab = params.get("tab")
+    term = params.get("destination" if tab == "from" else "origin")
+
+    # Fetch one extra ride to find out whether there is another page
+    ride_ids = Ride.search_ids(tab, term, window, after, limit + 1)
+
+    # Skip loading the page if the client's copy is still fresh.
+    # Browsers may cache pages, but must revalidate them each time.
+    etag = search_etag(user, ride_ids, limit)
+    if request.if_none_match.contains(etag):
+        response = make_response("", 304)
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "private, no-cache"
+        return response
+
+    rides = Ride.load_in_order(ride_ids)
+    next_cursor = None
+    if len(rides) > limit:
+        rides = rides[:limit]
+        next_cursor = encode_cursor(rides[-1])
+
+    results = load_search_results(rides, user)
+    response = make_response(
+        jsonify(
+            version=1,
+            rides=[result.to_json() for result in results],
+            next_cursor=next_cursor,
+        )
+    )
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+
+@login_required
+def ride_stream() -> Response:
+    """Endpoint streaming live updates to ride search results.
+
+    The Search Rides page opens a stream with the same query parameters
+    as its search, and receives the rides added to, changed in or
+    removed from its results as server-sent events, in the format of
+    the JSON search API. See streams.py for the events, and
+    static/js/searchrides.js for the client.
+
+    Each open stream holds a server thread, so streams beyond
+    STREAM_MAX_CLIENTS per worker (including My Rides streams) are
+    turned away, and every stream is closed after STREAM_MAX_AGE
+    seconds (browsers reconnect on their own).
+    """
+    config = current_app.config
+    if open_streams() >= config["STREAM_MAX_CLIENTS"]:
+        response = make_response("", 503)
+        response.headers["Retry-After"] = "60"
+        return response
+
+    params = request.args
+    tab = params.get("tab")
+    term = params.get("destination" if tab == "from" else "origin")
+    try:
+        window = Ride.departure_window(
+            params.get("departure_date"), params.get("utc_offset", 0)
+        )
+    except ValueError:
+        return make_response("Invalid departure date", 400)
+
+    # Streams only remove rides which matched the search, starting with
+    # those found in the in-process search index now
+    events = ride_search_events(
+        current_user.id,
+        tab,
+        term,
+        window,
+        set(Ride.search_index(tab, term, window)),
+        max_age=config["STREAM_MAX_AGE"],
+        keepalive=config["STREAM_KEEPALIVE"],
+    )
+    response = Response(events, mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    # Keeps proxies from buffering the stream
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
+@login_required
+def my_rides_stream() -> Response:
+    """Endpoint streaming live updates to the user's My Rides page.
+
+    The My Rides page opens a stream on which it receives its cards
+    again, as server-sent events, whenever the user's rides or requests
+    change: new and cancelled requests for the rides they created, their
+    own requests being accepted or rejected, and riders joining or
+    leaving. See streams.py for the events, and static/js/myrides.js for
+    the client.
+
+    Streams are limited and closed as for ride_stream.
+    """
+    config = current_app.config
+    if open_streams() >= config["STREAM_MAX_CLIENTS"]:
+        response = make_response("", 503)
+        response.headers["Retry-After"] = "60"
+        return response
+
+    events = my_rides_events(
+        current_user.id,
+        max_age=config["STREAM_MAX_AGE"],
+        keepalive=config["STREAM_KEEPALIVE"],
+    )
+    response = Response(events, mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    # Keeps proxies from buffering the stream
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
 @login_required
 def leave_ride(ride_id: str) -> Response:
     """Endpoint for an accepted rider leaving a ride.
@@ -291,9 +463,6 @@ def leave_ride(ride_id: str) -> Response:
     """
 
     ride = Ride.query.filter_by(id=ride_id).first_or_404()
-    current_user = User.query.filter_by(
-        netid=cas.username
-    ).first_or_404()
     rider = Rider.query.where(
         Rider.ride_id == ride_id, Rider.user_id == current_user.id
     ).first()
@@ -308,42 +477,68 @@ def leave_ride(ride_id: str) -> Response:
     else:
         rider_user = rider.user
         rider_name = rider_user.disp_name
-        rider.remove()
-        flash("You have successfully left the ride!", "success")
         if ride.creator.email_notifs:
             notif = Message(
                 subject="{} has left your ride".format(
                     escape(rider_name)
                 ),
-                html=(
-                    """
-                    <style>p {{margin-bottom: 2rem;}}</style>
-                    <p>Hello {},</p>
-                    <p>{} has left your ride from {} to {} on {}.
-                    <a href=\"{}\">Click here</a> to manage
-                    your ride.</p>
-                    <p>All the best,</p>
-                    <p>TigerTaxi Team</p>
-                    """
-                ).format(
-                    escape(ride.creator.disp_name),
-                    escape(rider_name),
-                    escape(ride.origin),
-                    escape(ride.destination),
-                    escape(ride.format_departure_datetime()),
-                    url_for(
-                        "main_bp.user_rides",
-                        _external=True,
-                        _scheme="https",
-                    ),
+                html=render_email(
+                    "emails/rider_left.html",
+                    name=ride.creator.disp_name,
+                    rider_name=rider_name,
+                    ride=ride,
                 ),
                 recipients=[ride.creator.email],
             )
-            mail.send(notif)
+            outbox.enqueue(notif)
 
+        rider.remove()
+        flash("You have successfully left the ride!", "success")
         return redirect(request.referrer)
 
 
+# --------- Locations controller ---------------------------------------
+
+
+@read_only
+@login_required
+def location_suggestions() -> Response:
+    """Endpoint for location autocomplete.
+
+    Returns the most frequently used ride locations which start with (or
+    contain a word starting with) the "q" query parameter. Suggestions
+    are answered from an in-process index which is refreshed as rides
+    are created, so the search boxes can call this on every keystroke.
+    """
+    if location_index.is_stale(
+        current_app.config["LOCATION_INDEX_MAX_AGE"]
+    ):
+        location_index.load(Ride.location_counts())
+
+    suggestions = location_index.suggest(request.args.get("q", ""))
+    return make_response(jsonify(suggestions=suggestions))
+
+
+# --------- Internal controller ----------------------------------------
+
+
+@login_required
+def internal_stats() -> Response:
+    """Endpoint reporting runtime statistics for this worker.
+
+    Used to size the database connection pools. Only available to the
+    users listed in the ADMIN_NETIDS environment variable.
+    """
+    if cas.username not in current_app.config["ADMIN_NETIDS"]:
+        abort(404)
+
+    database_pools = {"primary": pool_stats(db.engine)}
+    for bind in current_app.config["REPLICA_BINDS"]:
+        database_pools[bind] = pool_stats(db.get_engine(bind=bind))
+
+    return make_response(jsonify(database_pools=database_pools))
+
+
 # --------- RideRequests controller ------------------------------------
 
 
@@ -358,7 +553,7 @@ def ride_requests(ride_id: str) -> Response:
     message is flashed.
     """
 
-    user = User.query.filter_by(netid=cas.username).first_or_404()
+    user = current_user
     ride = Ride.query.filter_by(id=ride_id).first_or_404()
 
     if ride.is_user_rider(user):
@@ -371,38 +566,32 @@ def ride_requests(ride_id: str) -> Response:
 
     else:
         ride_request = RideRequest(user_id=user.id, ride_id=ride.id)
-        ride_request.save()
 
         if ride.creator.email_notifs:
+            # Requests arriving in quick succession are sent together,
+            # as a digest listing each request's summary
+            html, summary = render_emails(
+                [
+                    (
+                        "emails/ride_request.html",
+                        {"name": ride.creator.disp_name, "ride": ride},
+                    ),
+                    (
+                        "emails/ride_request_summary.html",
+                        {"requester": user.disp_name, "ride": ride},
+                    ),
+                ]
+            )
             notif = Message(
                 subject="New ride request from {}".format(
                     escape(user.disp_name)
                 ),
-                html=(
-                    """
-                    <style>p {{margin-bottom: 2rem;}}</style>
-                    <p>Hello {},</p>
-                    <p>You've received a ride request for
-                    your ride from {} to {} on {}. <a href=\"{}\">
-                    Click here</a> to manage the request.</p>
-                    <p>All the best,</p>
-                    <p>TigerTaxi Team</p>
-                    """
-                ).format(
-                    escape(ride.creator.disp_name),
-                    escape(ride.origin),
-                    escape(ride.destination),
-                    escape(ride.format_departure_datetime()),
-                    url_for(
-                        "main_bp.user_rides",
-                        _external=True,
-                        _scheme="https",
-                    ),
-                ),
+                html=html,
                 recipients=[ride.creator.email],
             )
-            mail.send(notif)
+            outbox.enqueue(notif, kind="ride_request", summary=summary)
 
+        ride_request.save()
         flash(
             "You have successfully requested to join the ride!",
             "success",
@@ -427,7 +616,7 @@ def ride_request_accept(ride_req_id: str) -> Response:
     ).first_or_404()
     ride = ride_req.ride
 
-    if ride.creator.netid != cas.username:
+    if ride.creator_id != current_user.id:
         flash(
             "You do not have permission to accept this request!",
             "danger",
@@ -448,38 +637,42 @@ def ride_request_accept(ride_req_id: str) -> Response:
         )
 
     else:
-        if ride_req.user.email_notifs:
-            notif = Message(
-                subject="{} has accepted your ride request".format(
-                    escape(ride.creator.disp_name)
-                ),
-                html=(
-                    """
-                    <style>p {{margin-bottom: 2rem;}}</style>
-                    <p>Hello {},</p>
-                    <p>You've been accepted to ride from {} to {} on {}.
-                    <a href=\"{}\">Click here</a> to manage
-                    your accepted request.</p>
-                    <p>All the best,</p>
-                    <p>TigerTaxi Team</p>
-                    """
-                ).format(
-                    escape(ride_req.user.disp_name),
-                    escape(ride.origin),
-                    escape(ride.destination),
-                    escape(ride.format_departure_datetime()),
-                    url_for(
-                        "main_bp.user_rides",
-                        _external=True,
-                        _scheme="https",
+        # The checks above are repeated atomically by the database, in
+        # case another request was accepted in the meantime. The
+        # notification is committed along with the acceptance.
+        with transactions.transaction():
+            outcome = ride_req.accept()
+            accepted = outcome == RideRequest.AcceptOutcome.ACCEPTED
+            if accepted and ride_req.user.email_notifs:
+                notif = Message(
+                    subject="{} has accepted your ride request".format(
+                        escape(ride.creator.disp_name)
                     ),
-                ),
-                recipients=[ride_req.user.email],
-            )
-            mail.send(notif)
+                    html=render_email(
+                        "emails/request_accepted.html",
+                        name=ride_req.user.disp_name,
+                        ride=ride,
+                    ),
+                    recipients=[ride_req.user.email],
+                )
+                outbox.enqueue(notif)
 
-        ride_req.accept()
-        flash("You have successfully accepted the request!", "success")
+        if outcome == RideRequest.AcceptOutcome.ACCEPTED:
+            flash(
+                "You have successfully accepted the request!", "success"
+            )
+        elif outcome == RideRequest.AcceptOutcome.FULL:
+            flash(
+                "This ride filled up before the request could be "
+                "accepted!",
+                "danger",
+            )
+        else:
+            flash(
+                "This request has already been accepted, rejected, or "
+                "cancelled!",
+                "danger",
+            )
 
     return redirect(request.referrer)
 
@@ -500,7 +693,7 @@ def ride_request_reject(ride_req_id: str) -> Response:
     ).first_or_404()
     ride = ride_req.ride
 
-    if ride.creator.netid != cas.username:
+    if ride.creator_id != current_user.id:
         flash(
             "You do not have permission to reject this request!",
             "danger",
@@ -519,30 +712,14 @@ def ride_request_reject(ride_req_id: str) -> Response:
                 subject="{} has rejected your ride request".format(
                     escape(ride.creator.disp_name)
                 ),
-                html=(
-                    """
-                    <style>p {{margin-bottom: 2rem;}}</style>
-                    <p>Hello {},</p>
-                    <p>Your request to ride from {} to {} on {}
-                    has been rejected. <a href=\"{}\">Click here</a>
-                    to look for other options.</p>
-                    <p>All the best,</p>
-                    <p>TigerTaxi Team</p>
-                    """
-                ).format(
-                    escape(ride_req.user.disp_name),
-                    escape(ride.origin),
-                    escape(ride.destination),
-                    escape(ride.format_departure_datetime()),
-                    url_for(
-                        "main_bp.search_rides",
-                        _external=True,
-                        _scheme="https",
-                    ),
+                html=render_email(
+                    "emails/request_rejected.html",
+                    name=ride_req.user.disp_name,
+                    ride=ride,
                 ),
                 recipients=[ride_req.user.email],
             )
-            mail.send(notif)
+            outbox.enqueue(notif)
 
         ride_req.reject()
         flash("You have successfully rejected the request!", "success")
@@ -550,6 +727,116 @@ def ride_request_reject(ride_req_id: str) -> Response:
     return redirect(request.referrer)
 
 
+@login_required
+def ride_requests_bulk() -> Response:
+    """Endpoint for accepting and rejecting several ride requests at
+    once.
+
+    Handles the multi-select form in the Created Rides tab of the My
+    Rides page, which sends a "decision-<ride request id>" field set to
+    "accept" or "reject" for each request being decided. The decisions
+    are applied all together or not at all: if any ride would go over
+    capacity, or any request is no longer pending, nothing is changed.
+    Every notification is rendered and queued in one batch.
+    """
+    decisions = {}
+    for key, value in request.form.items():
+        if not key.startswith("decision-") or value == "":
+            continue
+        ride_req_id = key[len("decision-") :]
+        if not ride_req_id.isdigit() or value not in (
+            "accept",
+            "reject",
+        ):
+            flash("Invalid ride request decision", "danger")
+            return redirect(request.referrer)
+        decisions[int(ride_req_id)] = value
+
+    if len(decisions) == 0:
+        flash(
+            "Select at least one request to accept or reject.", "danger"
+        )
+        return redirect(request.referrer)
+
+    # Ownership of every request is checked in a single query
+    ride_reqs = (
+        current_user.query_inbound_requests()
+        .where(RideRequest.id.in_(decisions.keys()))
+        .options(
+            contains_eager(RideRequest.ride),
+            joinedload(RideRequest.user),
+        )
+        .all()
+    )
+    if len(ride_reqs) != len(decisions):
+        flash(
+            "You do not have permission to decide on these requests!",
+            "danger",
+        )
+        return redirect(request.referrer)
+
+    to_accept = [r for r in ride_reqs if decisions[r.id] == "accept"]
+    to_reject = [r for r in ride_reqs if decisions[r.id] == "reject"]
+
+    # The decisions and their notifications are committed together
+    with transactions.transaction():
+        outcome = RideRequest.decide_many(to_accept, to_reject)
+        if outcome == RideRequest.AcceptOutcome.ACCEPTED:
+            notified = [
+                (ride_req, decision)
+                for ride_reqs, decision in (
+                    (to_accept, "accepted"),
+                    (to_reject, "rejected"),
+                )
+                for ride_req in ride_reqs
+                if ride_req.user.email_notifs
+            ]
+            bodies = render_emails(
+                [
+                    (
+                        f"emails/request_{decision}.html",
+                        {
+                            "name": ride_req.user.disp_name,
+                            "ride": ride_req.ride,
+                        },
+                    )
+                    for ride_req, decision in notified
+                ]
+            )
+            for (ride_req, decision), html in zip(notified, bodies):
+                outbox.enqueue(
+                    Message(
+                        subject="{} has {} your ride request".format(
+                            escape(current_user.disp_name), decision
+                        ),
+                        html=html,
+                        recipients=[ride_req.user.email],
+                    )
+                )
+
+    if outcome == RideRequest.AcceptOutcome.FULL:
+        flash(
+            "There aren't enough seats left to accept all of these "
+            "requests! Nothing was changed.",
+            "danger",
+        )
+        return redirect(request.referrer)
+    if outcome == RideRequest.AcceptOutcome.NOT_PENDING:
+        flash(
+            "Some of these requests have already been accepted, "
+            "rejected, or cancelled! Nothing was changed.",
+            "danger",
+        )
+        return redirect(request.referrer)
+
+    flash(
+        "You have successfully accepted {} and rejected {} "
+        "request(s)!".format(len(to_accept), len(to_reject)),
+        "success",
+    )
+    return redirect(request.referrer)
+
+
 @login_required
 def ride_request_cancel(ride_req_id: str) -> Response:
     """Endpoint for cancelling a pending ride request.
@@ -564,7 +851,7 @@ def ride_request_cancel(ride_req_id: str) -> Response:
         id=ride_req_id
     ).first_or_404()
 
-    if ride_req.user.netid != cas.username:
+    if ride_req.user_id != current_user.id:
         flash(
             "You do not have permission to cancel this request!",
             "danger",
@@ -599,60 +886,40 @@ def remove_rider(rider_id: str) -> Response:
     """
     if request.method == "POST":
         rider = Rider.query.filter_by(id=rider_id).first_or_404()
-        current_user = User.query.filter_by(
-            netid=cas.username
-        ).first_or_404()
 
         # Pointers used to maintain references to deleted objects
         rider_user = rider.user
         rider_name = rider_user.disp_name
         ride = rider.ride
-        ride_creator = ride.creator
 
-        if not current_user.netid == ride_creator.netid:
+        if ride.creator_id != current_user.id:
             flash(
                 "You do not have permission to remove this rider!",
                 "danger",
             )
         else:
-            rider.remove()
-            flash(
-                f"You have successfully removed {rider_name} from the"
-                " ride!",
-                "success",
-            )
-
-            if rider.user.email_notifs:
+            if rider_user.email_notifs:
                 notif = Message(
                     subject=(
                         "{} has removed you from their ride".format(
                             current_user.disp_name
                         )
                     ),
-                    html=(
-                        """
-                    <style>p {{margin-bottom: 2rem;}}</style>
-                    <p>Hello {},</p>
-                    <p>{} has removed you from their ride from {} to {}
-                    on {}. <a href=\"{}\">Click here</a> to search for
-                    other options.</p>
-                    <p>All the best,</p>
-                    <p>TigerTaxi Team</p>
-                    """
-                    ).format(
-                        escape(rider_name),
-                        escape(ride.creator.disp_name),
-                        escape(ride.origin),
-                        escape(ride.destination),
-                        escape(ride.format_departure_datetime()),
-                        url_for(
-                            "main_bp.search_rides",
-                            _external=True,
-                            _scheme="https",
-                        ),
+                    html=render_email(
+                        "emails/rider_removed.html",
+                        name=rider_name,
+                        creator_name=ride.creator.disp_name,
+                        ride=ride,
                     ),
-                    recipients=[rider.user.email],
+                    recipients=[rider_user.email],
                 )
-                mail.send(notif)
+                outbox.enqueue(notif)
+
+            rider.remove()
+            flash(
+                f"You have successfully removed {rider_name} from the"
+                " ride!",
+                "success",
+            )
 
         return redirect(request.referrer)
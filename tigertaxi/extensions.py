@@ -11,10 +11,13 @@ Jude Muriithi '24 (muriithi@princeton.edu)
 
 from flask_cas import CAS
 from flask_mail import Mail
-from flask_sqlalchemy import SQLAlchemy
+
+from tigertaxi.mailer import MailDispatcher
+from tigertaxi.replicas import RoutingSQLAlchemy
 
 # ----------------------------------------------------------------------
 
 cas = CAS()
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 mail = Mail()
+mailer = MailDispatcher(mail)
@@ -12,14 +12,36 @@ Jude Muriithi '24 (muriithi@princeton.edu)
 from functools import wraps
 from typing import Any, Callable
 
-from flask import Response, flash, redirect, request, session, url_for
-
-from tigertaxi.extensions import cas
+from flask import (
+    Response,
+    flash,
+    g,
+    redirect,
+    request,
+    session,
+    url_for,
+)
+from werkzeug.local import LocalProxy
+
+from tigertaxi.extensions import cas, db
 from tigertaxi.models import User
 
 # ----------------------------------------------------------------------
 
 
+def get_current_user() -> User:
+    """Returns the logged in user for the current request.
+
+    Only available within views decorated with login_required.
+    """
+    user: User = g.current_user
+    return user
+
+
+# The logged in user, loaded at most once per request by login_required
+current_user: User = LocalProxy(get_current_user)  # type: ignore
+
+
 def login_required(
     function: Callable[..., Response]
 ) -> Callable[..., Response]:
@@ -29,7 +51,8 @@ def login_required(
     Sends user to the landing page if they are not logged in. On
     successful CAS login, the user is added to the database if they
     don't already exist, and any relevant reminders for the user are
-    flashed.
+    flashed. The user is then made available to the view as
+    current_user.
     """
 
     @wraps(function)
@@ -41,30 +64,55 @@ def login_required(
             return redirect(url_for("main_bp.landing"))
 
         else:
-            # Uses a custom session variable to check if we have a user
-            # in the database (faster than just querying every time)
-            if "TT_USER_EXISTS" not in session:
-                user = User.query.filter_by(netid=cas.username).first()
-
-                if user is None:
-                    user = User(
-                        netid=cas.username,
-                        email=cas.attributes["cas:mail"],
-                        disp_name=cas.attributes["cas:displayname"],
-                    )
-                    user.save()
-
-                # Flash phone number reminder
-                if user.phone_num is None:
-                    flash(
-                        "It's easier to coordinate rides over text. "
-                        "We recommend adding your phone number in "
-                        "'Settings'",
-                        "warning",
-                    )
-
-                session["TT_USER_EXISTS"] = True
+            if "current_user" not in g:
+                g.current_user = load_user()
 
             return function(*args, **kwargs)
 
     return wrap
+
+
+def load_user() -> User:
+    """Returns the user logged in through CAS, adding them to the
+    database if they don't already exist.
+
+    The user's id is kept in the session after the first lookup, so
+    later requests load the user by primary key (faster than querying by
+    netid every time).
+    """
+    user = None
+    if "TT_USER_ID" in session:
+        user = User.query.get(session["TT_USER_ID"])
+
+        # Sessions can outlive the users they point to, e.g. after the
+        # database is reset
+        if user is not None and user.netid != cas.username:
+            user = None
+
+    if user is None:
+        user = User.query.filter_by(netid=cas.username).first()
+
+        if user is None:
+            user = User(
+                netid=cas.username,
+                email=cas.attributes["cas:mail"],
+                disp_name=cas.attributes["cas:displayname"],
+            )
+            user.save()
+
+            # Within a unit of work the user is only staged, but their
+            # id is needed right away
+            db.session.flush()
+
+        # Flash phone number reminder
+        if user.phone_num is None:
+            flash(
+                "It's easier to coordinate rides over text. "
+                "We recommend adding your phone number in "
+                "'Settings'",
+                "warning",
+            )
+
+        session["TT_USER_ID"] = user.id
+
+    return user
@@ -0,0 +1,396 @@
+"""Cross-worker cache invalidation for TigerTaxi.
+
+Each gunicorn worker keeps in-process caches (such as the ride search
+index), which only that worker's own writes keep current. The
+invalidation bus lets every worker know about changes made by the
+others:
+
+- Changes to users, rides, ride requests and riders are staged by the
+  model events in models.py (see models.stage_change), and published
+  as part of the transaction which makes them, so they are only seen
+  once committed and never if rolled back. Rides whose locations are
+  added, removed or changed are also staged as "RideLocation" changes,
+  which the location suggestions listen for instead of every change to
+  a ride.
+- On PostgreSQL they are published with NOTIFY on the tigertaxi_changes
+  channel, which each worker LISTENs to from a background thread.
+- Elsewhere (SQLite test runs, or PgBouncer without a direct
+  DATABASE_LISTEN_URL), they are written to the cache_invalidations
+  table, which each worker polls every INVALIDATION_POLL_INTERVAL
+  seconds. Ids are handed out when a change is staged, but rows only
+  become visible when their transaction commits, possibly after rows
+  with higher ids. Each poll therefore re-reads the last POLL_OVERLAP
+  ids as well, skipping the rows it has already seen.
+
+Handlers registered for an entity are called, in the background thread
+and within an app context, with the ids of the objects which changed
+(including those changed by the worker itself). They're called with
+None when changes may have been missed, for instance after the
+listener reconnects, and should then drop everything they cache.
+"""
+
+# ----------------------------------------------------------------------
+
+import json
+import logging
+import os
+import select
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Set,
+    Tuple,
+)
+
+from flask import Flask
+from sqlalchemy import create_engine, delete, func, insert
+from sqlalchemy import select as sql_select
+from sqlalchemy.engine import Connection, make_url
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import NullPool
+
+from tigertaxi.extensions import db
+from tigertaxi.models import CacheInvalidation
+
+# ----------------------------------------------------------------------
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "tigertaxi_changes"
+
+# Key used in the SQLAlchemy session's info (see models.stage_change)
+STAGED_KEY = "invalidations"
+
+# NOTIFY payloads must be shorter than 8000 bytes
+MAX_PAYLOAD_CHANGES = 200
+
+# Seconds between checks that the LISTEN connection is still alive
+LISTEN_KEEPALIVE = 60
+
+# Longest wait between attempts to reconnect, in seconds
+MAX_BACKOFF = 60
+
+# How long polled changes are kept before being pruned
+POLL_RETENTION = timedelta(hours=1)
+
+# How many ids before the highest one seen are polled again, to catch
+# rows committed after rows with higher ids
+POLL_OVERLAP = 1000
+
+Change = Tuple[str, int]
+Handler = Callable[[Optional[Set[int]]], None]
+
+
+class InvalidationBus:
+    """Publishes committed model changes to every worker, and applies
+    the changes made by any worker to the registered handlers."""
+
+    def __init__(self) -> None:
+        """Creates a bus with no handlers, which publishes nothing until
+        it is initialized for an app."""
+        self.app: Optional[Flask] = None
+        self.mode: Optional[str] = None
+        self.listen_url: Optional[str] = None
+        self.poll_interval = 0.0
+        self._handlers: Dict[str, List[Handler]] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._last_id: Optional[int] = None
+        self._seen: Set[int] = set()
+
+    def register(self, entity: str, handler: Handler) -> None:
+        """Has handler called with the ids of changed objects of the
+        given model (e.g. "Ride")."""
+        handlers = self._handlers.setdefault(entity, [])
+        if handler not in handlers:
+            handlers.append(handler)
+
+    def init_app(self, app: Flask) -> None:
+        """Chooses how changes are published from the app config, and
+        starts listening for them on the app's first request."""
+        self.app = app
+        self.mode = None
+        if not app.config["INVALIDATION_ENABLED"]:
+            return
+
+        url = make_url(app.config["SQLALCHEMY_DATABASE_URI"])
+        self.listen_url = app.config["DATABASE_LISTEN_URL"]
+        if self.listen_url is None and not app.config["DB_PGBOUNCER"]:
+            self.listen_url = str(url)
+        self.poll_interval = app.config["INVALIDATION_POLL_INTERVAL"]
+
+        if url.get_backend_name() == "postgresql" and self.listen_url:
+            self.mode = "notify"
+        else:
+            self.mode = "poll"
+
+        # Only serving processes listen, rather than every CLI command
+        app.before_request(self._ensure_worker)
+
+    def publish(self, session: Session) -> None:
+        """Publishes the changes staged in the session within its
+        current transaction."""
+        changes = session.info.pop(STAGED_KEY, None)
+        if not changes or self.mode is None:
+            return
+
+        # Always on the primary, even in read-only views
+        connection = session.connection(
+            bind_arguments={"bind": db.engine}
+        )
+        changes = sorted(changes)
+        if self.mode == "notify":
+            for start in range(0, len(changes), MAX_PAYLOAD_CHANGES):
+                payload = json.dumps(
+                    changes[start : start + MAX_PAYLOAD_CHANGES],
+                    separators=(",", ":"),
+                )
+                connection.execute(
+                    sql_select(func.pg_notify(CHANNEL, payload))
+                )
+        else:
+            now = datetime.utcnow()
+            connection.execute(
+                insert(CacheInvalidation.__table__),
+                [
+                    {
+                        "entity": entity,
+                        "entity_id": entity_id,
+                        "created_at": now,
+                        "updated_at": now,
+                    }
+                    for entity, entity_id in changes
+                ],
+            )
+
+    def apply(self, changes: Iterable[Change]) -> None:
+        """Calls the registered handlers with the given changes."""
+        ids: Dict[str, Set[int]] = {}
+        for entity, entity_id in changes:
+            ids.setdefault(entity, set()).add(entity_id)
+        self._dispatch(ids)
+
+    def reset(self) -> None:
+        """Has every handler drop what it caches, since changes may have
+        been missed."""
+        self._dispatch({entity: None for entity in self._handlers})
+
+    def _dispatch(self, ids: Mapping[str, Optional[Set[int]]]) -> None:
+        assert self.app is not None
+        with self.app.app_context():
+            try:
+                for entity, entity_ids in ids.items():
+                    for handler in self._handlers.get(entity, ()):
+                        try:
+                            handler(entity_ids)
+                        except Exception:
+                            logger.exception(
+                                "Invalidation handler %r failed",
+                                handler,
+                            )
+            finally:
+                db.session.remove()
+
+    def _ensure_worker(self) -> None:
+        # Threads don't survive a fork, so servers which fork workers
+        # after creating the app need one thread per worker process
+        if self._pid == os.getpid() and self._worker_alive():
+            return
+
+        with self._lock:
+            if self._pid != os.getpid() or not self._worker_alive():
+                self._pid = os.getpid()
+                target = (
+                    self._listen
+                    if self.mode == "notify"
+                    else self._poll
+                )
+                self._thread = threading.Thread(
+                    target=target,
+                    name="invalidation-bus",
+                    daemon=True,
+                )
+                self._thread.start()
+
+    def _worker_alive(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def _listen(self) -> None:
+        assert self.listen_url is not None
+        # A dedicated connection, as LISTEN only lasts as long as the
+        # connection it was issued on
+        engine = create_engine(self.listen_url, poolclass=NullPool)
+        backoff = 1
+        connected_before = False
+
+        while True:
+            connection = None
+            try:
+                connection = engine.raw_connection()
+                listener = connection.connection
+                listener.autocommit = True
+                cursor = listener.cursor()
+                cursor.execute(f"LISTEN {CHANNEL}")
+                backoff = 1
+
+                # Anything may have changed while not listening
+                if connected_before:
+                    self.reset()
+                connected_before = True
+
+                while True:
+                    ready, _, _ = select.select(
+                        [listener], [], [], LISTEN_KEEPALIVE
+                    )
+                    if not ready:
+                        cursor.execute("SELECT 1")
+                        continue
+
+                    listener.poll()
+                    changes: List[Change] = []
+                    while listener.notifies:
+                        notify = listener.notifies.pop(0)
+                        changes.extend(
+                            (entity, entity_id)
+                            for entity, entity_id in json.loads(
+                                notify.payload
+                            )
+                        )
+                    if changes:
+                        self.apply(changes)
+
+            except Exception:
+                logger.exception(
+                    "Invalidation listener failed, reconnecting in %ds",
+                    backoff,
+                )
+            finally:
+                if connection is not None:
+                    try:
+                        connection.close()
+                    except Exception:
+                        pass
+
+            time.sleep(backoff)
+            backoff = min(backoff * 2, MAX_BACKOFF)
+
+    def _poll(self) -> None:
+        assert self.app is not None
+        table = CacheInvalidation.__table__
+        next_prune = 0.0
+
+        while True:
+            try:
+                with self.app.app_context(), db.engine.connect() as conn:
+                    changes = self._poll_changes(conn)
+
+                    if time.monotonic() >= next_prune:
+                        cutoff = datetime.utcnow() - POLL_RETENTION
+                        with conn.begin():
+                            conn.execute(
+                                delete(table).where(
+                                    table.c.created_at < cutoff
+                                )
+                            )
+                        next_prune = (
+                            time.monotonic()
+                            + POLL_RETENTION.total_seconds() / 10
+                        )
+
+                if changes:
+                    self.apply(changes)
+
+            except Exception:
+                logger.exception("Failed to poll for invalidations")
+                # Whatever was missed in the meantime is dropped below
+                if self._last_id is not None:
+                    self._last_id = None
+                    self.reset()
+
+            finally:
+                time.sleep(self.poll_interval)
+
+    def _poll_changes(self, conn: Connection) -> List[Change]:
+        """Returns the changes committed since the last poll.
+
+        The first poll only notes which changes were already there,
+        since the worker's caches are loaded after them.
+        """
+        table = CacheInvalidation.__table__
+        if self._last_id is None:
+            last_id: int = conn.execute(
+                sql_select(func.coalesce(func.max(table.c.id), 0))
+            ).scalar_one()
+            self._seen = set(
+                conn.execute(
+                    sql_select(table.c.id).where(
+                        table.c.id > last_id - POLL_OVERLAP
+                    )
+                ).scalars()
+            )
+            self._last_id = last_id
+            return []
+
+        rows = [
+            row
+            for row in conn.execute(
+                sql_select(
+                    table.c.id,
+                    table.c.entity,
+                    table.c.entity_id,
+                )
+                .where(table.c.id > self._last_id - POLL_OVERLAP)
+                .order_by(table.c.id)
+            )
+            if row.id not in self._seen
+        ]
+        if not rows:
+            return []
+
+        last_id = max(self._last_id, rows[-1].id)
+        self._seen = {
+            row_id
+            for row_id in self._seen.union(row.id for row in rows)
+            if row_id > last_id - POLL_OVERLAP
+        }
+        self._last_id = last_id
+        return [(row.entity, row.entity_id) for row in rows]
+
+
+# The bus used by the application. Handlers are registered and the bus
+# initialized in create_app().
+invalidation_bus = InvalidationBus()
+
+
+def publish_flushed_changes(
+    session: Session, flush_context: Any
+) -> None:
+    """Publishes the changes staged by a flush within its
+    transaction."""
+    invalidation_bus.publish(session)
+
+
+def publish_staged_changes(session: Session) -> None:
+    """Publishes changes staged by bulk statements, which may not be
+    followed by a flush, before the session commits."""
+    invalidation_bus.publish(session)
+
+
+def discard_staged_changes(session: Session) -> None:
+    """Drops the changes staged in a session whose transaction was
+    rolled back."""
+    session.info.pop(STAGED_KEY, None)
+
+
+db.event.listen(Session, "after_flush", publish_flushed_changes)
+db.event.listen(Session, "before_commit", publish_staged_changes)
+db.event.listen(Session, "after_rollback", discard_staged_changes)
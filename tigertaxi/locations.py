@@ -0,0 +1,147 @@
+"""Location suggestions for TigerTaxi.
+
+Defines an in-process prefix index of the locations used in existing
+rides, which backs the location autocomplete on the Create a Ride and
+Search Rides pages (see endpoints.location_suggestions).
+"""
+
+# ----------------------------------------------------------------------
+
+import heapq
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import Counter, OrderedDict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# ----------------------------------------------------------------------
+
+SPACE_PATTERN = re.compile(r"\s+")
+
+# Most suggestion lists kept memoized at once. Prefixes come straight
+# from users, so only the most recently requested are kept.
+MEMO_SIZE = 1024
+
+
+def normalize_location(location: str) -> str:
+    """Returns the normalized form of a location name, used to group
+    different spellings of the same place."""
+    return SPACE_PATTERN.sub(" ", location).strip().lower()
+
+
+class LocationIndex:
+    """Prefix index of location names weighted by how often they are
+    used.
+
+    Every word-suffix of each normalized location is stored in a sorted
+    list, so a prefix lookup is a pair of binary searches. For example,
+    "newark airport" is found by both "new" and "air". Suggestions are
+    displayed with the most common spelling of each location.
+    """
+
+    def __init__(self) -> None:
+        """Creates an empty, unloaded index."""
+        self._lock = threading.Lock()
+        self.loaded_at: Optional[float] = None
+        self._keys: List[Tuple[str, str]] = []
+        self._spellings: Dict[str, "Counter[str]"] = {}
+        self._weights: Dict[str, int] = {}
+
+        # Memoized suggestions, since short prefixes match many
+        # locations and are requested far more often than they change.
+        # Least recently used first, up to MEMO_SIZE entries.
+        self._memo: "OrderedDict[Tuple[str, int], List[str]]" = (
+            OrderedDict()
+        )
+
+    def is_stale(self, max_age: float) -> bool:
+        """Returns whether the index should be (re)loaded."""
+        return (
+            self.loaded_at is None
+            or time.monotonic() - self.loaded_at > max_age
+        )
+
+    def load(self, locations: Iterable[Tuple[str, int]]) -> None:
+        """Replaces the index with the given (location, count) pairs."""
+        with self._lock:
+            self._keys = []
+            self._spellings = {}
+            self._weights = {}
+            self._memo.clear()
+            for location, count in locations:
+                self._add(location, count)
+            self._keys.sort()
+            self.loaded_at = time.monotonic()
+
+    def invalidate(self, ride_ids: Optional[Set[int]] = None) -> None:
+        """Marks the index to be reloaded after rides are added or
+        removed, or their locations change.
+
+        Which rides changed doesn't matter, since the index only holds
+        location counts (see invalidation.py). Changes to a ride's seats
+        or departure time leave its locations alone, so they are not
+        published for the index (see models.stage_ride_location_change).
+        """
+        with self._lock:
+            self.loaded_at = None
+
+    def add(self, location: str) -> None:
+        """Records one more use of the given location."""
+        with self._lock:
+            if self.loaded_at is not None:
+                self._add(location, 1, keep_sorted=True)
+                self._memo.clear()
+
+    def suggest(self, prefix: str, limit: int = 8) -> List[str]:
+        """Returns up to limit locations matching the given prefix, most
+        frequently used first."""
+        prefix = normalize_location(prefix)
+        if prefix == "":
+            return []
+
+        with self._lock:
+            suggestions = self._memo.get((prefix, limit))
+            if suggestions is not None:
+                self._memo.move_to_end((prefix, limit))
+                return suggestions
+
+            start = bisect_left(self._keys, (prefix, ""))
+            end = bisect_left(self._keys, (prefix + "\uffff", ""))
+            matches = {key for _, key in self._keys[start:end]}
+            best = heapq.nlargest(
+                limit,
+                matches,
+                key=lambda key: (self._weights[key], key),
+            )
+            suggestions = [
+                self._spellings[key].most_common(1)[0][0]
+                for key in best
+            ]
+            self._memo[(prefix, limit)] = suggestions
+            if len(self._memo) > MEMO_SIZE:
+                self._memo.popitem(last=False)
+            return suggestions
+
+    def _add(
+        self, location: str, count: int, keep_sorted: bool = False
+    ) -> None:
+        key = normalize_location(location)
+        if key == "":
+            return
+
+        if key not in self._spellings:
+            self._spellings[key] = Counter()
+            words = key.split(" ")
+            for i in range(len(words)):
+                entry = (" ".join(words[i:]), key)
+                if keep_sorted:
+                    insort(self._keys, entry)
+                else:
+                    self._keys.append(entry)
+
+        self._spellings[key][location.strip()] += count
+        self._weights[key] = self._weights.get(key, 0) + count
+
+
+location_index = LocationIndex()
@@ -0,0 +1,218 @@
+"""Background mail delivery for TigerTaxi.
+
+Defines a dispatcher which delivers the notification outbox (see
+outbox.py) from a worker thread, so that requests only have to write
+their messages to the outbox instead of waiting on the mail server. The
+worker keeps a single SMTP connection open between messages and
+reconnects as needed.
+"""
+
+# ----------------------------------------------------------------------
+
+import atexit
+import logging
+import os
+import queue
+import smtplib
+import threading
+import time
+from typing import Callable, Optional
+
+from flask import Flask
+from flask_mail import Connection, Mail, Message
+
+# ----------------------------------------------------------------------
+
+logger = logging.getLogger(__name__)
+
+# Queued to wake the worker up (see stop() and wake())
+STOP = object()
+DRAIN = object()
+
+# Shortest wait before the worker drains again on its own, so that
+# messages claimed by other workers aren't polled for in a busy loop
+MIN_REDRAIN_DELAY = 1.0
+
+
+class SMTPSession:
+    """SMTP connection which is opened on first use and then kept open
+    between messages."""
+
+    def __init__(self, mail: Mail) -> None:
+        """Creates an unconnected session for the given Flask-Mail
+        extension."""
+        self.mail = mail
+        self._connection: Optional[Connection] = None
+
+    def send(self, message: Message) -> None:
+        """Sends a message, connecting first if necessary.
+
+        If sending fails, the connection is closed (so the next message
+        uses a new one) and the error is raised.
+        """
+        try:
+            if self._connection is None:
+                self._connection = self.mail.connect().__enter__()
+            self._connection.send(message)
+        except (smtplib.SMTPException, OSError):
+            self.close()
+            raise
+
+    def close(self) -> None:
+        """Closes the connection if it is open."""
+        connection, self._connection = self._connection, None
+        if connection is not None:
+            try:
+                connection.__exit__(None, None, None)
+            except (smtplib.SMTPException, OSError):
+                pass
+
+
+class MailDispatcher:
+    """Background thread which drains the notification outbox.
+
+    The worker drains the outbox whenever wake() is called, using the
+    function assigned to drain_outbox. Delayed wake-ups share a single
+    timer, set for the earliest of them, and after each drain the worker
+    schedules the next one for whenever the function assigned to
+    outbox_due_in says a message is next due (such as a digest, or a
+    retry). Mail is sent over one persistent SMTP connection, which is
+    closed after MAIL_IDLE_TIMEOUT seconds without mail.
+
+    With MAIL_ASYNC disabled, no thread is started, and the outbox is
+    only drained by `flask outbox drain`.
+    """
+
+    def __init__(self, mail: Mail) -> None:
+        """Creates a dispatcher delivering through the given Flask-Mail
+        extension."""
+        self.mail = mail
+        self.app: Optional[Flask] = None
+        self.enabled = False
+        self.idle_timeout = 0.0
+        self.drain_outbox: Optional[Callable[[SMTPSession], int]] = None
+        self.outbox_due_in: Optional[
+            Callable[[], Optional[float]]
+        ] = None
+        self._queue: "queue.Queue[object]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._smtp = SMTPSession(mail)
+        self._timer: Optional[threading.Timer] = None
+        self._wake_at = 0.0
+
+    def init_app(self, app: Flask) -> None:
+        """Configures the dispatcher from the app config."""
+        self.app = app
+        self.enabled = app.config["MAIL_ASYNC"]
+        self.idle_timeout = app.config["MAIL_IDLE_TIMEOUT"]
+        atexit.register(self.stop)
+
+    def wake(self, delay: float = 0) -> None:
+        """Has the worker thread drain the notification outbox, after
+        the given number of seconds.
+
+        A delayed wake-up is skipped if one is already set for no later
+        than it, since that drain sends everything due by then and
+        schedules the next one itself.
+        """
+        if not self.enabled or self.drain_outbox is None:
+            return
+
+        if delay > 0:
+            self._schedule(delay)
+            return
+
+        self._ensure_worker()
+        self._queue.put(DRAIN)
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """Finishes any requested drain, then stops the worker
+        thread."""
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            return
+        self._queue.put(STOP)
+        thread.join(timeout)
+
+    def _schedule(self, delay: float) -> None:
+        wake_at = time.monotonic() + delay
+        with self._lock:
+            # Timers don't survive a fork either, hence is_alive()
+            timer = self._timer
+            if timer is not None and timer.is_alive():
+                if self._wake_at <= wake_at:
+                    return
+                timer.cancel()
+
+            self._wake_at = wake_at
+            self._timer = threading.Timer(delay, self._wake_up)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _wake_up(self) -> None:
+        with self._lock:
+            self._timer = None
+        self.wake()
+
+    def _ensure_worker(self) -> None:
+        # Threads don't survive a fork, so servers which fork workers
+        # after creating the app need one thread per worker process
+        if self._pid == os.getpid() and self._worker_alive():
+            return
+
+        with self._lock:
+            if self._pid != os.getpid() or not self._worker_alive():
+                self._pid = os.getpid()
+                self._smtp = SMTPSession(self.mail)
+                self._thread = threading.Thread(
+                    target=self._run,
+                    name="mail-dispatcher",
+                    daemon=True,
+                )
+                self._thread.start()
+
+    def _worker_alive(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self) -> None:
+        assert self.app is not None
+        with self.app.app_context():
+            while True:
+                try:
+                    item = self._queue.get(timeout=self.idle_timeout)
+                except queue.Empty:
+                    self._smtp.close()
+                    continue
+
+                # Wake-ups which arrive together only need one drain
+                draining = item is DRAIN
+                stopping = item is STOP
+                while not stopping:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    draining = draining or item is DRAIN
+                    stopping = item is STOP
+
+                if draining:
+                    self._drain()
+
+                if stopping:
+                    self._smtp.close()
+                    return
+
+    def _drain(self) -> None:
+        assert self.drain_outbox is not None
+        try:
+            self.drain_outbox(self._smtp)
+            if self.outbox_due_in is not None:
+                delay = self.outbox_due_in()
+                if delay is not None:
+                    self.wake(max(delay, MIN_REDRAIN_DELAY))
+        except Exception:
+            # Whatever is left is picked up by the next wake-up or by
+            # `flask outbox drain`
+            logger.exception("Failed to drain the outbox")
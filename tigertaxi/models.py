@@ -8,11 +8,24 @@ Kwasi Oppong-Badu '22 (kyo@princeton.edu)
 # ----------------------------------------------------------------------
 
 import enum
+from collections import Counter
 from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
 
-from sqlalchemy import func, or_
+from flask import current_app
+from sqlalchemy import func, or_, tuple_
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import Session, joinedload
 
+from tigertaxi import transactions
 from tigertaxi.extensions import db
+from tigertaxi.search_index import (
+    LIKE_ESCAPE,
+    RideEntry,
+    RideKey,
+    like_pattern,
+    ride_index,
+)
 
 # ----------------------------------------------------------------------
 
@@ -57,15 +70,21 @@ class AbstractModel(BaseModel):  # type: ignore
     )
 
     def save(cls) -> "AbstractModel":
-        """Saves a model object in the database."""
+        """Saves a model object in the database.
+
+        Within a unit of work (see tigertaxi/transactions.py), the
+        object is only added to the session and is committed along with
+        the rest of the unit of work.
+        """
         db.session.add(cls)
-        db.session.commit()
+        transactions.commit()
         return cls
 
     def remove(cls) -> None:
-        """Removes a model object from the database."""
+        """Removes a model object from the database, deferring the
+        commit like save()."""
         db.session.delete(cls)
-        db.session.commit()
+        transactions.commit()
 
 
 class User(AbstractModel):
@@ -106,7 +125,7 @@ class User(AbstractModel):
         default=True,
     )
 
-    def query_outbound_requests(self):
+    def query_outbound_requests(self) -> Any:
         return (
             RideRequest.query.join(Ride, RideRequest.ride)
             .where(
@@ -147,20 +166,16 @@ class User(AbstractModel):
         )
 
     def get_requests_outbox(self):
-        return {
-            "accepted": self.get_accepted_outbound_requests(),
-            "pending": self.get_pending_outbound_requests(),
-            "rejected": self.get_rejected_outbound_requests(),
-        }
+        return RideRequest.partition(
+            self.query_outbound_requests(), RideRequest.BOX_STATUSES
+        )
 
     def get_requests_inbox(self):
-        return {
-            "accepted": self.get_accepted_inbound_requests(),
-            "pending": self.get_pending_inbound_requests(),
-            "rejected": self.get_rejected_inbound_requests(),
-        }
+        return RideRequest.partition(
+            self.query_inbound_requests(), RideRequest.BOX_STATUSES
+        )
 
-    def query_inbound_requests(self):
+    def query_inbound_requests(self) -> Any:
         return RideRequest.query.join(Ride, RideRequest.ride).where(
             Ride.creator_id == self.id
         )
@@ -234,6 +249,36 @@ class User(AbstractModel):
 
 class Ride(AbstractModel):
     __tablename__ = "rides"
+    __table_args__ = (
+        # Full text search on the generated tsvector columns
+        db.Index(
+            "ix_rides_origin_tsv", "origin_tsv", postgresql_using="gin"
+        ),
+        db.Index(
+            "ix_rides_destination_tsv",
+            "destination_tsv",
+            postgresql_using="gin",
+        ),
+        # Trigram indexes allow ILIKE '%term%' to skip a full scan
+        db.Index(
+            "ix_rides_origin_trgm",
+            "origin",
+            postgresql_using="gin",
+            postgresql_ops={"origin": "gin_trgm_ops"},
+        ),
+        db.Index(
+            "ix_rides_destination_trgm",
+            "destination",
+            postgresql_using="gin",
+            postgresql_ops={"destination": "gin_trgm_ops"},
+        ),
+        # A user's upcoming created rides (My Rides)
+        db.Index(
+            "ix_rides_creator_id_departure_datetime",
+            "creator_id",
+            "departure_datetime",
+        ),
+    )
 
     # Ride fields
     creator_id = db.Column(
@@ -276,6 +321,35 @@ class Ride(AbstractModel):
         default=True,
     )
 
+    # Number of riders, including the creator. Maintained with
+    # database-side increments whenever riders are added or removed
+    # (see the Rider events below), so never assign it directly.
+    riders_count = db.Column(
+        db.Integer,
+        index=False,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+
+    # Search fields (generated by PostgreSQL, never loaded by default)
+    origin_tsv = db.deferred(
+        db.Column(
+            TSVECTOR,
+            db.Computed(
+                "to_tsvector('english', origin)", persisted=True
+            ),
+        )
+    )
+    destination_tsv = db.deferred(
+        db.Column(
+            TSVECTOR,
+            db.Computed(
+                "to_tsvector('english', destination)", persisted=True
+            ),
+        )
+    )
+
     # Relationships to other tables
     creator = db.relationship(
         "User",
@@ -294,6 +368,141 @@ class Ride(AbstractModel):
         tab=None,
         utc_offset=0,
     ):
+        term = destination if tab == "from" else origin
+        window = Ride.departure_window(departure_date, utc_offset)
+        return Ride.search_ids(tab, term, window)
+
+    @staticmethod
+    def search_page(
+        tab: Optional[str] = None,
+        term: Optional[str] = None,
+        window: Optional[Tuple[datetime, datetime]] = None,
+        after: Optional[RideKey] = None,
+        limit: Optional[int] = None,
+    ) -> List["Ride"]:
+        return Ride.load_in_order(
+            Ride.search_ids(tab, term, window, after, limit)
+        )
+
+    @staticmethod
+    def search_ids(
+        tab: Optional[str] = None,
+        term: Optional[str] = None,
+        window: Optional[Tuple[datetime, datetime]] = None,
+        after: Optional[RideKey] = None,
+        limit: Optional[int] = None,
+    ) -> List[int]:
+        # Answer from the in-process index when possible, falling back
+        # to the database otherwise
+        if current_app.config.get("RIDE_INDEX_ENABLED", False):
+            try:
+                return Ride.search_index(
+                    tab, term, window, after, limit
+                )
+            except Exception:
+                current_app.logger.exception("Ride index search failed")
+
+        upcoming_rides = Ride.query_search(tab, term, window)
+
+        # Keyset pagination over the result ordering
+        if after is not None:
+            upcoming_rides = upcoming_rides.where(
+                tuple_(
+                    Ride.departure_datetime,
+                    Ride.destination,
+                    Ride.origin,
+                    Ride.id,
+                )
+                > tuple_(*after)
+            )
+        if limit is not None:
+            upcoming_rides = upcoming_rides.limit(limit)
+
+        return [
+            ride_id
+            for (ride_id,) in upcoming_rides.with_entities(Ride.id)
+        ]
+
+    @staticmethod
+    def load_in_order(ride_ids: Sequence[int]) -> List["Ride"]:
+        if len(ride_ids) == 0:
+            return []
+
+        # Creators are shown with every result, so load them alongside
+        # the rides. Rides deleted since their ids were found are left
+        # out.
+        rides = (
+            Ride.query.options(joinedload(Ride.creator))
+            .where(Ride.id.in_(ride_ids))
+            .all()
+        )
+        position = {ride_id: i for i, ride_id in enumerate(ride_ids)}
+        return sorted(rides, key=lambda ride: position[ride.id])
+
+    def sort_key(self) -> RideKey:
+        return (
+            self.departure_datetime,
+            self.destination,
+            self.origin,
+            self.id,
+        )
+
+    @staticmethod
+    def departure_window(
+        departure_date: Optional[str], utc_offset: Any = 0
+    ) -> Optional[Tuple[datetime, datetime]]:
+        if departure_date is None or departure_date == "":
+            return None
+
+        # Get the datetimes which start and end the chosen day
+        # from the date string
+        midnight_start = datetime.strptime(departure_date, "%Y-%m-%d")
+        midnight_end = datetime.combine(
+            midnight_start, datetime.max.time()
+        )
+
+        # Add UTC offset to account for local timezone differences
+        delt = timedelta(minutes=int(utc_offset))
+
+        return (midnight_start + delt, midnight_end + delt)
+
+    @staticmethod
+    def search_index(
+        tab: Optional[str] = None,
+        term: Optional[str] = None,
+        window: Optional[Tuple[datetime, datetime]] = None,
+        after: Optional[RideKey] = None,
+        limit: Optional[int] = None,
+    ) -> List[int]:
+        # (Re)load the index periodically so that rides written by
+        # other workers eventually show up
+        if ride_index.is_stale(
+            current_app.config["RIDE_INDEX_MAX_AGE"]
+        ):
+            ride_index.load(
+                Ride.query_upcoming_rides().with_entities(
+                    Ride.id,
+                    Ride.origin,
+                    Ride.destination,
+                    Ride.departure_datetime,
+                )
+            )
+
+        return ride_index.search(
+            ride_departure_limit(),
+            tab=tab,
+            term=term,
+            window=window,
+            after=after,
+            count=limit,
+        )
+
+    @staticmethod
+    def query_search(
+        tab: Optional[str] = None,
+        term: Optional[str] = None,
+        window: Optional[Tuple[datetime, datetime]] = None,
+    ) -> Any:
         upcoming_rides = Ride.query_upcoming_rides()
 
         if tab == "from":
@@ -301,16 +510,18 @@ class Ride(AbstractModel):
                 Ride.origin == "Princeton"
             )
 
-            if destination is not None and destination != "":
+            if term is not None and term != "":
                 upcoming_rides = upcoming_rides.where(
                     or_(
-                        # Matches if the search term is a prefix of the
-                        # destination
-                        Ride.destination.ilike(f"%{destination}%"),
+                        # Matches if the search term is a substring of
+                        # the destination
+                        Ride.destination.ilike(
+                            like_pattern(term), escape=LIKE_ESCAPE
+                        ),
                         # Full text match with escaped user query
-                        # (using custom PostgreSQL functions)
-                        func.to_tsvector(Ride.destination).op("@@")(
-                            func.plainto_tsquery(destination)
+                        # against the indexed tsvector column
+                        Ride.destination_tsv.op("@@")(
+                            func.plainto_tsquery("english", term)
                         ),
                     )
                 )
@@ -320,40 +531,31 @@ class Ride(AbstractModel):
                 Ride.destination == "Princeton"
             )
 
-            if origin is not None and origin != "":
+            if term is not None and term != "":
                 upcoming_rides = upcoming_rides.where(
                     or_(
-                        Ride.origin.ilike(f"%{origin}%"),
-                        func.to_tsvector(Ride.origin).op("@@")(
-                            func.plainto_tsquery(origin)
+                        Ride.origin.ilike(
+                            like_pattern(term), escape=LIKE_ESCAPE
+                        ),
+                        Ride.origin_tsv.op("@@")(
+                            func.plainto_tsquery("english", term)
                         ),
                     )
                 )
 
-        if departure_date is not None and departure_date != "":
-            # Get the datetimes which start and end the chosen day
-            # from the date string
-            midnight_start = datetime.strptime(
-                departure_date, "%Y-%m-%d"
-            )
-            midnight_end = datetime.combine(
-                midnight_start, datetime.max.time()
-            )
-
-            # Add UTC offset to account for local timezone differences
-            delt = timedelta(minutes=int(utc_offset))
-
+        if window is not None:
             upcoming_rides = upcoming_rides.where(
-                Ride.departure_datetime >= midnight_start + delt,
-                Ride.departure_datetime <= midnight_end + delt,
+                Ride.departure_datetime >= window[0],
+                Ride.departure_datetime <= window[1],
             )
 
-        return upcoming_rides.all()
+        return upcoming_rides
 
     def format_departure_datetime(self):
         return self.departure_datetime.strftime("%m-%d-%Y at %H:%M %p")
 
-    def query_upcoming_rides():
+    @staticmethod
+    def query_upcoming_rides() -> Any:
         # Return appropriately ordered rides list
         return (
             Ride.query.where(
@@ -362,11 +564,30 @@ class Ride(AbstractModel):
             .order_by(Ride.departure_datetime.asc())
             .order_by(Ride.destination.asc())
             .order_by(Ride.origin.asc())
+            .order_by(Ride.id.asc())
         )
 
     def get_upcoming_rides():
         return Ride.query_upcoming_rides().all()
 
+    @staticmethod
+    def location_counts() -> List[Tuple[str, int]]:
+        # Number of rides using each secondary location
+        origins = (
+            db.session.query(Ride.origin, func.count(Ride.id))
+            .where(Ride.origin != "Princeton")
+            .group_by(Ride.origin)
+        )
+        destinations = (
+            db.session.query(Ride.destination, func.count(Ride.id))
+            .where(Ride.destination != "Princeton")
+            .group_by(Ride.destination)
+        )
+        counts: List[Tuple[str, int]] = origins.union_all(
+            destinations
+        ).all()
+        return counts
+
     def create_rider(self, user, is_creator=False):
         ride_id = self.id
         user_id = user.id
@@ -406,14 +627,11 @@ class Ride(AbstractModel):
             RideRequest.status == RideRequest.Status.REJECTED.value,
         ).all()
 
-    def riders_count(self):
-        return len(self.riders)
-
     def is_full(self):
-        return self.riders_count() >= self.capacity
+        return self.riders_count >= self.capacity
 
     def has_room(self):
-        return self.capacity > self.riders_count()
+        return self.capacity > self.riders_count
 
     def is_user_rider(self, user):
         return (
@@ -482,6 +700,24 @@ class Ride(AbstractModel):
         )
 
 
+def change_riders_count(
+    connection: Any, ride_id: int, delta: int
+) -> None:
+    """Adds delta to a ride's riders_count within the current
+    transaction.
+
+    The increment is computed by the database, so concurrent changes to
+    the same ride cannot overwrite each other. The ride's row stays
+    locked until the transaction ends.
+    """
+    ride_table = Ride.__table__
+    connection.execute(
+        ride_table.update()
+        .where(ride_table.c.id == ride_id)
+        .values(riders_count=ride_table.c.riders_count + delta)
+    )
+
+
 # Creator becomes rider after ride is created
 @db.event.listens_for(Ride, "after_insert")
 def after_insert(mapper, connection, target):
@@ -495,10 +731,92 @@ def after_insert(mapper, connection, target):
                 "is_creator": True,
             },
         )
+        change_riders_count(connection, target.id, 1)
+
+
+# Keep the in-process ride index in sync once changes are committed
+def stage_index_upsert(
+    mapper: Any, connection: Any, target: Ride
+) -> None:
+    session = db.object_session(target)
+    changes = session.info.setdefault("ride_index_changes", {})
+    changes[target.id] = RideEntry.from_ride(target)
+
+
+def stage_index_remove(
+    mapper: Any, connection: Any, target: Ride
+) -> None:
+    session = db.object_session(target)
+    changes = session.info.setdefault("ride_index_changes", {})
+    changes[target.id] = None
+
+
+def apply_index_changes(session: Session) -> None:
+    for ride_id, entry in session.info.pop(
+        "ride_index_changes", {}
+    ).items():
+        if entry is None:
+            ride_index.remove(ride_id)
+        else:
+            ride_index.upsert(entry)
+
+
+def discard_index_changes(session: Session) -> None:
+    session.info.pop("ride_index_changes", None)
+
+
+db.event.listen(Ride, "after_insert", stage_index_upsert)
+db.event.listen(Ride, "after_update", stage_index_upsert)
+db.event.listen(Ride, "after_delete", stage_index_remove)
+db.event.listen(Session, "after_commit", apply_index_changes)
+db.event.listen(Session, "after_rollback", discard_index_changes)
+
+
+def refresh_index_entries(ride_ids: Optional[Set[int]]) -> None:
+    """Reloads the index entries of rides changed by any worker, as
+    reported by the invalidation bus (see invalidation.py).
+
+    None means that any ride may have changed, in which case the index
+    is cleared and reloaded on its next search.
+    """
+    if ride_ids is None:
+        ride_index.clear()
+        return
+
+    entries = {
+        ride.id: RideEntry.from_ride(ride)
+        for ride in Ride.query_upcoming_rides()
+        .where(Ride.id.in_(ride_ids))
+        .with_entities(
+            Ride.id,
+            Ride.origin,
+            Ride.destination,
+            Ride.departure_datetime,
+        )
+    }
+    for ride_id in ride_ids:
+        entry = entries.get(ride_id)
+        if entry is None:
+            ride_index.remove(ride_id)
+        else:
+            ride_index.upsert(entry)
 
 
 class RideRequest(AbstractModel):
     __tablename__ = "ride_requests"
+    __table_args__ = (
+        # A ride's requests, optionally from one user or in one status
+        db.Index(
+            "ix_ride_requests_ride_id_user_id_status",
+            "ride_id",
+            "user_id",
+            "status",
+        ),
+        # A user's requests in one status (My Rides, search results)
+        db.Index(
+            "ix_ride_requests_user_id_status", "user_id", "status"
+        ),
+    )
 
     class Status(enum.Enum):
         PENDING = 1
@@ -506,6 +824,15 @@ class RideRequest(AbstractModel):
         REJECTED = 3
         CANCELLED = 4
 
+    # Results of accepting a request
+    class AcceptOutcome(enum.Enum):
+        ACCEPTED = "accepted"
+        FULL = "full"
+        NOT_PENDING = "not_pending"
+
+    # Statuses shown in a user's requests inbox and outbox
+    BOX_STATUSES = (Status.ACCEPTED, Status.PENDING, Status.REJECTED)
+
     # Fields
     ride_id = db.Column(
         db.Integer,
@@ -539,6 +866,24 @@ class RideRequest(AbstractModel):
         foreign_keys=[ride_id],
     )
 
+    @staticmethod
+    def partition(
+        query: Any, statuses: Sequence["RideRequest.Status"]
+    ) -> Dict[str, List["RideRequest"]]:
+        # Runs the query once for all of the given statuses and buckets
+        # the results by status name, keeping the query's ordering
+        buckets: Dict[str, List[RideRequest]] = {
+            status.name.lower(): [] for status in statuses
+        }
+        names = {
+            status.value: status.name.lower() for status in statuses
+        }
+        for ride_request in query.where(
+            RideRequest.status.in_(names.keys())
+        ):
+            buckets[names[ride_request.status]].append(ride_request)
+        return buckets
+
     def is_accepted(self):
         return self.status == self.Status.ACCEPTED.value
 
@@ -552,20 +897,67 @@ class RideRequest(AbstractModel):
         return self.status == self.Status.CANCELLED.value
 
     def accept(self):
-        if self.ride.is_full():
-            return
-
-        self.status = self.Status.ACCEPTED.value
-        self.to_rider().save()
-        self.status_changed_at = datetime.utcnow()
-        self.save()
+        # Take a seat if one is left. The database checks the capacity
+        # while holding the ride's row lock, so concurrent accepts can
+        # never fill the ride past its capacity.
+        seated = Ride.query.where(
+            Ride.id == self.ride_id,
+            Ride.riders_count < Ride.capacity,
+        ).update(
+            {Ride.riders_count: Ride.riders_count + 1},
+            synchronize_session="fetch",
+        )
+        if not seated:
+            return self.AcceptOutcome.FULL
+
+        # Likewise, only a pending request can be accepted, and only once
+        claimed = RideRequest.query.where(
+            RideRequest.id == self.id,
+            RideRequest.status == self.Status.PENDING.value,
+        ).update(
+            {
+                RideRequest.status: self.Status.ACCEPTED.value,
+                RideRequest.status_changed_at: datetime.utcnow(),
+            },
+            synchronize_session="fetch",
+        )
+        if not claimed:
+            # Give the seat back. The rest of the transaction may belong
+            # to a unit of work, so it can't simply be rolled back.
+            Ride.query.where(Ride.id == self.ride_id).update(
+                {Ride.riders_count: Ride.riders_count - 1},
+                synchronize_session="fetch",
+            )
+            return self.AcceptOutcome.NOT_PENDING
+
+        # The seat was counted above, so the rider is inserted without
+        # going through the Rider events. Everything is committed
+        # together.
+        db.session.execute(
+            Rider.__table__.insert().values(
+                ride_request_id=self.id,
+                ride_id=self.ride_id,
+                user_id=self.user_id,
+            )
+        )
+        stage_change(db.session, "Ride", self.ride_id)
+        stage_change(db.session, "RideRequest", self.id)
+        transactions.commit()
+        return self.AcceptOutcome.ACCEPTED
 
     def reject(self):
         self.status = self.Status.REJECTED.value
-        Rider.query.where(
+        removed = Rider.query.where(
             Rider.ride_request_id == self.id,
             Rider.user_id == self.user_id,
         ).delete()
+        if removed:
+            # Bulk deletes skip the Rider events, so update the count
+            # here instead
+            change_riders_count(
+                db.session.connection(), self.ride_id, -removed
+            )
+            stage_change(db.session, "Ride", self.ride_id)
         self.status_changed_at = datetime.utcnow()
         self.save()
 
@@ -574,6 +966,88 @@ class RideRequest(AbstractModel):
         self.status_changed_at = datetime.utcnow()
         self.save()
 
+    @staticmethod
+    def decide_many(
+        to_accept: List["RideRequest"], to_reject: List["RideRequest"]
+    ) -> "RideRequest.AcceptOutcome":
+        # Accepts and rejects several requests at once, all or nothing.
+        # The decisions are applied in a savepoint, so if any of them
+        # can't be made, the savepoint is rolled back and the rest of
+        # the transaction is left alone. Returns ACCEPTED once every
+        # decision has been applied.
+        savepoint = db.session.begin_nested()
+        outcome = RideRequest._apply_decisions(to_accept, to_reject)
+        if outcome == RideRequest.AcceptOutcome.ACCEPTED:
+            savepoint.commit()
+            transactions.commit()
+        else:
+            savepoint.rollback()
+        return outcome
+
+    @staticmethod
+    def _apply_decisions(
+        to_accept: List["RideRequest"], to_reject: List["RideRequest"]
+    ) -> "RideRequest.AcceptOutcome":
+        now = datetime.utcnow()
+
+        # Take every seat needed with one capacity-checked update per
+        # ride, in ride order so that concurrent decisions lock rides
+        # in the same order
+        seats = Counter(
+            ride_request.ride_id for ride_request in to_accept
+        )
+        for ride_id, count in sorted(seats.items()):
+            seated = Ride.query.where(
+                Ride.id == ride_id,
+                Ride.riders_count + count <= Ride.capacity,
+            ).update(
+                {Ride.riders_count: Ride.riders_count + count},
+                synchronize_session="fetch",
+            )
+            if not seated:
+                return RideRequest.AcceptOutcome.FULL
+
+        # Every request must still be pending
+        for ride_requests, status in (
+            (to_accept, RideRequest.Status.ACCEPTED),
+            (to_reject, RideRequest.Status.REJECTED),
+        ):
+            if len(ride_requests) == 0:
+                continue
+            claimed = RideRequest.query.where(
+                RideRequest.id.in_([r.id for r in ride_requests]),
+                RideRequest.status == RideRequest.Status.PENDING.value,
+            ).update(
+                {
+                    RideRequest.status: status.value,
+                    RideRequest.status_changed_at: now,
+                },
+                synchronize_session="fetch",
+            )
+            if claimed != len(ride_requests):
+                return RideRequest.AcceptOutcome.NOT_PENDING
+
+        # Bulk updates skip the model events, so stage their changes
+        for ride_id in seats:
+            stage_change(db.session, "Ride", ride_id)
+        for ride_request in to_accept + to_reject:
+            stage_change(db.session, "RideRequest", ride_request.id)
+
+        # Seats were counted above, so riders skip the Rider events
+        if len(to_accept) > 0:
+            db.session.execute(
+                Rider.__table__.insert(),
+                [
+                    {
+                        "ride_request_id": ride_request.id,
+                        "ride_id": ride_request.ride_id,
+                        "user_id": ride_request.user_id,
+                    }
+                    for ride_request in to_accept
+                ],
+            )
+        return RideRequest.AcceptOutcome.ACCEPTED
+
     def to_rider(self):
         return Rider(
             ride_request_id=self.id,
@@ -589,6 +1063,10 @@ class RideRequest(AbstractModel):
 
 class Rider(AbstractModel):
     __tablename__ = "riders"
+    __table_args__ = (
+        # A ride's riders, optionally only a given user
+        db.Index("ix_riders_ride_id_user_id", "ride_id", "user_id"),
+    )
 
     # Fields
     ride_request_id = db.Column(
@@ -632,9 +1110,345 @@ class Rider(AbstractModel):
         if self.ride_request_id is not None:
             db.session.delete(self.ride_request)
         db.session.delete(self)
-        db.session.commit()
+        transactions.commit()
 
     def __repr__(self):
         return "<Rider User:{} on Ride:{}>".format(
             self.user_id, self.ride_id
         )
+
+
+# Keep Ride.riders_count in sync with the riders table
+def after_rider_insert(
+    mapper: Any, connection: Any, target: Rider
+) -> None:
+    change_riders_count(connection, target.ride_id, 1)
+
+
+def after_rider_delete(
+    mapper: Any, connection: Any, target: Rider
+) -> None:
+    change_riders_count(connection, target.ride_id, -1)
+
+
+db.event.listen(Rider, "after_insert", after_rider_insert)
+db.event.listen(Rider, "after_delete", after_rider_delete)
+
+
+def stage_change(session: Session, entity: str, entity_id: int) -> None:
+    """Records a change to a model object, which the invalidation bus
+    publishes to every worker along with the session's transaction (see
+    invalidation.py).
+
+    Changes made through the ORM are recorded by the events below, so
+    this only needs to be called for bulk and Core statements.
+    """
+    session.info.setdefault("invalidations", set()).add(
+        (entity, entity_id)
+    )
+
+
+# Let every worker know about changes to objects that may be cached
+def stage_model_change(
+    mapper: Any, connection: Any, target: Any
+) -> None:
+    stage_change(
+        db.object_session(target), mapper.class_.__name__, target.id
+    )
+
+
+# Riders also change their ride's riders_count
+def stage_rider_ride_change(
+    mapper: Any, connection: Any, target: Rider
+) -> None:
+    stage_change(db.object_session(target), "Ride", target.ride_id)
+
+
+# Location suggestions only change with the locations rides use, not
+# with their seats or times
+def stage_ride_location_change(
+    mapper: Any, connection: Any, target: Ride
+) -> None:
+    stage_change(db.object_session(target), "RideLocation", target.id)
+
+
+def stage_ride_location_update(
+    mapper: Any, connection: Any, target: Ride
+) -> None:
+    state = db.inspect(target)
+    if any(
+        state.attrs[name].history.has_changes()
+        for name in ("origin", "destination")
+    ):
+        stage_ride_location_change(mapper, connection, target)
+
+
+for model in (User, Ride, RideRequest, Rider):
+    for event_name in ("after_insert", "after_update", "after_delete"):
+        db.event.listen(model, event_name, stage_model_change)
+for event_name in ("after_insert", "after_delete"):
+    db.event.listen(Ride, event_name, stage_ride_location_change)
+db.event.listen(Ride, "after_update", stage_ride_location_update)
+for event_name in ("after_insert", "after_delete"):
+    db.event.listen(Rider, event_name, stage_rider_ride_change)
+
+
+# Departed rides are moved to the archive tables below, along with
+# their riders and requests, by `flask rides archive` (see archive.py).
+# Archived rows keep their ids and are never modified.
+
+
+class ArchivedRide(AbstractModel):
+    __tablename__ = "archived_rides"
+    __table_args__ = (
+        db.Index(
+            "ix_archived_rides_creator_id_departure_datetime",
+            "creator_id",
+            "departure_datetime",
+        ),
+    )
+
+    # Ids are copied from the hot table
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+        autoincrement=False,
+    )
+
+    # Fields, as in Ride
+    creator_id = db.Column(
+        db.Integer,
+        db.ForeignKey("users.id"),
+        nullable=False,
+    )
+    capacity = db.Column(
+        db.Integer,
+        nullable=False,
+    )
+    origin = db.Column(
+        db.String(256),
+        nullable=False,
+    )
+    destination = db.Column(
+        db.String(256),
+        nullable=False,
+    )
+    departure_datetime = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+    notes = db.Column(
+        db.String(280),
+        nullable=True,
+    )
+    is_anonymous = db.Column(
+        db.Boolean,
+        nullable=False,
+    )
+    riders_count = db.Column(
+        db.Integer,
+        nullable=False,
+    )
+    archived_at = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+    # Relationships to other tables
+    creator = db.relationship(
+        "User",
+        foreign_keys=[creator_id],
+    )
+    riders = db.relationship(
+        "ArchivedRider",
+        backref="ride",
+    )
+
+    def __repr__(self) -> str:
+        return "<ArchivedRide from {} to {} on {}>".format(
+            self.origin, self.destination, self.departure_datetime
+        )
+
+
+class ArchivedRideRequest(AbstractModel):
+    __tablename__ = "archived_ride_requests"
+
+    # Ids are copied from the hot table
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+        autoincrement=False,
+    )
+
+    # Fields, as in RideRequest
+    ride_id = db.Column(
+        db.Integer,
+        db.ForeignKey("archived_rides.id"),
+        index=True,
+        nullable=False,
+    )
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey("users.id"),
+        index=True,
+        nullable=False,
+    )
+    status = db.Column(
+        db.Integer,
+        nullable=False,
+    )
+    status_changed_at = db.Column(
+        db.DateTime,
+    )
+    archived_at = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+    def __repr__(self) -> str:
+        return (
+            "<[{}] Archived request from User:{} join Ride:{}>".format(
+                self.status, self.user_id, self.ride_id
+            )
+        )
+
+
+class ArchivedRider(AbstractModel):
+    __tablename__ = "archived_riders"
+    __table_args__ = (
+        db.Index(
+            "ix_archived_riders_ride_id_user_id", "ride_id", "user_id"
+        ),
+    )
+
+    # Ids are copied from the hot table
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+        autoincrement=False,
+    )
+
+    # Fields, as in Rider
+    ride_request_id = db.Column(
+        db.Integer,
+        db.ForeignKey("archived_ride_requests.id"),
+        nullable=True,
+    )
+    ride_id = db.Column(
+        db.Integer,
+        db.ForeignKey("archived_rides.id"),
+        nullable=False,
+    )
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey("users.id"),
+        index=True,
+        nullable=False,
+    )
+    is_creator = db.Column(
+        db.Boolean,
+        nullable=False,
+    )
+    archived_at = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+    # Relationships to other tables
+    user = db.relationship(
+        "User",
+        foreign_keys=[user_id],
+    )
+
+    def __repr__(self) -> str:
+        return "<ArchivedRider User:{} on Ride:{}>".format(
+            self.user_id, self.ride_id
+        )
+
+
+class OutboxMessage(AbstractModel):
+    __tablename__ = "outbox"
+    __table_args__ = (
+        # Only undelivered messages are ever looked up
+        db.Index(
+            "ix_outbox_next_attempt_at",
+            "next_attempt_at",
+            postgresql_where=db.text("next_attempt_at IS NOT NULL"),
+        ),
+    )
+
+    # Fields
+    recipient = db.Column(
+        db.String(256),
+        nullable=False,
+    )
+    subject = db.Column(
+        db.String(256),
+        nullable=False,
+    )
+    html = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+    # Messages with a kind are combined into digests (see outbox.py),
+    # each listing the summaries of the messages it replaces
+    kind = db.Column(
+        db.String(64),
+        nullable=True,
+    )
+    summary = db.Column(
+        db.Text,
+        nullable=True,
+    )
+    attempts = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+    # When the message should next be sent. Cleared once it has been
+    # sent or has failed too many times.
+    next_attempt_at = db.Column(
+        db.DateTime,
+        nullable=True,
+        default=datetime.utcnow,
+    )
+    sent_at = db.Column(
+        db.DateTime,
+        nullable=True,
+    )
+    last_error = db.Column(
+        db.Text,
+        nullable=True,
+    )
+
+    def is_sent(self) -> bool:
+        return self.sent_at is not None
+
+    def __repr__(self) -> str:
+        return "<OutboxMessage {} to {}>".format(
+            self.id, self.recipient
+        )
+
+
+# Changes published to workers which poll for them instead of using
+# LISTEN (see invalidation.py). Rows are pruned once every worker has
+# had time to read them.
+class CacheInvalidation(AbstractModel):
+    __tablename__ = "cache_invalidations"
+
+    # Fields
+    entity = db.Column(
+        db.String(64),
+        nullable=False,
+    )
+    entity_id = db.Column(
+        db.Integer,
+        nullable=False,
+    )
+
+    def __repr__(self) -> str:
+        return "<CacheInvalidation {} {}>".format(
+            self.entity, self.entity_id
+        )
@@ -0,0 +1,338 @@
+"""Transactional outbox for TigerTaxi notifications.
+
+Notifications are written to the outbox table in the same transaction
+as the change they describe, so a notification is stored if and only if
+its change is committed. They are delivered afterwards by the mail
+dispatcher's worker thread, which is woken up after each commit, and by
+`flask outbox drain` workers, which pick up anything left behind (for
+example after a worker crashes). Rows are claimed with FOR UPDATE SKIP
+LOCKED, so any number of drain workers can run side by side.
+
+Notifications of the kinds listed in DIGESTS are coalesced: they are
+held until their recipient has received none of the same kind for
+DIGEST_QUIET_WINDOW seconds, or the oldest has waited DIGEST_MAX_DELAY
+seconds, and are then sent together as a single digest email. All other
+notifications are sent as soon as possible.
+
+Delivery is at least once: a worker which dies after sending a message
+but before committing will have that message sent again.
+"""
+
+# ----------------------------------------------------------------------
+
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from flask import current_app
+from flask_mail import Message
+from sqlalchemy import and_, func, or_
+from sqlalchemy.orm import Session
+
+from tigertaxi.emails import render_email, site_url_for
+from tigertaxi.extensions import db, mailer
+from tigertaxi.mailer import SMTPSession
+from tigertaxi.models import OutboxMessage
+
+# ----------------------------------------------------------------------
+
+
+class Digest:
+    """Describes how notifications of one kind are combined."""
+
+    def __init__(self, subject: str, intro: str, endpoint: str) -> None:
+        """Creates a digest description.
+
+        The subject and intro are formatted with the number of
+        notifications, and endpoint names the page the digest links to.
+        """
+        self.subject = subject
+        self.intro = intro
+        self.endpoint = endpoint
+
+
+# Notification kinds which are combined into digests
+DIGESTS: Dict[str, Digest] = {
+    "ride_request": Digest(
+        subject="{} new ride requests",
+        intro="You've received {} ride requests for your rides:",
+        endpoint="main_bp.user_rides",
+    ),
+}
+
+
+def enqueue(
+    message: Message,
+    kind: Optional[str] = None,
+    summary: Optional[str] = None,
+) -> None:
+    """Adds a message to the outbox for each of its recipients.
+
+    Messages of a kind listed in DIGESTS are held for a digest, which
+    lists the summary (an HTML fragment) of each message in it.
+
+    The messages are written with the next commit of the current
+    session, and are discarded if it is rolled back.
+    """
+    if kind is not None and kind not in DIGESTS:
+        raise ValueError(f"Unknown digest kind: {kind}")
+
+    for recipient in message.recipients:
+        db.session.add(
+            OutboxMessage(
+                recipient=recipient,
+                subject=message.subject,
+                html=message.html,
+                kind=kind,
+                summary=summary,
+            )
+        )
+
+    # Digests can only be sent once their quiet window has passed
+    delay = 0.0
+    if kind is not None:
+        delay = current_app.config["DIGEST_QUIET_WINDOW"]
+    staged = db.session.info.setdefault("outbox_staged", set())
+    staged.add(delay)
+
+
+def drain(smtp: SMTPSession, limit: Optional[int] = None) -> int:
+    """Delivers every due outbox message and digest, and returns the
+    number of emails sent.
+
+    Due messages are looked up OUTBOX_BATCH_SIZE at a time. Each one (or
+    each digest) is then claimed, sent and has its outcome committed on
+    its own, so a failure never undoes the record of emails already
+    sent. A message which can't be sent is retried after
+    OUTBOX_RETRY_BACKOFF seconds, doubling after each attempt, and given
+    up on after OUTBOX_MAX_ATTEMPTS attempts. When given, at most limit
+    batches are processed.
+    """
+    batch_size = current_app.config["OUTBOX_BATCH_SIZE"]
+    sent = 0
+    batches = 0
+
+    try:
+        while limit is None or batches < limit:
+            now = datetime.utcnow()
+            claimed = 0
+
+            due_ids = [
+                message_id
+                for (message_id,) in db.session.query(OutboxMessage.id)
+                .where(
+                    OutboxMessage.next_attempt_at <= now,
+                    OutboxMessage.kind.is_(None),
+                )
+                .order_by(OutboxMessage.next_attempt_at)
+                .limit(batch_size)
+            ]
+            for message_id in due_ids:
+                # Another worker may have claimed or sent it already
+                outbox_message = (
+                    OutboxMessage.query.where(
+                        OutboxMessage.id == message_id,
+                        OutboxMessage.next_attempt_at <= now,
+                    )
+                    .with_for_update(skip_locked=True)
+                    .one_or_none()
+                )
+                if outbox_message is not None:
+                    claimed += 1
+                    if deliver(smtp, [outbox_message]):
+                        sent += 1
+
+                # Records the outcome and releases the row
+                db.session.commit()
+
+            for recipient, kind in due_digests(now, batch_size):
+                pending = (
+                    OutboxMessage.query.where(
+                        OutboxMessage.recipient == recipient,
+                        OutboxMessage.kind == kind,
+                        OutboxMessage.next_attempt_at.isnot(None),
+                    )
+                    .order_by(OutboxMessage.created_at)
+                    .with_for_update(skip_locked=True)
+                    .all()
+                )
+                if len(pending) > 0:
+                    claimed += 1
+                    if deliver(smtp, pending):
+                        sent += 1
+
+                db.session.commit()
+
+            batches += 1
+            if claimed == 0:
+                break
+
+    finally:
+        db.session.rollback()
+
+    return sent
+
+
+def due_digests(now: datetime, limit: int) -> List[Tuple[str, str]]:
+    """Returns the (recipient, kind) pairs of digests which are ready to
+    be sent."""
+    config = current_app.config
+    quiet_since = now - timedelta(seconds=config["DIGEST_QUIET_WINDOW"])
+    waiting_since = now - timedelta(seconds=config["DIGEST_MAX_DELAY"])
+
+    rows = (
+        db.session.query(OutboxMessage.recipient, OutboxMessage.kind)
+        .where(
+            OutboxMessage.next_attempt_at.isnot(None),
+            OutboxMessage.kind.isnot(None),
+        )
+        .group_by(OutboxMessage.recipient, OutboxMessage.kind)
+        .having(
+            and_(
+                func.max(OutboxMessage.next_attempt_at) <= now,
+                or_(
+                    func.max(OutboxMessage.created_at) <= quiet_since,
+                    func.min(OutboxMessage.created_at) <= waiting_since,
+                ),
+            )
+        )
+        .limit(limit)
+        .all()
+    )
+    return [(recipient, kind) for recipient, kind in rows]
+
+
+def due_in() -> Optional[float]:
+    """Returns the number of seconds until the next outbox message or
+    digest is due to be sent (zero or less if one already is), or None
+    if nothing is waiting to be sent."""
+    config = current_app.config
+    quiet_window = timedelta(seconds=config["DIGEST_QUIET_WINDOW"])
+    max_delay = timedelta(seconds=config["DIGEST_MAX_DELAY"])
+
+    try:
+        due_times: List[datetime] = []
+        next_attempt_at = (
+            db.session.query(func.min(OutboxMessage.next_attempt_at))
+            .where(OutboxMessage.kind.is_(None))
+            .scalar()
+        )
+        if next_attempt_at is not None:
+            due_times.append(next_attempt_at)
+
+        # Digests follow the same rules as in due_digests()
+        digests = (
+            db.session.query(
+                func.max(OutboxMessage.next_attempt_at),
+                func.max(OutboxMessage.created_at),
+                func.min(OutboxMessage.created_at),
+            )
+            .where(
+                OutboxMessage.next_attempt_at.isnot(None),
+                OutboxMessage.kind.isnot(None),
+            )
+            .group_by(OutboxMessage.recipient, OutboxMessage.kind)
+        )
+        for next_attempt_at, newest, oldest in digests:
+            due_times.append(
+                max(
+                    next_attempt_at,
+                    min(newest + quiet_window, oldest + max_delay),
+                )
+            )
+    finally:
+        db.session.rollback()
+
+    if len(due_times) == 0:
+        return None
+    return (min(due_times) - datetime.utcnow()).total_seconds()
+
+
+def digest_message(pending: List[OutboxMessage]) -> Message:
+    """Returns the email combining the given pending notifications,
+    which all share a recipient and kind."""
+    first = pending[0]
+    if len(pending) == 1:
+        return Message(
+            subject=first.subject,
+            html=first.html,
+            recipients=[first.recipient],
+        )
+
+    digest = DIGESTS[first.kind]
+    html = render_email(
+        "emails/digest.html",
+        intro=digest.intro.format(len(pending)),
+        summaries=[
+            outbox_message.summary for outbox_message in pending
+        ],
+        link=site_url_for(digest.endpoint),
+    )
+    return Message(
+        subject=digest.subject.format(len(pending)),
+        html=html,
+        recipients=[first.recipient],
+    )
+
+
+def deliver(smtp: SMTPSession, pending: List[OutboxMessage]) -> bool:
+    """Sends claimed outbox messages as one email and records the
+    outcome on each of them, to be committed by the caller.
+
+    Returns whether the email was sent.
+    """
+    config = current_app.config
+    now = datetime.utcnow()
+    attempts = max(
+        outbox_message.attempts for outbox_message in pending
+    )
+    attempts += 1
+
+    try:
+        smtp.send(digest_message(pending))
+
+    except Exception as error:
+        # Anything which goes wrong, including rendering the email, is
+        # recorded as a failed attempt so one bad message can't hold up
+        # the rest
+        next_attempt_at: Optional[datetime] = None
+        if attempts >= config["OUTBOX_MAX_ATTEMPTS"]:
+            current_app.logger.error(
+                "Giving up on outbox message(s) %s: %s",
+                ", ".join(str(message.id) for message in pending),
+                error,
+            )
+        else:
+            backoff = config["OUTBOX_RETRY_BACKOFF"] * 2 ** (
+                attempts - 1
+            )
+            next_attempt_at = now + timedelta(seconds=backoff)
+
+        for outbox_message in pending:
+            outbox_message.attempts = attempts
+            outbox_message.last_error = str(error)
+            outbox_message.next_attempt_at = next_attempt_at
+        return False
+
+    for outbox_message in pending:
+        outbox_message.attempts = attempts
+        outbox_message.sent_at = now
+        outbox_message.next_attempt_at = None
+    return True
+
+
+# Wake the dispatcher once staged messages are committed
+def wake_dispatcher(session: Session) -> None:
+    """Has the mail dispatcher drain the outbox after a commit which
+    added messages to it, and again once any staged digests may be
+    due."""
+    for delay in session.info.pop("outbox_staged", ()):
+        mailer.wake(delay)
+
+
+def discard_staged(session: Session) -> None:
+    """Forgets about messages staged in a rolled back transaction."""
+    session.info.pop("outbox_staged", None)
+
+
+db.event.listen(Session, "after_commit", wake_dispatcher)
+db.event.listen(Session, "after_rollback", discard_staged)
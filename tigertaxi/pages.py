@@ -14,8 +14,9 @@ Kwasi Oppong-Badu '22 (kyo@princeton.edu)
 from flask import Response, make_response, render_template
 
 from tigertaxi.extensions import cas
-from tigertaxi.helpers import login_required
-from tigertaxi.models import User
+from tigertaxi.helpers import current_user, login_required
+from tigertaxi.replicas import read_only
+from tigertaxi.viewmodels import load_my_rides, load_ride_history
 
 # ----------------------------------------------------------------------
 
@@ -30,32 +31,43 @@ def ride_guide() -> Response:
     return make_response(render_template("guide.html"))
 
 
+@read_only
 @login_required
 def user_rides() -> Response:
     """Renders the My Rides page and returns it as a response."""
-    user = User.query.filter_by(netid=cas.username).first_or_404()
+    user = current_user
 
     # Get user rides and requests by category
-    created = user.get_created_rides()
-    accepted = user.get_accepted_outbound_requests()
-    pending = user.get_pending_outbound_requests()
-    rejected = user.get_rejected_outbound_requests()
+    my_rides = load_my_rides(user)
 
     html = render_template(
         "myrides.html",
-        created=created,
-        accepted=accepted,
-        pending=pending,
-        rejected=rejected,
+        created=my_rides.created,
+        accepted=my_rides.accepted,
+        pending=my_rides.pending,
+        rejected=my_rides.rejected,
         netid=cas.username,
     )
     return make_response(html)
 
 
+@read_only
+@login_required
+def ride_history() -> Response:
+    """Renders the Ride History page and returns it as a response."""
+    html = render_template(
+        "history.html",
+        history=load_ride_history(current_user),
+        netid=cas.username,
+    )
+    return make_response(html)
+
+
+@read_only
 @login_required
 def settings() -> Response:
     """Renders the Settings page and returns it as a response."""
-    user = User.query.filter_by(netid=cas.username).first_or_404()
+    user = current_user
 
     # Get user's current settings
     html = render_template(
@@ -68,6 +80,7 @@ def settings() -> Response:
     return make_response(html)
 
 
+@read_only
 @login_required
 def search_rides() -> Response:
     """Renders the Search Rides page and returns it as a response."""
@@ -0,0 +1,249 @@
+"""Database connection pools for TigerTaxi.
+
+The primary and replica engines use a MeteredQueuePool, sized by the
+DB_POOL_* environment variables (see config.py), which keeps live
+counters of how many connections are checked out and how long requests
+wait to get one. These are reported by the internal statistics
+endpoint, and are what DB_POOL_SIZE and DB_MAX_OVERFLOW should be
+sized from: sustained waits mean the pool is too small for the
+worker's threads, while a peak well below the pool size means
+connections are being held open for nothing.
+
+With DB_PGBOUNCER set, the database is reached through PgBouncer in
+transaction pooling mode, where consecutive transactions of one pool
+connection can run on different server connections. Nothing may then
+rely on state kept by a server connection between transactions, such as
+prepared statements, session settings or LISTEN. PgBouncer does the
+pooling there, so the engines use a NullPool instead, opening a
+(cheap) client connection to PgBouncer for each checkout and closing
+it on checkin. Only the pool's status is reported then.
+"""
+
+# ----------------------------------------------------------------------
+
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from flask import Flask
+from sqlalchemy import event, exc
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import NullPool, QueuePool
+
+# ----------------------------------------------------------------------
+
+# Engine options which only apply to a QueuePool
+QUEUE_POOL_OPTIONS = (
+    "pool_size",
+    "max_overflow",
+    "pool_timeout",
+    "pool_use_lifo",
+)
+
+# Key used in connection records' info
+CHECKOUT_KEY = "checked_out_at"
+
+
+class PoolMetrics:
+    """Thread-safe counters for a connection pool's checkouts."""
+
+    def __init__(self) -> None:
+        """Creates metrics with every counter at zero."""
+        self._lock = threading.Lock()
+        self.waiting = 0
+        self.checkouts = 0
+        self.timeouts = 0
+        self.connects = 0
+        self.invalidations = 0
+        self.peak_checked_out = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.held_seconds = 0.0
+        self.max_held_seconds = 0.0
+
+    def start_wait(self) -> float:
+        """Records a thread starting to wait for a connection, and
+        returns the time it started."""
+        with self._lock:
+            self.waiting += 1
+        return time.perf_counter()
+
+    def end_wait(
+        self, started: float, checked_out: Optional[int]
+    ) -> None:
+        """Records a thread done waiting for a connection.
+
+        checked_out is the pool's number of checked out connections if
+        the thread got one, or None if it timed out.
+        """
+        waited = time.perf_counter() - started
+        with self._lock:
+            self.waiting -= 1
+            self.wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+            if checked_out is None:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+                self.peak_checked_out = max(
+                    self.peak_checked_out, checked_out
+                )
+
+    def record_checkin(self, held: float) -> None:
+        """Records a connection being returned after held seconds."""
+        with self._lock:
+            self.held_seconds += held
+            self.max_held_seconds = max(self.max_held_seconds, held)
+
+    def record_connect(self) -> None:
+        """Records a new database connection being opened."""
+        with self._lock:
+            self.connects += 1
+
+    def record_invalidation(self) -> None:
+        """Records a connection being discarded as unusable."""
+        with self._lock:
+            self.invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns the counters, with wait and hold times averaged, in
+        milliseconds."""
+        with self._lock:
+            attempts = self.checkouts + self.timeouts
+            return {
+                "waiting": self.waiting,
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "connects": self.connects,
+                "invalidations": self.invalidations,
+                "peak_checked_out": self.peak_checked_out,
+                "avg_wait_ms": (
+                    self.wait_seconds / attempts * 1000
+                    if attempts
+                    else None
+                ),
+                "max_wait_ms": self.max_wait_seconds * 1000,
+                "avg_held_ms": (
+                    self.held_seconds / self.checkouts * 1000
+                    if self.checkouts
+                    else None
+                ),
+                "max_held_ms": self.max_held_seconds * 1000,
+            }
+
+
+class MeteredQueuePool(QueuePool):
+    """QueuePool which times how long each checkout waits for a
+    connection (including opening one, if needed)."""
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        """Creates the pool, with new metrics."""
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+
+    def _do_get(self) -> Any:
+        started = self.metrics.start_wait()
+        try:
+            record = super()._do_get()
+        except exc.TimeoutError:
+            self.metrics.end_wait(started, None)
+            raise
+        except BaseException:
+            self.metrics.end_wait(started, self.checkedout())
+            raise
+        self.metrics.end_wait(started, self.checkedout())
+        return record
+
+    def recreate(self) -> "MeteredQueuePool":
+        """Returns a new pool like this one, which keeps counting in the
+        same metrics (disposing of an engine replaces its pool)."""
+        pool: MeteredQueuePool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns the pool's current state along with its metrics."""
+        return {
+            "size": self.size(),
+            "checked_in": self.checkedin(),
+            "checked_out": self.checkedout(),
+            "overflow": self.overflow(),
+            "max_overflow": self._max_overflow,
+            "timeout_seconds": self.timeout(),
+            **self.metrics.stats(),
+        }
+
+
+def configure_engine(
+    app: Flask, sa_url: Any, options: Dict[str, Any]
+) -> Dict[str, Any]:
+    """Adjusts the options an engine for the given URL is created with
+    to the app's pool configuration."""
+    if sa_url.get_backend_name() == "sqlite":
+        # SQLite gets the pool Flask-SQLAlchemy picks for it
+        for name in QUEUE_POOL_OPTIONS:
+            options.pop(name, None)
+        return options
+
+    if app.config["DB_PGBOUNCER"]:
+        # Holding connections to PgBouncer would only pool them twice,
+        # and a connection opened for the checkout needs no ping or
+        # recycling
+        options["poolclass"] = NullPool
+        for name in QUEUE_POOL_OPTIONS + (
+            "pool_pre_ping",
+            "pool_recycle",
+        ):
+            options.pop(name, None)
+        # psycopg2 never prepares statements server side, but looks up
+        # the hstore type's OIDs once per engine and caches them, which
+        # PgBouncer can't promise stay valid
+        if sa_url.get_driver_name() == "psycopg2":
+            options.setdefault("use_native_hstore", False)
+        return options
+
+    options.setdefault("poolclass", MeteredQueuePool)
+    return options
+
+
+def register_events(engine: Engine) -> None:
+    """Counts the connects, invalidations and checkout durations of the
+    engine's pool, if it is metered."""
+    if not isinstance(engine.pool, MeteredQueuePool):
+        return
+
+    def metrics() -> PoolMetrics:
+        # Looked up on each event, as disposing replaces the pool
+        metrics: PoolMetrics = engine.pool.metrics
+        return metrics
+
+    def on_connect(dbapi_connection: Any, record: Any) -> None:
+        metrics().record_connect()
+
+    def on_checkout(
+        dbapi_connection: Any, record: Any, proxy: Any
+    ) -> None:
+        record.info[CHECKOUT_KEY] = time.perf_counter()
+
+    def on_checkin(dbapi_connection: Any, record: Any) -> None:
+        started = record.info.pop(CHECKOUT_KEY, None)
+        if started is not None:
+            metrics().record_checkin(time.perf_counter() - started)
+
+    def on_invalidate(
+        dbapi_connection: Any, record: Any, error: Any
+    ) -> None:
+        metrics().record_invalidation()
+
+    event.listen(engine, "connect", on_connect)
+    event.listen(engine, "checkout", on_checkout)
+    event.listen(engine, "checkin", on_checkin)
+    event.listen(engine, "invalidate", on_invalidate)
+
+
+def pool_stats(engine: Engine) -> Dict[str, Any]:
+    """Returns the statistics of an engine's connection pool."""
+    pool = engine.pool
+    if isinstance(pool, MeteredQueuePool):
+        return pool.stats()
+    return {"status": pool.status()}
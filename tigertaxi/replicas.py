@@ -0,0 +1,134 @@
+"""Read replica routing for TigerTaxi.
+
+When read replicas are configured (DATABASE_REPLICA_URLS), GET requests
+to views marked with read_only() run their queries on a replica chosen
+at random, and everything else uses the primary database. Writes,
+flushes and locking reads always go to the primary, even within
+read-only views.
+
+Replicas lag slightly behind the primary, so a user's own changes might
+not be visible on them straight away. After a request which wrote to
+the database, that user's requests are kept on the primary for
+REPLICA_READ_YOUR_WRITES seconds, so that (for instance) the redirect
+back to My Rides after accepting a request shows the change.
+"""
+
+# ----------------------------------------------------------------------
+
+import random
+import time
+from typing import Any, Callable, Optional
+
+from flask import Flask, Response, current_app, request, session
+from flask_sqlalchemy import SignallingSession, SQLAlchemy, get_state
+from sqlalchemy import orm
+from sqlalchemy.engine import Engine
+
+from tigertaxi import pools
+
+# ----------------------------------------------------------------------
+
+# Keys used in the SQLAlchemy session's info
+REPLICA_KEY = "replica_bind"
+WROTE_KEY = "wrote_to_primary"
+
+# Key used in the Flask session
+LAST_WRITE_KEY = "TT_LAST_WRITE"
+
+
+def read_only(
+    function: Callable[..., Response]
+) -> Callable[..., Response]:
+    """Marks a view as safe to serve from a read replica for GET
+    requests.
+
+    Should be applied on top of login_required, so the mark is visible
+    on the registered view function.
+    """
+    function.reads_from_replica = True  # type: ignore[attr-defined]
+    return function
+
+
+class RoutingSession(SignallingSession):
+    """Session which sends reads to the replica named in its info, if
+    any, and everything else to the primary."""
+
+    def get_bind(
+        self, mapper: Any = None, clause: Any = None, **kwargs: Any
+    ) -> Any:
+        """Returns the engine to run the given statement on."""
+        writing = self._flushing or (
+            clause is not None
+            and (
+                getattr(clause, "is_dml", False)
+                or getattr(clause, "_for_update_arg", None) is not None
+            )
+        )
+        if writing:
+            self.info[WROTE_KEY] = True
+        else:
+            replica = self.info.get(REPLICA_KEY)
+            if replica is not None:
+                db = get_state(self.app).db
+                return db.get_engine(self.app, bind=replica)
+
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy extension whose sessions can route reads to read
+    replicas (see RoutingSession)."""
+
+    def create_session(self, options: Any) -> Any:
+        """Creates the factory for the extension's sessions."""
+        return orm.sessionmaker(
+            class_=RoutingSession, db=self, **options
+        )
+
+    def create_engine(self, sa_url: Any, engine_opts: Any) -> Engine:
+        """Creates an engine with the app's pool configuration (see
+        pools.py), whose pool reports its statistics."""
+        engine_opts = pools.configure_engine(
+            self.get_app(), sa_url, dict(engine_opts)
+        )
+        engine = super().create_engine(sa_url, engine_opts)
+        pools.register_events(engine)
+        return engine
+
+    def init_app(self, app: Flask) -> None:
+        """Sets up the extension, and replica routing for the app's
+        requests if any replicas are configured."""
+        super().init_app(app)
+        if app.config["REPLICA_BINDS"]:
+            app.before_request(self.route_request)
+            app.after_request(self.record_writes)
+
+    def route_request(self) -> None:
+        """Sends the current request's reads to a replica, if its view
+        allows it and the user hasn't written anything recently."""
+        if request.method not in ("GET", "HEAD"):
+            return
+
+        if request.endpoint is None:
+            return
+
+        view = current_app.view_functions.get(request.endpoint)
+        if not getattr(view, "reads_from_replica", False):
+            return
+
+        last_write: Optional[float] = session.get(LAST_WRITE_KEY)
+        window = current_app.config["REPLICA_READ_YOUR_WRITES"]
+        if last_write is not None and time.time() - last_write < window:
+            return
+
+        replica = random.choice(current_app.config["REPLICA_BINDS"])
+        self.session.info[REPLICA_KEY] = replica
+
+    def record_writes(self, response: Response) -> Response:
+        """Keeps the user on the primary for a while after a request
+        which wrote to it."""
+        info = self.session.info
+        info.pop(REPLICA_KEY, None)
+        if info.pop(WROTE_KEY, False):
+            session[LAST_WRITE_KEY] = time.time()
+        return response
@@ -0,0 +1,354 @@
+"""In-process index of upcoming rides for TigerTaxi.
+
+Every keystroke on the Search Rides page runs a ride search, so each
+worker keeps the set of upcoming rides in memory and answers searches
+from it (see Ride.search). The index is kept current from SQLAlchemy
+events in models.py and falls back to the database whenever it is
+disabled or unavailable.
+"""
+
+# ----------------------------------------------------------------------
+
+import re
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+from datetime import date, datetime, timedelta
+from itertools import islice
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+# ----------------------------------------------------------------------
+
+# Ordering key matching Ride.query_upcoming_rides()
+RideKey = Tuple[datetime, str, str, int]
+
+# Words dropped by PostgreSQL's english configuration which commonly
+# show up in location searches
+STOP_WORDS = frozenset(
+    [
+        "a",
+        "an",
+        "and",
+        "at",
+        "by",
+        "for",
+        "from",
+        "in",
+        "of",
+        "on",
+        "the",
+        "to",
+    ]
+)
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+# Escape character for the LIKE patterns built by like_pattern()
+LIKE_ESCAPE = "\\"
+
+
+def like_pattern(term: str) -> str:
+    """Returns an ILIKE pattern matching values which contain term.
+
+    "%" and "_" in term are matched literally, as by the index's
+    substring match, rather than as wildcards.
+    """
+    escaped = (
+        term.replace(LIKE_ESCAPE, LIKE_ESCAPE * 2)
+        .replace("%", LIKE_ESCAPE + "%")
+        .replace("_", LIKE_ESCAPE + "_")
+    )
+    return f"%{escaped}%"
+
+
+def tokenize(text: str) -> List[str]:
+    """Splits text into normalized search tokens.
+
+    This is a lightweight stand-in for to_tsvector('english', ...):
+    tokens are lowercased, stop words are dropped and a trailing plural
+    "s" is removed. PostgreSQL's stemmer also strips other suffixes
+    (such as "ing") and drops more stop words, so the database can match
+    a term by tokens which the index only matches by substring, or not
+    at all. For example, "parking" matches "Park Ave" in the database
+    but not in the index.
+    """
+    tokens = []
+    for word in TOKEN_PATTERN.findall(text.lower()):
+        if word in STOP_WORDS:
+            continue
+        if (
+            len(word) > 3
+            and word.endswith("s")
+            and not word.endswith("ss")
+        ):
+            word = word[:-1]
+        tokens.append(word)
+    return tokens
+
+
+class RideEntry:
+    """Snapshot of the searchable fields of a single ride."""
+
+    __slots__ = ("id", "origin", "destination", "departure_datetime")
+
+    def __init__(
+        self,
+        id: int,
+        origin: str,
+        destination: str,
+        departure_datetime: datetime,
+    ) -> None:
+        """Creates an entry from the given ride fields."""
+        self.id = id
+        self.origin = origin
+        self.destination = destination
+        self.departure_datetime = departure_datetime
+
+    @classmethod
+    def from_ride(cls, ride: Any) -> "RideEntry":
+        """Creates an entry from a Ride or any row with ride fields."""
+        return cls(
+            ride.id,
+            ride.origin,
+            ride.destination,
+            ride.departure_datetime,
+        )
+
+    def key(self) -> RideKey:
+        """Returns the key used to order search results."""
+        return (
+            self.departure_datetime,
+            self.destination,
+            self.origin,
+            self.id,
+        )
+
+    def matches(
+        self,
+        limit: datetime,
+        tab: Optional[str] = None,
+        term: Optional[str] = None,
+        window: Optional[Tuple[datetime, datetime]] = None,
+    ) -> bool:
+        """Returns whether the ride would be among the results of
+        UpcomingRidesIndex.search with the same filters."""
+        if self.departure_datetime < limit:
+            return False
+        if window is not None and not (
+            window[0] <= self.departure_datetime <= window[1]
+        ):
+            return False
+
+        if tab == "from":
+            if self.origin != "Princeton":
+                return False
+        elif tab == "to":
+            if self.destination != "Princeton":
+                return False
+
+        if term and tab in ("from", "to"):
+            value = self.destination if tab == "from" else self.origin
+            if term.lower() in value.lower():
+                return True
+            tokens = tokenize(term)
+            return bool(tokens) and set(tokens) <= set(tokenize(value))
+
+        return True
+
+
+class UpcomingRidesIndex:
+    """Index of upcoming rides held in a single worker.
+
+    Entries are kept in a list sorted in search result order, bucketed
+    by UTC departure day, and tokenized into postings for origins and
+    destinations. All methods are thread-safe.
+    """
+
+    def __init__(self) -> None:
+        """Creates an empty, unloaded index."""
+        self._lock = threading.RLock()
+        self.loaded_at: Optional[float] = None
+        self._keys: List[RideKey] = []
+        self._entries: Dict[int, RideEntry] = {}
+        self._days: Dict[date, Set[int]] = {}
+        self._postings: Dict[str, Dict[str, Set[int]]] = {
+            "origin": {},
+            "destination": {},
+        }
+
+    def is_stale(self, max_age: float) -> bool:
+        """Returns whether the index should be (re)loaded."""
+        return (
+            self.loaded_at is None
+            or time.monotonic() - self.loaded_at > max_age
+        )
+
+    def load(self, rides: Iterable[Any]) -> None:
+        """Replaces the contents of the index with the given rides."""
+        with self._lock:
+            self.clear()
+            for ride in rides:
+                self._add(RideEntry.from_ride(ride))
+            self.loaded_at = time.monotonic()
+
+    def clear(self) -> None:
+        """Removes every entry and marks the index as unloaded."""
+        with self._lock:
+            self.loaded_at = None
+            self._keys = []
+            self._entries = {}
+            self._days = {}
+            for postings in self._postings.values():
+                postings.clear()
+
+    def __len__(self) -> int:
+        """Returns the number of rides in the index."""
+        return len(self._entries)
+
+    def upsert(self, entry: RideEntry) -> None:
+        """Adds a ride to the index, replacing any previous version."""
+        with self._lock:
+            if self.loaded_at is None:
+                return
+            self._discard(entry.id)
+            self._add(entry)
+
+    def remove(self, ride_id: int) -> None:
+        """Removes a ride from the index if it is present."""
+        with self._lock:
+            self._discard(ride_id)
+
+    def expire(self, limit: datetime) -> None:
+        """Removes every ride which departs before the given limit.
+
+        Since entries are sorted by departure time, expired entries are
+        always at the front of the list.
+        """
+        with self._lock:
+            while self._keys and self._keys[0][0] < limit:
+                self._discard(self._keys[0][3])
+
+    def search(
+        self,
+        limit: datetime,
+        tab: Optional[str] = None,
+        term: Optional[str] = None,
+        window: Optional[Tuple[datetime, datetime]] = None,
+        after: Optional[RideKey] = None,
+        count: Optional[int] = None,
+    ) -> List[int]:
+        """Returns the ids of matching rides in search result order.
+
+        Mirrors the filters in Ride.query_search: rides departing after
+        the departure limit, from (or to) Princeton depending on the
+        tab, whose secondary location contains the search term or
+        matches all of its tokens, and which depart within the given
+        window. When given, only the first count rides ordered after the
+        given key are returned.
+        """
+        with self._lock:
+            self.expire(limit)
+
+            if window is not None:
+                candidates = self._in_window(*window)
+            else:
+                candidates = set(self._entries)
+
+            if tab == "from":
+                candidates = {
+                    i
+                    for i in candidates
+                    if self._entries[i].origin == "Princeton"
+                }
+            elif tab == "to":
+                candidates = {
+                    i
+                    for i in candidates
+                    if self._entries[i].destination == "Princeton"
+                }
+
+            if term and tab in ("from", "to"):
+                field = "destination" if tab == "from" else "origin"
+                candidates &= self._matching(field, term, candidates)
+
+            # Walk the sorted keys to return matches in result order
+            start = (
+                0 if after is None else bisect_right(self._keys, after)
+            )
+            ride_ids: List[int] = []
+            for key in islice(self._keys, start, None):
+                if count is not None and len(ride_ids) >= count:
+                    break
+                if key[3] in candidates:
+                    ride_ids.append(key[3])
+            return ride_ids
+
+    def _add(self, entry: RideEntry) -> None:
+        self._entries[entry.id] = entry
+        insort(self._keys, entry.key())
+        day = entry.departure_datetime.date()
+        self._days.setdefault(day, set()).add(entry.id)
+        for field in self._postings:
+            for token in tokenize(getattr(entry, field)):
+                self._postings[field].setdefault(token, set()).add(
+                    entry.id
+                )
+
+    def _discard(self, ride_id: int) -> None:
+        entry = self._entries.pop(ride_id, None)
+        if entry is None:
+            return
+
+        key = entry.key()
+        position = bisect_left(self._keys, key)
+        if position < len(self._keys) and self._keys[position] == key:
+            del self._keys[position]
+
+        day = entry.departure_datetime.date()
+        self._days[day].discard(ride_id)
+        if not self._days[day]:
+            del self._days[day]
+
+        for field, postings in self._postings.items():
+            for token in tokenize(getattr(entry, field)):
+                ids = postings.get(token)
+                if ids is not None:
+                    ids.discard(ride_id)
+                    if not ids:
+                        del postings[token]
+
+    def _in_window(self, start: datetime, end: datetime) -> Set[int]:
+        ids: Set[int] = set()
+        day = start.date()
+        while day <= end.date():
+            for ride_id in self._days.get(day, ()):
+                departure = self._entries[ride_id].departure_datetime
+                if start <= departure <= end:
+                    ids.add(ride_id)
+            day += timedelta(days=1)
+        return ids
+
+    def _matching(
+        self, field: str, term: str, candidates: Set[int]
+    ) -> Set[int]:
+        # Substring match, as with ILIKE '%term%'
+        needle = term.lower()
+        matches = {
+            i
+            for i in candidates
+            if needle in getattr(self._entries[i], field).lower()
+        }
+
+        # Token match, as with plainto_tsquery: every token must appear
+        tokens = tokenize(term)
+        if tokens:
+            postings = self._postings[field]
+            token_matches = set(postings.get(tokens[0], ()))
+            for token in tokens[1:]:
+                token_matches &= postings.get(token, set())
+            matches |= token_matches
+
+        return matches
+
+
+ride_index = UpcomingRidesIndex()
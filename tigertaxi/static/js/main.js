@@ -44,6 +44,30 @@ function disableSubmit() {
     }, 2000);
 }
 
+// Fill the datalist attached to a location input with suggestions for
+// what has been typed so far (see endpoints.location_suggestions)
+function suggestLocations(input) {
+    const query = input.value.trim();
+    const datalist = input.list;
+    if (!datalist || !query)
+        return;
+
+    fetch(`/locations/suggest?q=${encodeURIComponent(query)}`)
+        .then(response => response.json())
+        .then(data => {
+            // Ignore responses for text which has since been changed
+            if (input.value.trim() !== query)
+                return;
+
+            datalist.replaceChildren(...data.suggestions.map(location => {
+                const option = document.createElement("option");
+                option.value = location;
+                return option;
+            }));
+        })
+        .catch(console.error);
+}
+
 function setupMain() {
     // Convert all dates that exist when the page is loaded
     dateConvert($(".tt-date"));
@@ -0,0 +1,123 @@
+/***********************************************************************
+* myrides.js
+* Authors: Jude Muriithi, Meet Patel
+* Description: Defines JS for live updates to the My Rides page
+***********************************************************************/
+
+/* Live updates *******************************************************/
+
+// Stream of changes to the user's rides and requests (see
+// endpoints.my_rides_stream)
+let myRidesStream = null;
+
+// Changes to cards which were in use when they arrived, applied once
+// the user is done with them, by card (or ride) id
+const deferredChanges = new Map();
+let deferredReload = false;
+
+// Tab panes by the tab names used in the stream's events
+const tabPanes = {
+    created: "#my-created",
+    accepted: "#accepted-requests",
+    pending: "#pending-requests",
+    rejected: "#rejected-requests",
+};
+
+// Cards affected by a change: one card by id, or every card of a ride
+const changedCards = (change) => {
+    if (change.id) {
+        const card = document.getElementById(change.id);
+        return card ? [card] : [];
+    }
+    return [...document.querySelectorAll(
+        `.tt-my-ride[data-ride-id="${change.ride_id}"]`)];
+}
+
+// Replacing a card with an open modal, dropdown or bulk form would
+// close it under the user
+const isInUse = (card) => card.querySelector(
+    ".modal.show, .dropdown-menu.show, .collapse.show") !== null;
+
+// Show each tab's "Nothing here." message only when it has no cards
+const updatePlaceholders = () => {
+    for (let selector of Object.values(tabPanes)) {
+        const pane = document.querySelector(selector);
+        const nothing = pane.querySelector(".tt-nothing");
+        nothing.classList.toggle(
+            "d-none", pane.querySelector(".tt-my-ride") !== null);
+    }
+}
+
+const upsertCard = (change) => {
+    const page = document.createElement("template");
+    page.innerHTML = change.html;
+    dateConvert($(page.content).find(".tt-date"));
+    const card = page.content.querySelector(".tt-my-ride");
+
+    // The card may have moved to a different tab
+    const existing = document.getElementById(change.id);
+    if (existing)
+        existing.remove();
+
+    // Cards are listed by departure, soonest first
+    const pane = document.querySelector(tabPanes[change.tab]);
+    const next = [...pane.querySelectorAll(".tt-my-ride")].find(
+        other => other.dataset.departure > change.departure);
+    pane.insertBefore(card, next || pane.querySelector(".tt-nothing"));
+}
+
+const applyChange = (event, change) => {
+    const key = change.id || `ride-${change.ride_id}`;
+    if (changedCards(change).some(isInUse)) {
+        // Only the latest change to a card matters
+        deferredChanges.set(key, [event, change]);
+        return;
+    }
+    deferredChanges.delete(key);
+
+    if (event === "upsert")
+        upsertCard(change);
+    else
+        changedCards(change).forEach(card => card.remove());
+    updatePlaceholders();
+}
+
+const applyDeferredChanges = () => {
+    for (let [event, change] of [...deferredChanges.values()])
+        applyChange(event, change);
+}
+
+// Changes may have been missed, so load the page again, unless the
+// user is in the middle of something
+const reloadPage = () => {
+    deferredReload = Boolean(
+        document.querySelector(".modal.show, .collapse.show"));
+    if (!deferredReload)
+        window.location.reload();
+}
+
+const openMyRidesStream = () => {
+    if (!window.EventSource)
+        return;
+
+    myRidesStream = new EventSource("/account/rides/stream");
+    for (let event of ["upsert", "remove"]) {
+        myRidesStream.addEventListener(event, (message) => {
+            applyChange(event, JSON.parse(message.data));
+        });
+    }
+    myRidesStream.addEventListener("reset", reloadPage);
+}
+
+// Retry changes held back while a card was in use
+$(document).on(
+    "hidden.bs.modal hidden.bs.dropdown hidden.bs.collapse",
+    () => setTimeout(() => {
+        if (deferredReload)
+            reloadPage();
+        else
+            applyDeferredChanges();
+    })
+);
+
+$(document).ready(openMyRidesStream);
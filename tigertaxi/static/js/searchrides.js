@@ -35,31 +35,129 @@ const clearQueryData = (tab) => {
     );
 }
 
-const displayData = (html) => {
-    if (fromPrincetonTab.className.includes("active")) {
-        document.querySelector("#from-princeton-container").innerHTML = html;
+const activeContainer = () => {
+    if (queryData['tab'] === "to")
+        return document.querySelector("#to-princeton-container");
+    return document.querySelector("#from-princeton-container");
+}
 
-        // Convert the dates within the newly loaded rows
-        // (should only happen in the newly generated container)
-        dateConvert($("#from-princeton-container .tt-date"));
-    }
-    else if (toPrincetonTab.className.includes("active")) {
-        document.querySelector("#to-princeton-container").innerHTML = html;
-        dateConvert($("#to-princeton-container .tt-date"));
-    }
+/* Search result rendering ********************************************/
+
+const escapeHtml = (text) => {
+    const div = document.createElement("div");
+    div.textContent = text;
+    return div.innerHTML;
 }
 
-const getData = () => {
-    if (!queryData["tab"]) {
-        if (fromPrincetonTab.className.includes("active"))
-            queryData['tab'] = "from";
-        else
-            queryData['tab'] = "to";
+// Buttons for each viewer status (see viewmodels.RideSearchResult)
+const statusLabels = {
+    creator: "Created By You",
+    rider: "Already Joined",
+    pending: "Request Pending",
+    rejected: "Request Rejected",
+    full: "Ride Full",
+};
+
+const renderAction = (ride) => {
+    if (ride.viewer_status in statusLabels) {
+        return `<button class="btn btn-secondary" type="button" disabled>
+            ${statusLabels[ride.viewer_status]}
+            </button>`;
     }
+    return `<button type="button" class="btn btn-primary"
+        onclick="openRequestModal(${ride.id})">
+        Request to Join
+        </button>`;
+}
+
+const renderCard = (ride) => {
+    const creator = ride.creator === null
+        ? "Princeton Student 🎒"
+        : `${escapeHtml(ride.creator.disp_name)}
+            (${escapeHtml(ride.creator.netid)})`;
+    const notes = ride.notes
+        ? `<li class="list-group-item">
+            <strong class="mr-2">Notes:</strong>
+            <span class="d-block d-sm-inline">${escapeHtml(ride.notes)}</span>
+          </li>`
+        : "";
 
-    const queryString = Object.keys(queryData)
+    return `<div class="card shadow-sm rounded-md text-left m-3"
+        data-ride-id="${ride.id}">
+    <ul class="list-group list-group-flush">
+      <li class="list-group-item bg-light">
+        <span class="mr-2">
+          <strong class="mr-2">From:</strong>
+          <span class="badge badge-dark badge-sm my-1">
+            ${escapeHtml(ride.origin)}
+          </span>
+        </span>
+        <span class="mr-2 d-block d-sm-inline">
+          <strong class="mr-2">
+            <span class="d-sm-none">&nbsp;&nbsp;&nbsp;&nbsp;</span>
+            To:
+          </strong>
+          <span class="badge badge-dark badge-sm my-1">
+            ${escapeHtml(ride.destination)}
+          </span>
+        </span>
+      </li>
+      <li class="list-group-item">
+        <strong class="mr-2">Departure:</strong>
+        <span class="tt-date d-block d-sm-inline">${ride.departure_datetime}</span>
+      </li>
+      <li class="list-group-item">
+        <strong class="mr-2">Capacity:</strong>
+        <span class="badge badge-primary">
+          ${ride.riders_count} / ${ride.capacity}
+        </span>
+      </li>
+      ${notes}
+      <li class="list-group-item">
+        <strong class="mr-2">Created by:</strong>
+        <div class=" d-block d-sm-inline mr-auto">
+          <span class="badge border border-dark my-1 m-sm-1">
+            ${creator}
+          </span>
+        </div>
+      </li>
+      <li class="list-group-item text-center bg-light">
+        ${renderAction(ride)}
+      </li>
+    </ul>
+</div>`;
+}
+
+const renderEmpty = () => `<div class="mt-5 mb-5 p-2 pt-5 pb-5 tt-nothing">
+    <h2>No rides found.</h2>
+    <p>
+      Try creating your own!
+    </p>
+</div>`;
+
+const openRequestModal = (rideId) => {
+    document.querySelector("#requestRideForm").action =
+        `/rides/${rideId}/requests`;
+    $("#requestRideModal").modal("show");
+}
+
+/* Paginated search ***************************************************/
+
+// Cursor for the next page of the current search (null once every
+// page has been loaded), and a counter used to ignore responses to
+// searches which have since been replaced
+let nextCursor = null;
+let searchId = 0;
+let loadingPage = false;
+
+// Sort keys of the displayed rides, by id, used to place live updates
+const rideKeys = new Map();
+
+const buildQueryString = (extra) => {
+    const params = Object.assign({}, queryData, extra);
+    return Object.keys(params)
         .map(key => {
-            let value = queryData[key].trim();
+            let value = String(params[key]).trim();
             let hasValue = !!value;
             if (hasValue)
                 return `${key}=${encodeURIComponent(value)}`;
@@ -67,15 +165,88 @@ const getData = () => {
                 return '';
         })
         .filter(s => !!s).join('&');
-    const rideSearchEndpoint = `/rides?${queryString}`;
+}
+
+const loadPage = (cursor) => {
+    const currentSearch = searchId;
+    const extra = cursor ? {cursor: cursor} : {};
+    const rideSearchEndpoint = `/api/v1/rides?${buildQueryString(extra)}`;
+
+    loadingPage = true;
+
+    // get ride data from server (revalidating any cached copy, which
+    // the server answers with 304 Not Modified if nothing has changed)
+    fetch(rideSearchEndpoint, {cache: "no-cache"})
+        .then(response => response.json())
+        .then(data => {
+            if (currentSearch !== searchId)
+                return;
 
-    // get class data from server
-    fetch(rideSearchEndpoint)
-        .then(response => response.text())
-        .then(displayData)
-        .catch(console.error);
+            // Convert the dates within the new cards before adding
+            // them, so that earlier pages aren't converted twice
+            const page = document.createElement("template");
+            page.innerHTML = data.rides.map(renderCard).join("");
+            dateConvert($(page.content).find(".tt-date"));
+
+            const container = activeContainer();
+            if (!cursor) {
+                container.innerHTML = data.rides.length
+                    ? "" : renderEmpty();
+                rideKeys.clear();
+            }
+
+            // Live updates may have already placed some of these rides
+            data.rides.forEach(ride => {
+                const card = findCard(container, ride.id);
+                if (card)
+                    card.remove();
+            });
+            container.appendChild(page.content);
+            data.rides.forEach(ride => rideKeys.set(ride.id, sortKey(ride)));
+
+            nextCursor = data.next_cursor;
+
+            // Follow changes to the new search once it settles
+            if (!cursor) {
+                clearTimeout(streamTimer);
+                streamTimer = setTimeout(openRideStream, 1000);
+            }
+        })
+        .catch(console.error)
+        .finally(() => {
+            if (currentSearch === searchId)
+                loadingPage = false;
+        });
 }
 
+const getData = () => {
+    if (!queryData["tab"]) {
+        if (fromPrincetonTab.className.includes("active"))
+            queryData['tab'] = "from";
+        else
+            queryData['tab'] = "to";
+    }
+
+    // Updates to the previous search no longer apply
+    clearTimeout(streamTimer);
+    if (rideStream) {
+        rideStream.close();
+        rideStream = null;
+    }
+
+    // Start a new search from the first page
+    searchId += 1;
+    nextCursor = null;
+    loadPage(null);
+}
+
+// Load more results as the bottom of the list scrolls into view
+new IntersectionObserver((entries) => {
+    if (entries[0].isIntersecting && nextCursor && !loadingPage)
+        loadPage(nextCursor);
+}, {rootMargin: "400px"}).observe(
+    document.querySelector("#search-results-sentinel"));
+
 [...document.getElementsByClassName("form-control")].forEach(input => {
     input.addEventListener("input", () => {
         queryData[input.name] = input.value;
@@ -90,6 +261,91 @@ $(document).ready(function () {
 
 document.addEventListener("DOMContentLoaded", getData);
 
+/* Live updates *******************************************************/
+
+// Stream of changes to the current search's results (see
+// endpoints.ride_stream), reopened whenever the search changes
+let rideStream = null;
+let streamTimer = null;
+
+// Same order as the search results (see Ride.sort_key)
+const sortKey = (ride) =>
+    [ride.departure_datetime, ride.destination, ride.origin, ride.id];
+
+const compareKeys = (a, b) => {
+    for (let i = 0; i < a.length; i++) {
+        if (a[i] < b[i])
+            return -1;
+        if (a[i] > b[i])
+            return 1;
+    }
+    return 0;
+}
+
+const findCard = (container, rideId) =>
+    container.querySelector(`[data-ride-id="${rideId}"]`);
+
+const removeCard = (rideId) => {
+    const container = activeContainer();
+    const card = findCard(container, rideId);
+    if (card)
+        card.remove();
+    rideKeys.delete(rideId);
+
+    if (rideKeys.size === 0 && !nextCursor)
+        container.innerHTML = renderEmpty();
+}
+
+const upsertCard = (ride) => {
+    const container = activeContainer();
+    const key = sortKey(ride);
+
+    const page = document.createElement("template");
+    page.innerHTML = renderCard(ride);
+    dateConvert($(page.content).find(".tt-date"));
+    const card = page.content.firstElementChild;
+
+    const existing = findCard(container, ride.id);
+    if (existing)
+        existing.remove();
+    rideKeys.delete(ride.id);
+
+    // Place the card before the first displayed ride which sorts after
+    // it. Rides sorting after every loaded page arrive with later pages.
+    const next = [...container.querySelectorAll("[data-ride-id]")].find(
+        other => compareKeys(
+            rideKeys.get(Number(other.dataset.rideId)), key) > 0);
+    if (next)
+        container.insertBefore(card, next);
+    else if (!nextCursor)
+        container.appendChild(card);
+    else
+        return;
+
+    rideKeys.set(ride.id, key);
+    const nothing = container.querySelector(".tt-nothing");
+    if (nothing)
+        nothing.remove();
+}
+
+const openRideStream = () => {
+    if (!window.EventSource)
+        return;
+    if (rideStream)
+        rideStream.close();
+
+    rideStream = new EventSource(`/rides/stream?${buildQueryString({})}`);
+    rideStream.addEventListener("upsert", (event) => {
+        upsertCard(JSON.parse(event.data));
+    });
+    rideStream.addEventListener("remove", (event) => {
+        removeCard(JSON.parse(event.data).id);
+    });
+
+    // Changes may have been missed, so search again
+    rideStream.addEventListener("reset", getData);
+}
+
 /* Date picker input events *******************************************/
 
 const handleDateInputFocus = (input) => {
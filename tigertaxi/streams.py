@@ -0,0 +1,315 @@
+"""Server-sent event streams for TigerTaxi.
+
+The Search Rides page keeps a stream open (see endpoints.ride_stream)
+over which it receives the rides added to, changed in or removed from
+its current results, and patches its cards in place instead of running
+the search again. Likewise, the My Rides page keeps a stream open (see
+endpoints.my_rides_stream) over which it receives its cards again as
+requests are made, cancelled, accepted or rejected and riders leave,
+instead of being reloaded.
+
+Streams don't query the database. Each worker has a single RideFeed and
+MyRidesFeed, fed by the invalidation bus (see invalidation.py), which
+load every change once, for all viewers, and broadcast it. Nothing is
+loaded while no stream is open. Streams wait on the feeds and only
+filter the broadcast changes by their own search or user, so an idle
+stream costs a sleeping thread and nothing else, however many of them
+are open.
+"""
+
+# ----------------------------------------------------------------------
+
+import json
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+from typing import (
+    Any,
+    Deque,
+    Dict,
+    Hashable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+
+from tigertaxi.models import ride_departure_limit
+from tigertaxi.viewmodels import (
+    MyRidesChange,
+    RideChange,
+    load_my_rides_changes,
+    load_ride_changes,
+)
+
+# ----------------------------------------------------------------------
+
+# Broadcast when changes may have been missed, for instance after the
+# invalidation bus reconnects
+RESET = "reset"
+
+# How long browsers wait before reconnecting a closed stream, in
+# milliseconds
+RECONNECT_DELAY = 1000
+
+
+def format_event(event: str, data: Any) -> str:
+    """Returns a server-sent event with the given name and JSON data."""
+    payload = json.dumps(data, separators=(",", ":"))
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+class Broadcast:
+    """Recent events, numbered in order, which any number of streams can
+    wait on.
+
+    Only the last history events are kept. Streams which fall further
+    behind than that are told they missed some, and should resync.
+    """
+
+    def __init__(self, history: int = 256) -> None:
+        """Creates a broadcast with no events or subscribers."""
+        self._condition = threading.Condition()
+        self._events: Deque[Tuple[int, Any]] = deque(maxlen=history)
+        self._sequence = 0
+        self._viewers: Counter[int] = Counter()
+        self.subscribers = 0
+
+    def latest(self) -> int:
+        """Returns the sequence number of the latest event."""
+        with self._condition:
+            return self._sequence
+
+    def publish(self, event: Any) -> None:
+        """Adds an event and wakes every waiting stream."""
+        with self._condition:
+            self._sequence += 1
+            self._events.append((self._sequence, event))
+            self._condition.notify_all()
+
+    def wait(
+        self, after: int, timeout: float
+    ) -> Tuple[int, Optional[List[Any]]]:
+        """Waits up to timeout seconds for events published after the
+        given sequence number.
+
+        Returns the latest sequence number along with the new events
+        (empty on timeout), or None instead of the events if some of
+        them have already been dropped from the history.
+        """
+        with self._condition:
+            if self._sequence == after:
+                self._condition.wait(timeout)
+
+            missed = self._sequence - after
+            if missed > len(self._events):
+                return self._sequence, None
+            events = [
+                event
+                for sequence, event in self._events
+                if sequence > after
+            ]
+            return self._sequence, events
+
+    def subscribe(self, viewer_id: Optional[int] = None) -> None:
+        """Counts a newly opened stream, of the given viewer if any."""
+        with self._condition:
+            self.subscribers += 1
+            if viewer_id is not None:
+                self._viewers[viewer_id] += 1
+
+    def unsubscribe(self, viewer_id: Optional[int] = None) -> None:
+        """Counts a closed stream, of the given viewer if any."""
+        with self._condition:
+            self.subscribers -= 1
+            if viewer_id is not None:
+                self._viewers[viewer_id] -= 1
+                if self._viewers[viewer_id] <= 0:
+                    del self._viewers[viewer_id]
+
+    def viewers(self) -> Set[int]:
+        """Returns the ids of the viewers with a stream open."""
+        with self._condition:
+            return set(self._viewers)
+
+
+class RideFeed(Broadcast):
+    """Broadcast of changed rides, as lists of RideChange."""
+
+    def publish_changes(self, ride_ids: Optional[Set[int]]) -> None:
+        """Loads and broadcasts the given changed rides, or a reset if
+        ride_ids is None.
+
+        Called by the invalidation bus. Nothing is loaded or broadcast
+        while no stream is open, since streams only see the changes
+        published after they subscribe.
+        """
+        if self.subscribers == 0:
+            return
+        if ride_ids is None:
+            self.publish(RESET)
+        else:
+            self.publish(load_ride_changes(ride_ids))
+
+
+class MyRidesFeed(Broadcast):
+    """Broadcast of changed My Rides cards, as lists of MyRidesChange.
+
+    Cards are only rendered for the users with a stream open in this
+    worker, and nothing is loaded at all while there are none.
+    """
+
+    def publish_ride_changes(
+        self, ride_ids: Optional[Set[int]]
+    ) -> None:
+        """Loads and broadcasts the cards of the given changed rides, or
+        a reset if ride_ids is None.
+
+        Called by the invalidation bus.
+        """
+        if ride_ids is None:
+            self.publish(RESET)
+        else:
+            self._publish_changes(ride_ids, set())
+
+    def publish_request_changes(
+        self, request_ids: Optional[Set[int]]
+    ) -> None:
+        """Loads and broadcasts the cards of the rides of the given
+        changed ride requests, or a reset if request_ids is None.
+
+        Called by the invalidation bus.
+        """
+        if request_ids is None:
+            self.publish(RESET)
+        else:
+            self._publish_changes(set(), request_ids)
+
+    def _publish_changes(
+        self, ride_ids: Set[int], request_ids: Set[int]
+    ) -> None:
+        viewer_ids = self.viewers()
+        if viewer_ids:
+            self.publish(
+                load_my_rides_changes(ride_ids, request_ids, viewer_ids)
+            )
+
+
+# The feeds used by the application, registered with the invalidation
+# bus in create_app()
+ride_feed = RideFeed()
+my_rides_feed = MyRidesFeed()
+
+
+def open_streams() -> int:
+    """Returns the number of streams open in this worker, each of which
+    holds a server thread."""
+    return ride_feed.subscribers + my_rides_feed.subscribers
+
+
+def ride_search_events(
+    viewer_id: int,
+    tab: Optional[str],
+    term: Optional[str],
+    window: Optional[Tuple[datetime, datetime]],
+    ride_ids: Set[int],
+    max_age: float,
+    keepalive: float,
+) -> Iterator[str]:
+    """Yields the events of a live ride search for the given viewer and
+    filters (see Ride.search_page) for max_age seconds.
+
+    ride_ids are the rides matching the search when the stream is
+    opened. An "upsert" event carries a ride matching the search, as the
+    JSON search API would return it, and a "remove" event the id of a
+    ride which matched it but no longer does. Changes to rides which
+    neither match nor matched the search are not sent. A "reset" event
+    means the results should be searched again. Comments are sent every
+    keepalive seconds without changes, so that idle connections aren't
+    dropped.
+    """
+    matching = set(ride_ids)
+    ride_feed.subscribe()
+    try:
+        cursor = ride_feed.latest()
+        deadline = time.monotonic() + max_age
+        yield f"retry: {RECONNECT_DELAY}\n\n"
+
+        while time.monotonic() < deadline:
+            cursor, events = ride_feed.wait(cursor, keepalive)
+            if events is None or RESET in events:
+                yield format_event("reset", {})
+                continue
+            if len(events) == 0:
+                yield ": keepalive\n\n"
+                continue
+
+            # Only the latest change to each ride matters
+            changes: Dict[int, RideChange] = {}
+            for batch in events:
+                for change in batch:
+                    changes[change.ride_id] = change
+
+            limit = ride_departure_limit()
+            for change in changes.values():
+                if change.entry is not None and change.entry.matches(
+                    limit, tab, term, window
+                ):
+                    matching.add(change.ride_id)
+                    yield format_event(
+                        "upsert", change.to_json_for(viewer_id)
+                    )
+                elif change.ride_id in matching:
+                    matching.discard(change.ride_id)
+                    yield format_event("remove", {"id": change.ride_id})
+    finally:
+        ride_feed.unsubscribe()
+
+
+def my_rides_events(
+    viewer_id: int, max_age: float, keepalive: float
+) -> Iterator[str]:
+    """Yields the events of the given viewer's live My Rides page for
+    max_age seconds.
+
+    An "upsert" event carries a card to show in place of the one with
+    the same id, if any, and a "remove" event the id of a card (or of a
+    ride, all of whose cards) to remove (see viewmodels.MyRidesChange).
+    A "reset" event means the page should be loaded again. Comments are
+    sent every keepalive seconds without changes, so that idle
+    connections aren't dropped.
+    """
+    my_rides_feed.subscribe(viewer_id)
+    try:
+        cursor = my_rides_feed.latest()
+        deadline = time.monotonic() + max_age
+        yield f"retry: {RECONNECT_DELAY}\n\n"
+
+        # Most changes concern other users, so keep track of when
+        # anything was last sent rather than waiting for a quiet spell
+        last_sent = time.monotonic()
+        while time.monotonic() < deadline:
+            cursor, events = my_rides_feed.wait(cursor, keepalive)
+            if events is None or RESET in events:
+                yield format_event("reset", {})
+                last_sent = time.monotonic()
+                continue
+
+            # Only the latest change to each card matters
+            changes: Dict[Hashable, MyRidesChange] = {}
+            for batch in events:
+                for change in batch:
+                    if change.user_id in (None, viewer_id):
+                        changes[change.key()] = change
+
+            if changes:
+                for change in changes.values():
+                    yield format_event(change.event, change.data)
+                last_sent = time.monotonic()
+            elif time.monotonic() - last_sent >= keepalive:
+                yield ": keepalive\n\n"
+                last_sent = time.monotonic()
+    finally:
+        my_rides_feed.unsubscribe(viewer_id)
@@ -0,0 +1,97 @@
+"""Unit of work handling for TigerTaxi.
+
+By default, AbstractModel.save() and remove() commit straight away.
+Within a unit of work they only stage their changes in the session
+instead, and everything staged is committed together when the unit of
+work ends, with one round trip and one fsync for the whole request.
+
+Scripts start a unit of work with the transaction() context manager.
+When UNIT_OF_WORK_PER_REQUEST is enabled, every request runs inside
+one, which is committed once the view has returned a successful
+response and rolled back otherwise.
+"""
+
+# ----------------------------------------------------------------------
+
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from flask import Flask, Response
+
+from tigertaxi.extensions import db
+
+# ----------------------------------------------------------------------
+
+# Key of the unit of work nesting depth in the session's info
+DEPTH_KEY = "unit_of_work_depth"
+
+
+def in_unit_of_work() -> bool:
+    """Returns whether changes are currently being deferred to the end
+    of a unit of work."""
+    depth: int = db.session.info.get(DEPTH_KEY, 0)
+    return depth > 0
+
+
+def commit() -> None:
+    """Commits the session, unless a unit of work is active, in which
+    case the changes are left for it to commit."""
+    if not in_unit_of_work():
+        db.session.commit()
+
+
+@contextmanager
+def transaction() -> Iterator[None]:
+    """Runs the enclosed block as a unit of work.
+
+    Changes made in the block are committed together when it exits, or
+    rolled back if it raises. Nested blocks join the outermost unit of
+    work, which is the only one to commit.
+    """
+    info = db.session.info
+    info[DEPTH_KEY] = info.get(DEPTH_KEY, 0) + 1
+    try:
+        yield
+    except BaseException:
+        info[DEPTH_KEY] -= 1
+        if info[DEPTH_KEY] == 0:
+            db.session.rollback()
+        raise
+    else:
+        info[DEPTH_KEY] -= 1
+        if info[DEPTH_KEY] == 0:
+            db.session.commit()
+
+
+def begin_request() -> None:
+    """Starts the unit of work for the current request."""
+    db.session.info[DEPTH_KEY] = 1
+
+
+def commit_request(response: Response) -> Response:
+    """Commits the request's unit of work if the response was
+    successful, and rolls it back otherwise.
+
+    Runs before the response is sent, so a failed commit is reported as
+    an error rather than silently losing the changes.
+    """
+    if db.session.info.pop(DEPTH_KEY, 0) > 0:
+        if response.status_code < 400:
+            db.session.commit()
+        else:
+            db.session.rollback()
+    return response
+
+
+def end_request(error: Optional[BaseException]) -> None:
+    """Discards the request's unit of work if the view raised."""
+    if db.session.info.pop(DEPTH_KEY, 0) > 0:
+        db.session.rollback()
+
+
+def init_app(app: Flask) -> None:
+    """Runs every request of the app in a unit of work, if enabled."""
+    if app.config["UNIT_OF_WORK_PER_REQUEST"]:
+        app.before_request(begin_request)
+        app.after_request(commit_request)
+        app.teardown_request(end_request)
@@ -0,0 +1,645 @@
+"""View models for TigerTaxi.
+
+Pages which display many rides at once load everything they need about
+those rides up front, in a fixed number of queries, and hand plain
+objects to their templates. Templates should read the precomputed fields
+defined here instead of calling query methods on the models.
+"""
+
+# ----------------------------------------------------------------------
+
+import base64
+import enum
+import hashlib
+import json
+from datetime import datetime
+from typing import (
+    Any,
+    Dict,
+    Hashable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+
+from flask import render_template
+from sqlalchemy import func, select
+from sqlalchemy.orm import contains_eager, joinedload, selectinload
+
+from tigertaxi.extensions import db
+from tigertaxi.models import (
+    ArchivedRide,
+    ArchivedRider,
+    Ride,
+    Rider,
+    RideRequest,
+    User,
+    ride_departure_limit,
+)
+from tigertaxi.search_index import RideEntry
+
+# ----------------------------------------------------------------------
+
+
+class RideSearchResult:
+    """A ride as displayed on the Search Rides page.
+
+    Holds the ride itself along with its creator, its current number of
+    riders, and the relationship between the ride and the user viewing
+    the search results.
+    """
+
+    class ViewerStatus(enum.Enum):
+        """How the viewer is involved with the ride."""
+
+        CREATOR = "creator"
+        RIDER = "rider"
+        PENDING = "pending"
+        REJECTED = "rejected"
+        FULL = "full"
+        OPEN = "open"
+
+    def __init__(
+        self,
+        ride: Ride,
+        riders_count: int,
+        viewer_status: "RideSearchResult.ViewerStatus",
+    ) -> None:
+        """Creates a search result for the given ride."""
+        self.ride = ride
+        self.creator = ride.creator
+        self.riders_count = riders_count
+        self.viewer_status = viewer_status
+
+    @classmethod
+    def viewer_status_for(
+        cls,
+        ride: Ride,
+        viewer_id: int,
+        riders_count: int,
+        joined: bool,
+        request_statuses: Set[int],
+    ) -> "RideSearchResult.ViewerStatus":
+        """Returns the status for a ride of the viewer with the given
+        id, given whether they are one of its riders and the statuses of
+        their requests for it."""
+        # Precedence matches the order of checks previously made in
+        # elements/ride_search_cards.html
+        if ride.creator_id == viewer_id:
+            return cls.ViewerStatus.CREATOR
+        if joined:
+            return cls.ViewerStatus.RIDER
+        if RideRequest.Status.PENDING.value in request_statuses:
+            return cls.ViewerStatus.PENDING
+        if RideRequest.Status.REJECTED.value in request_statuses:
+            return cls.ViewerStatus.REJECTED
+        if riders_count >= ride.capacity:
+            return cls.ViewerStatus.FULL
+        return cls.ViewerStatus.OPEN
+
+    def can_request(self) -> bool:
+        """Returns whether the viewer is able to request the ride."""
+        return self.viewer_status == self.ViewerStatus.OPEN
+
+    def to_json(self) -> Dict[str, Any]:
+        """Returns the compact projection of the result used by the JSON
+        search API."""
+        ride = self.ride
+        creator = None
+        if not ride.is_anonymous:
+            creator = {
+                "disp_name": self.creator.disp_name,
+                "netid": self.creator.netid,
+            }
+
+        return {
+            "id": ride.id,
+            "origin": ride.origin,
+            "destination": ride.destination,
+            "departure_datetime": ride.departure_datetime.isoformat(),
+            "capacity": ride.capacity,
+            "riders_count": self.riders_count,
+            "notes": ride.notes,
+            "creator": creator,
+            "viewer_status": self.viewer_status.value,
+        }
+
+    def __repr__(self) -> str:
+        """Returns a string representation of the search result."""
+        return "<RideSearchResult {} [{}]>".format(
+            self.ride.id, self.viewer_status.value
+        )
+
+
+def load_search_results(
+    rides: List[Ride], viewer: User
+) -> List[RideSearchResult]:
+    """Builds search results for the given rides as seen by the viewer.
+
+    The viewer's riders and ride requests are fetched with one query
+    each, regardless of the number of rides, so the whole page is
+    rendered in a constant number of round trips. Ride creators are
+    expected to be loaded with the rides (see Ride.search_page), and
+    rider counts are read from the rides themselves.
+    """
+    if len(rides) == 0:
+        return []
+
+    ride_ids = [ride.id for ride in rides]
+
+    # Rides the viewer is already part of
+    joined: Set[int] = {
+        ride_id
+        for (ride_id,) in db.session.query(Rider.ride_id).where(
+            Rider.ride_id.in_(ride_ids), Rider.user_id == viewer.id
+        )
+    }
+
+    # Statuses of the viewer's requests for each ride
+    statuses: Dict[int, Set[Any]] = {}
+    for ride_id, status in db.session.query(
+        RideRequest.ride_id, RideRequest.status
+    ).where(
+        RideRequest.ride_id.in_(ride_ids),
+        RideRequest.user_id == viewer.id,
+    ):
+        statuses.setdefault(ride_id, set()).add(status)
+
+    results = []
+    for ride in rides:
+        riders_count = ride.riders_count
+        status = RideSearchResult.viewer_status_for(
+            ride,
+            viewer.id,
+            riders_count,
+            ride.id in joined,
+            statuses.get(ride.id, set()),
+        )
+        results.append(RideSearchResult(ride, riders_count, status))
+
+    return results
+
+
+class RideChange:
+    """A ride as it is after being changed, with everything needed to
+    show it to any viewer in live search results (see streams.py).
+
+    ride is None once the ride has been deleted or has departed.
+    """
+
+    def __init__(
+        self,
+        ride_id: int,
+        ride: Optional[Ride],
+        rider_ids: Set[int],
+        request_statuses: Dict[int, Set[int]],
+    ) -> None:
+        """Creates a change from a ride whose creator has already been
+        loaded, the user ids of its riders, and the statuses of each
+        user's requests for it."""
+        self.ride_id = ride_id
+        self.ride = ride
+        self.entry = None if ride is None else RideEntry.from_ride(ride)
+        self.rider_ids = rider_ids
+        self.request_statuses = request_statuses
+        self._json: Dict[str, Dict[str, Any]] = {}
+
+    def to_json_for(self, viewer_id: int) -> Dict[str, Any]:
+        """Returns the ride as the JSON search API would show it to the
+        viewer with the given id."""
+        assert self.ride is not None
+        status = RideSearchResult.viewer_status_for(
+            self.ride,
+            viewer_id,
+            self.ride.riders_count,
+            viewer_id in self.rider_ids,
+            self.request_statuses.get(viewer_id, set()),
+        )
+
+        # Viewers only differ by their status, so most of them share
+        # the same few projections
+        projection = self._json.get(status.value)
+        if projection is None:
+            result = RideSearchResult(
+                self.ride, self.ride.riders_count, status
+            )
+            projection = self._json[status.value] = result.to_json()
+        return projection
+
+
+def load_ride_changes(ride_ids: Set[int]) -> List[RideChange]:
+    """Loads the given rides after they have changed, for every viewer
+    at once.
+
+    Takes three queries no matter how many rides changed. Rides which no
+    longer exist or have departed are returned without a ride.
+    """
+    rides = {
+        ride.id: ride
+        for ride in Ride.query.where(
+            Ride.id.in_(ride_ids),
+            Ride.departure_datetime >= ride_departure_limit(),
+        ).options(joinedload(Ride.creator))
+    }
+
+    rider_ids: Dict[int, Set[int]] = {}
+    for ride_id, user_id in db.session.query(
+        Rider.ride_id, Rider.user_id
+    ).where(Rider.ride_id.in_(rides)):
+        rider_ids.setdefault(ride_id, set()).add(user_id)
+
+    statuses: Dict[int, Dict[int, Set[int]]] = {}
+    for ride_id, user_id, status in db.session.query(
+        RideRequest.ride_id, RideRequest.user_id, RideRequest.status
+    ).where(RideRequest.ride_id.in_(rides)):
+        statuses.setdefault(ride_id, {}).setdefault(user_id, set()).add(
+            status
+        )
+
+    return [
+        RideChange(
+            ride_id,
+            rides.get(ride_id),
+            rider_ids.get(ride_id, set()),
+            statuses.get(ride_id, {}),
+        )
+        for ride_id in sorted(ride_ids)
+    ]
+
+
+class CreatedRide:
+    """A ride as displayed in the Created Rides tab of the My Rides
+    page."""
+
+    def __init__(self, ride: Ride) -> None:
+        """Creates a view of a ride whose riders and requests (along
+        with their users) have already been loaded."""
+        self.ride = ride
+        self.riders = ride.riders
+        self.pending_requests = [
+            ride_request
+            for ride_request in ride.requests
+            if ride_request.is_pending()
+        ]
+
+
+class MyRides:
+    """Everything displayed on the My Rides page for a single user."""
+
+    def __init__(
+        self,
+        created: List[CreatedRide],
+        accepted: List[RideRequest],
+        pending: List[RideRequest],
+        rejected: List[RideRequest],
+    ) -> None:
+        """Creates the My Rides view from its four tabs."""
+        self.created = created
+        self.accepted = accepted
+        self.pending = pending
+        self.rejected = rejected
+
+
+def load_my_rides(user: User) -> MyRides:
+    """Loads the My Rides page for the given user.
+
+    Every ride, rider, request and user shown on the page is loaded
+    eagerly, so the page takes a fixed number of queries no matter how
+    many rides the user has created or requested, and myrides.html never
+    triggers lazy loads.
+    """
+    created = (
+        Ride.query.where(
+            Ride.creator_id == user.id,
+            Ride.departure_datetime >= ride_departure_limit(),
+        )
+        .order_by(Ride.departure_datetime.asc())
+        .options(
+            selectinload(Ride.riders).joinedload(Rider.user),
+            selectinload(Ride.requests).joinedload(RideRequest.user),
+        )
+        .all()
+    )
+
+    # Outbound requests already join their rides, so reuse that join
+    # to load them
+    outbound_options = [
+        contains_eager(RideRequest.ride).joinedload(Ride.creator),
+        contains_eager(RideRequest.ride)
+        .selectinload(Ride.riders)
+        .joinedload(Rider.user),
+    ]
+
+    # Fetch every tab's requests at once, then split them by status
+    outbox = RideRequest.partition(
+        user.query_outbound_requests().options(*outbound_options),
+        RideRequest.BOX_STATUSES,
+    )
+
+    return MyRides(
+        created=[CreatedRide(ride) for ride in created],
+        accepted=outbox["accepted"],
+        pending=outbox["pending"],
+        rejected=outbox["rejected"],
+    )
+
+
+class MyRidesChange:
+    """A change to the cards on a user's My Rides page, sent by its live
+    stream (see streams.py).
+
+    An "upsert" replaces or adds a card, rendered as the page renders
+    it, in the given tab. A "remove" removes a card by its element id,
+    or every card of a ride which no longer exists or has departed.
+    Changes without a user_id are sent to every user, for cards whose
+    owner can no longer be looked up.
+    """
+
+    def __init__(
+        self, user_id: Optional[int], event: str, data: Dict[str, Any]
+    ) -> None:
+        """Creates a change to the given user's page."""
+        self.user_id = user_id
+        self.event = event
+        self.data = data
+
+    @classmethod
+    def upsert(
+        cls, user_id: int, tab: str, card_id: str, ride: Ride, html: str
+    ) -> "MyRidesChange":
+        """Returns a change showing the given card of a ride."""
+        return cls(
+            user_id,
+            "upsert",
+            {
+                "id": card_id,
+                "ride_id": ride.id,
+                "tab": tab,
+                "departure": ride.departure_datetime.isoformat(),
+                "html": html,
+            },
+        )
+
+    @classmethod
+    def remove(
+        cls, user_id: Optional[int], card_id: str
+    ) -> "MyRidesChange":
+        """Returns a change removing the card with the given id."""
+        return cls(user_id, "remove", {"id": card_id})
+
+    @classmethod
+    def remove_ride(cls, ride_id: int) -> "MyRidesChange":
+        """Returns a change removing every card of the given ride."""
+        return cls(None, "remove", {"ride_id": ride_id})
+
+    def key(self) -> Hashable:
+        """Returns what the change applies to, so that only the latest
+        change to each card needs to be sent."""
+        return self.data.get("id") or ("ride", self.data["ride_id"])
+
+
+def load_my_rides_changes(
+    ride_ids: Set[int], request_ids: Set[int], viewer_ids: Set[int]
+) -> List[MyRidesChange]:
+    """Loads the My Rides cards affected by changes to the given rides
+    and ride requests, for the users with the given ids.
+
+    A changed ride's card is rendered again for its creator, along with
+    the cards of its requesters' own requests, which show its riders.
+    Takes at most four queries, no matter how many rides changed or
+    cards are rendered.
+    """
+    changes: List[MyRidesChange] = []
+    ride_ids = set(ride_ids)
+    if request_ids:
+        found = set()
+        for request_id, ride_id in db.session.query(
+            RideRequest.id, RideRequest.ride_id
+        ).where(RideRequest.id.in_(request_ids)):
+            found.add(request_id)
+            ride_ids.add(ride_id)
+        # Deleted along with a rider leaving or being removed
+        changes.extend(
+            MyRidesChange.remove(None, f"ride-request-{request_id}")
+            for request_id in sorted(request_ids - found)
+        )
+    if not ride_ids:
+        return changes
+
+    rides = {
+        ride.id: ride
+        for ride in Ride.query.where(
+            Ride.id.in_(ride_ids),
+            Ride.departure_datetime >= ride_departure_limit(),
+        ).options(
+            joinedload(Ride.creator),
+            selectinload(Ride.riders).joinedload(Rider.user),
+            selectinload(Ride.requests).joinedload(RideRequest.user),
+        )
+    }
+    tabs = {
+        status.value: status.name.lower()
+        for status in RideRequest.BOX_STATUSES
+    }
+
+    # Element ids match those given to the cards by their templates
+    for ride_id in sorted(ride_ids):
+        ride = rides.get(ride_id)
+        if ride is None:
+            changes.append(MyRidesChange.remove_ride(ride_id))
+            continue
+
+        if ride.creator_id in viewer_ids:
+            html = render_template(
+                "elements/created_ride_card.html",
+                created_ride=CreatedRide(ride),
+                netid=ride.creator.netid,
+            )
+            changes.append(
+                MyRidesChange.upsert(
+                    ride.creator_id,
+                    "created",
+                    f"created-ride-{ride.id}",
+                    ride,
+                    html,
+                )
+            )
+
+        for ride_request in ride.requests:
+            user_id = ride_request.user_id
+            if user_id not in viewer_ids:
+                continue
+            card_id = f"ride-request-{ride_request.id}"
+            tab = tabs.get(ride_request.status)
+            if tab is None:
+                # Cancelled, so removed if that's what changed
+                if ride_request.id in request_ids:
+                    changes.append(
+                        MyRidesChange.remove(user_id, card_id)
+                    )
+                continue
+            html = render_template(
+                "elements/ride_request_card.html",
+                ride_req=ride_request,
+                netid=ride_request.user.netid,
+            )
+            changes.append(
+                MyRidesChange.upsert(user_id, tab, card_id, ride, html)
+            )
+
+    return changes
+
+
+# Number of past rides shown on the Ride History page
+RIDE_HISTORY_LIMIT = 100
+
+
+class PastRide:
+    """A ride as displayed on the Ride History page, whether it is still
+    in the rides table or has been archived."""
+
+    def __init__(
+        self, ride: Union[Ride, ArchivedRide], viewer: User
+    ) -> None:
+        """Creates a view of a past ride whose creator and riders (along
+        with their users) have already been loaded."""
+        self.ride = ride
+        self.creator = ride.creator
+        self.riders = ride.riders
+        self.is_creator = ride.creator_id == viewer.id
+        self.is_archived = isinstance(ride, ArchivedRide)
+
+
+def load_ride_history(
+    user: User, limit: int = RIDE_HISTORY_LIMIT
+) -> List[PastRide]:
+    """Loads the most recent rides the given user has created or ridden
+    in, and which have already departed, most recent first.
+
+    Rides are read from the rides table first, and only if there are
+    fewer than limit of them from the archive, which only holds rides
+    that departed before any still in the rides table.
+    """
+    recent = (
+        Ride.query.where(
+            Ride.departure_datetime < ride_departure_limit(),
+            Ride.id.in_(
+                select(Rider.ride_id).where(Rider.user_id == user.id)
+            ),
+        )
+        .order_by(Ride.departure_datetime.desc())
+        .limit(limit)
+        .options(
+            joinedload(Ride.creator),
+            selectinload(Ride.riders).joinedload(Rider.user),
+        )
+        .all()
+    )
+    history = [PastRide(ride, user) for ride in recent]
+    if len(history) >= limit:
+        return history
+
+    archived = (
+        ArchivedRide.query.where(
+            ArchivedRide.id.in_(
+                select(ArchivedRider.ride_id).where(
+                    ArchivedRider.user_id == user.id
+                )
+            ),
+        )
+        .order_by(ArchivedRide.departure_datetime.desc())
+        .limit(limit - len(history))
+        .options(
+            joinedload(ArchivedRide.creator),
+            selectinload(ArchivedRide.riders).joinedload(
+                ArchivedRider.user
+            ),
+        )
+        .all()
+    )
+    history.extend(PastRide(ride, user) for ride in archived)
+    return history
+
+
+def encode_cursor(ride: Ride) -> str:
+    """Returns an opaque pagination cursor pointing just after the given
+    ride in search result order."""
+    departure, destination, origin, ride_id = ride.sort_key()
+    key = [departure.isoformat(), destination, origin, ride_id]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str, str, int]:
+    """Returns the ride sort key encoded in the given cursor.
+
+    Raises a ValueError if the cursor is malformed.
+    """
+    try:
+        departure, destination, origin, ride_id = json.loads(
+            base64.urlsafe_b64decode(cursor.encode())
+        )
+        return (
+            datetime.fromisoformat(departure),
+            str(destination),
+            str(origin),
+            int(ride_id),
+        )
+    except (TypeError, ValueError) as error:
+        raise ValueError("Invalid cursor") from error
+
+
+def search_etag(viewer: User, ride_ids: List[int], limit: int) -> str:
+    """Returns an ETag for a page of search results for the viewer,
+    given the ids of the rides on it (see Ride.search_ids) and the page
+    size they were fetched for.
+
+    The ids come from the same place as the results themselves (the in-
+    process index or the database), so the tag changes whenever rides
+    enter or leave the page. Changes to the rides shown are tracked with
+    the indexed updated_at columns of the rides (which also change along
+    with their riders_count), their creators, and the viewer's riders
+    and requests for them, plus row counts to catch deletions. Only rows
+    belonging to the page are read, with a single query.
+    """
+    stamps: Tuple[Any, ...] = ()
+    if len(ride_ids) > 0:
+        on_page = Ride.id.in_(ride_ids)
+        page_rows: List[Tuple[Any, List[Any]]] = [
+            (Ride, [on_page]),
+            (
+                User,
+                [User.id.in_(select(Ride.creator_id).where(on_page))],
+            ),
+            (
+                Rider,
+                [
+                    Rider.ride_id.in_(ride_ids),
+                    Rider.user_id == viewer.id,
+                ],
+            ),
+            (
+                RideRequest,
+                [
+                    RideRequest.ride_id.in_(ride_ids),
+                    RideRequest.user_id == viewer.id,
+                ],
+            ),
+        ]
+        columns = []
+        for model, conditions in page_rows:
+            columns.append(
+                select(func.max(model.updated_at))
+                .where(*conditions)
+                .scalar_subquery()
+            )
+            columns.append(
+                select(func.count(model.id))
+                .where(*conditions)
+                .scalar_subquery()
+            )
+        stamps = tuple(db.session.query(*columns).one())
+
+    version = repr((ride_ids, limit, stamps, viewer.id))
+    return hashlib.sha1(version.encode()).hexdigest()